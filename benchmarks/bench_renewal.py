@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""\
+Usage: bench_renewal.py [options] [benchmark...]
+Benchmark the certbot-to-acm hot paths against moto (an in-process stand-in for S3, ACM, SSM, and Route 53) and, for
+end-to-end renewals, a local Pebble ACME server. The benchmarks are:
+
+    archive         create_config_tarfile: build the config archive of each lineage.
+    download        download_certbot_config: extract the stored config archive of each lineage from S3.
+    acm-lookup      find_existing_certificate: find each certificate in ACM by domain with a cold index.
+    acm-lookup-warm find_existing_certificate: the same with the index already built.
+    renewal         lambda_handler: force-renew every certificate as one batch event.
+
+All of them run by default, except renewal, which needs a Pebble server (see --pebble-url). Every benchmark but archive
+needs moto (pip install -r requirements-dev.txt). Each benchmark prints a JSON line with its parameters and, per run, the
+wall time, AWS API calls, bytes written (nearly all of them to /tmp), and peak RSS.
+
+Options:
+    -c <n> | --certificates=<n>
+        Number of certificates (lineages) to generate. Defaults to 10.
+    -s <n> | --sans=<n>
+        Names per certificate. Defaults to 5.
+    -d <n> | --history=<n>
+        Archived versions per lineage. Defaults to 3.
+    -k <kib> | --archive-kb=<kib>
+        Incompressible data stored with each lineage, to scale the archive size independently of the history depth.
+        Defaults to 0.
+    -z <compression> | --compression=<compression>
+        Config archive compression: gzip or zstd (which needs the zstandard package). Defaults to gzip.
+    -l <level> | --compression-level=<level>
+        Config archive compression level. Defaults to the compression's default.
+    -f <format> | --config-store-format=<format>
+        Config store format used by the renewal benchmark: tar, incremental, or file (a file:// store in a local directory,
+        renewed in place). Defaults to tar.
+    -e <engine> | --acme-engine=<engine>
+        ACME engine used by the renewal benchmark: native or certbot. Defaults to native.
+    -p <url> | --pebble-url=<url>
+        Directory URL of the Pebble server, e.g. https://localhost:14000/dir. Defaults to $PEBBLE_DIRECTORY.
+    -r <n> | --repeat=<n>
+        Number of timed runs of each benchmark. Defaults to 3.
+    -h | --help
+        Show this usage information.
+
+Pebble must be started with PEBBLE_VA_ALWAYS_VALID=1, since the DNS challenges are published in moto's Route 53 where
+Pebble can't see them, and REQUESTS_CA_BUNDLE must point at Pebble's test CA (test/certs/pebble.minica.pem).
+
+Peak RSS is reset before each benchmark on Linux; elsewhere it is the peak of the whole process so far.
+"""
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timedelta
+from getopt import getopt, GetoptError
+from io import StringIO
+from json import dumps as json_dumps
+from os import environ, makedirs, unlink, urandom
+from os.path import abspath, dirname, lexists
+from resource import getrusage, RUSAGE_SELF
+from statistics import median
+from sys import argv, exit as sys_exit, path as sys_path, stderr, stdout
+from tempfile import mkdtemp, TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+sys_path.insert(0, dirname(dirname(abspath(__file__))))
+import index  # noqa: E402
+
+BENCHMARKS = ("archive", "download", "acm-lookup", "acm-lookup-warm", "renewal")
+BUCKET = "certbot-to-acm-bench"
+ZONE = "bench.example.com"
+ACCOUNT_ID = "0" * 32
+KEY_SPEC = index.KeySpec(key_type="rsa", rsa_key_size=2048, elliptic_curve=index.DEFAULT_ELLIPTIC_CURVE)
+
+
+class Lineage(NamedTuple):
+    name: str
+    domains: List[str]
+    config_dir: str
+
+
+class Measurement:
+    """
+    Wall time, AWS API calls, bytes written, and peak RSS of the timed runs of one benchmark.
+    """
+
+    def __init__(self, name: str, params: Dict[str, Any]) -> None:
+        self.name = name
+        self.params = params
+        self.wall_ms: List[float] = []
+        self.api_calls: Dict[str, int] = {}
+        self.bytes_written = 0
+        reset_peak_rss()
+
+    def run(self, call: Callable[[], Any]) -> Any:
+        """
+        Time one run of the benchmark. Output printed by the code under test is discarded.
+        """
+        metrics = index.RenewalMetrics()
+        written = bytes_written()
+        start = perf_counter()
+        with metrics, redirect_stdout(StringIO()):
+            result = call()
+        self.wall_ms.append(round((perf_counter() - start) * 1000, 1))
+
+        self.bytes_written += bytes_written() - written
+        self.add_api_calls(metrics.summary()["api-calls"])
+        return result
+
+    def add_api_calls(self, api_calls: Dict[str, int]) -> None:
+        """
+        Add API calls counted by metrics other than the run's own (i.e., by the renewals of a batch).
+        """
+        for operation, count in api_calls.items():
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + count
+
+    def report(self, **extra: Any) -> None:
+        """
+        Print the per-run figures as a JSON line, with any extra fields.
+        """
+        runs = len(self.wall_ms)
+        print(json_dumps({
+            "benchmark": self.name,
+            **self.params,
+            "runs": runs,
+            "wall-ms": {"min": min(self.wall_ms), "median": median(self.wall_ms), "max": max(self.wall_ms)},
+            "api-calls": round(sum(self.api_calls.values()) / runs, 1),
+            "api-calls-by-operation": {operation: round(count / runs, 1) for operation, count in sorted(self.api_calls.items())},
+            "bytes-written": self.bytes_written // runs,
+            "peak-rss-kb": peak_rss_kb(),
+            **extra,
+        }), flush=True)
+
+
+def bytes_written() -> int:
+    """
+    Return the bytes this process has written so far (to files, pipes, etc.), or 0 if the platform doesn't say.
+    """
+    try:
+        with open("/proc/self/io", "r") as fd:
+            for line in fd:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the process's peak RSS to its current RSS (Linux only).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_kb() -> int:
+    """
+    Return the peak RSS of the process since it was last reset, in KiB.
+    """
+    try:
+        with open("/proc/self/status", "r") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return getrusage(RUSAGE_SELF).ru_maxrss
+
+
+def make_ca() -> Tuple[Any, Any]:
+    """
+    Return the key and certificate of a throwaway CA for the generated certificates.
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "certbot-to-acm benchmark CA")])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=365)).add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+        .sign(key, hashes.SHA256()))
+    return key, cert
+
+
+def make_certificate(ca: Any, domains: List[str]) -> index.CertbotCertificate:
+    """
+    Issue a certificate for the domains from the throwaway CA, due for renewal like one certbot has held for 60 days.
+    """
+    ca_key, ca_cert = ca
+    private_key = index.generate_private_key(KEY_SPEC)
+    key = serialization.load_pem_private_key(private_key, password=None)
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder().subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])]))
+        .issuer_name(ca_cert.subject).public_key(key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=60)).not_valid_after(now + timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain) for domain in domains]), critical=False)
+        .sign(ca_key, hashes.SHA256()))
+
+    certificate = cert.public_bytes(serialization.Encoding.PEM)
+    chain = ca_cert.public_bytes(serialization.Encoding.PEM)
+    return index.CertbotCertificate(
+        certificate=certificate, chain=chain, full_chain=certificate + chain, private_key=private_key)
+
+
+def config_store_fields(root: str, lineage: Lineage, config_store_format: str) -> Dict[str, Any]:
+    """
+    Return the config-store-url and config-store-format fields for the lineage's config store in the given format.
+    """
+    if config_store_format == "file":
+        return {"config-store-url": f"file://{root}/store/{lineage.name}"}
+
+    return {
+        "config-store-url": f"s3://{BUCKET}/{lineage.name}.{'json' if config_store_format == 'incremental' else 'tar.gz'}",
+        "config-store-format": config_store_format}
+
+
+def setup(root: str, certificates: int, sans: int, history: int, archive_kb: int, endpoint: str,
+          config_store_format: str, store_options: Dict[str, Any], aws: bool) -> List[Lineage]:
+    """
+    Generate the certbot config directory of each lineage and, if aws is set, store it in S3 (always as a tar archive for
+    the download benchmark, and in the renewal benchmark's format) and import its live certificate into ACM.
+    """
+    if aws:
+        index.get_client("s3").create_bucket(Bucket=BUCKET)
+        index.get_client("route53").create_hosted_zone(Name=f"{ZONE}.", CallerReference=ZONE)
+
+    ca = make_ca()
+    lineages = []
+    for i in range(certificates):
+        name = f"cert{i}.{ZONE}"
+        lineage = Lineage(
+            name=name, domains=[name] + [f"san{j}.{name}" for j in range(1, sans)], config_dir=f"{root}/config/{name}")
+
+        for _ in range(history):
+            cert = make_certificate(ca, lineage.domains)
+            index.install_lineage_version(lineage.config_dir, name, cert, ACCOUNT_ID, endpoint, KEY_SPEC)
+
+        if archive_kb:
+            with open(f"{lineage.config_dir}/archive/{name}/padding.bin", "wb") as fd:
+                fd.write(urandom(archive_kb * 1024))
+
+        lineages.append(lineage)
+        if not aws:
+            continue
+
+        work_dir = mkdtemp(dir=root)
+        with redirect_stdout(StringIO()):
+            for store_format in sorted({"tar", config_store_format}):
+                errors: List[str] = []
+                store = index.config_store_from_event(
+                    {**config_store_fields(root, lineage, store_format), **store_options}, errors)
+                assert store is not None, errors
+                store.save(lineage.config_dir, work_dir)
+
+        index.get_client("acm").import_certificate(
+            Certificate=cert.certificate, PrivateKey=cert.private_key, CertificateChain=cert.chain)
+
+    return lineages
+
+
+def bench_archive(
+        measurement: Measurement, lineages: List[Lineage], root: str, compression: str, level: Optional[int], repeat: int
+) -> None:
+    work_dir = mkdtemp(dir=root)
+
+    def run() -> None:
+        for lineage in lineages:
+            index.create_config_tarfile(lineage.config_dir, f"{work_dir}/{lineage.name}.tar", compression, level)
+
+    for _ in range(repeat):
+        measurement.run(run)
+
+    measurement.report()
+
+
+def bench_download(measurement: Measurement, lineages: List[Lineage], root: str, repeat: int) -> None:
+    config_dir = mkdtemp(dir=root)
+
+    def run() -> None:
+        for lineage in lineages:
+            index.download_certbot_config(BUCKET, f"{lineage.name}.tar.gz", config_dir)
+
+    for _ in range(repeat):
+        measurement.run(run)
+
+    measurement.report()
+
+
+def bench_acm_lookup(measurement: Measurement, lineages: List[Lineage], warm: bool, repeat: int) -> None:
+    def run() -> None:
+        if not warm:
+            index.acm_index = index.AcmCertificateIndex()
+
+        for lineage in lineages:
+            if index.find_existing_certificate(None, {"domain": lineage.name}) is None:
+                raise ValueError(f"Certificate for {lineage.name} not found")
+
+    if warm:
+        run()
+
+    for _ in range(repeat):
+        measurement.run(run)
+
+    measurement.report()
+
+
+def bench_renewal(measurement: Measurement, lineages: List[Lineage], root: str, history: int, endpoint: str,
+                  acme_engine: str, config_store_format: str, store_options: Dict[str, Any], repeat: int) -> None:
+    event = {
+        "certificates": [
+            {
+                "domains": lineage.domains,
+                **config_store_fields(root, lineage, config_store_format),
+                "acm-certificate-filters": {"domain": lineage.name},
+                "ssm-parameter-prefix": f"/certbot-to-acm-bench/{lineage.name}",
+            } for lineage in lineages],
+        "max-workers": index.DEFAULT_BATCH_MAX_WORKERS,
+        "acme-engine": acme_engine,
+        "agree-tos": True,
+        "archive-keep-versions": history,
+        **store_options,
+        "email": f"bench@{ZONE}",
+        "endpoint": endpoint,
+        "force-renewal": True,
+    }
+
+    statuses: Dict[str, int] = {}
+    for _ in range(repeat):
+        # Every run renews the same names; without a clean slate, the duplicate certificate limit would defer them.
+        index.acme_rate_limiter = index.AcmeRateLimiter()
+        index.get_client("s3").delete_object(Bucket=BUCKET, Key=index.ACME_RATE_LIMIT_SIDECAR)
+        for lineage in lineages:
+            pathname = f"{root}/store/{lineage.name}/{index.FILESYSTEM_STORE_SIDECAR_DIR}/{index.ACME_RATE_LIMIT_SIDECAR}"
+            if lexists(pathname):
+                unlink(pathname)
+
+        report = measurement.run(lambda: index.lambda_handler(event, None))
+        for result in report["results"]:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+            measurement.add_api_calls(result.get("metrics", {}).get("api-calls", {}))
+
+    measurement.report(statuses=statuses)
+
+
+def main(args: List[str]) -> int:
+    """
+    Main program entrypoint.
+    """
+    certificates = 10
+    sans = 5
+    history = 3
+    archive_kb = 0
+    compression = index.DEFAULT_ARCHIVE_COMPRESSION
+    compression_level: Optional[int] = None
+    config_store_format = index.DEFAULT_CONFIG_STORE_FORMAT
+    acme_engine = "native"
+    pebble_url = environ.get("PEBBLE_DIRECTORY")
+    repeat = 3
+
+    try:
+        opts, args = getopt(args, "c:s:d:k:z:l:f:e:p:r:h", [
+            "certificates=", "sans=", "history=", "archive-kb=", "compression=", "compression-level=", "config-store-format=",
+            "acme-engine=", "pebble-url=", "repeat=", "help"])
+
+        for opt, val in opts:
+            if opt in ["-c", "--certificates"]:
+                certificates = int(val)
+            elif opt in ["-s", "--sans"]:
+                sans = int(val)
+            elif opt in ["-d", "--history"]:
+                history = int(val)
+            elif opt in ["-k", "--archive-kb"]:
+                archive_kb = int(val)
+            elif opt in ["-z", "--compression"]:
+                compression = val
+            elif opt in ["-l", "--compression-level"]:
+                compression_level = int(val)
+            elif opt in ["-f", "--config-store-format"]:
+                config_store_format = val
+            elif opt in ["-e", "--acme-engine"]:
+                acme_engine = val
+            elif opt in ["-p", "--pebble-url"]:
+                pebble_url = val
+            elif opt in ["-r", "--repeat"]:
+                repeat = int(val)
+            elif opt in ["-h", "--help"]:
+                usage(stdout)
+                return 0
+    except (GetoptError, ValueError) as e:
+        print(e, file=stderr)
+        usage()
+        return 2
+
+    errors: List[str] = []
+    if certificates < 1 or sans < 1 or history < 1 or archive_kb < 0 or repeat < 1:
+        errors.append("certificates, sans, history, and repeat must be positive, and archive-kb can't be negative")
+
+    if compression not in index.ARCHIVE_COMPRESSIONS:
+        errors.append(f"compression must be one of {', '.join(index.ARCHIVE_COMPRESSIONS)}: {compression}")
+
+    if config_store_format not in index.CONFIG_STORE_FORMATS + ("file",):
+        errors.append(
+            f"config-store-format must be one of {', '.join(index.CONFIG_STORE_FORMATS)}, file: {config_store_format}")
+
+    if acme_engine not in index.ACME_ENGINES:
+        errors.append(f"acme-engine must be one of {', '.join(index.ACME_ENGINES)}: {acme_engine}")
+
+    benchmarks = args or [benchmark for benchmark in BENCHMARKS if benchmark != "renewal" or pebble_url]
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            errors.append(f"Unknown benchmark: {benchmark}")
+
+    if "renewal" in benchmarks and not pebble_url:
+        errors.append("The renewal benchmark needs a Pebble server: set --pebble-url or PEBBLE_DIRECTORY")
+
+    # Only the archive benchmark runs without moto.
+    aws = any(benchmark != "archive" for benchmark in benchmarks)
+    aws_mock: Any = nullcontext()
+    if aws:
+        try:
+            aws_mock = index.lazy_import("moto").mock_aws()
+        except ImportError:
+            errors.append("The download, acm-lookup, and renewal benchmarks need moto: pip install -r requirements-dev.txt")
+
+    if errors:
+        for error in errors:
+            print(error, file=stderr)
+        return 2
+
+    # moto accepts any credentials, but botocore insists on having some.
+    for name, value in (("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        environ.setdefault(name, value)
+
+    params = {
+        "certificates": certificates, "sans": sans, "history": history, "archive-kb": archive_kb,
+        "compression": compression, "compression-level": compression_level, "config-store-format": config_store_format,
+        "acme-engine": acme_engine}
+    store_options = {"config-store-compression": compression, "config-store-compression-level": compression_level}
+
+    with TemporaryDirectory(prefix="certbot-to-acm-bench-") as root, aws_mock:
+        index.WARM_CACHE_DIR = f"{root}/warm"
+        makedirs(index.WARM_CACHE_DIR)
+        lineages = setup(
+            root, certificates, sans, history, archive_kb, pebble_url or index.DEFAULT_ENDPOINT, config_store_format,
+            store_options, aws)
+
+        for benchmark in benchmarks:
+            measurement = Measurement(benchmark, params)
+            if benchmark == "archive":
+                bench_archive(measurement, lineages, root, compression, compression_level, repeat)
+            elif benchmark == "download":
+                bench_download(measurement, lineages, root, repeat)
+            elif benchmark in ("acm-lookup", "acm-lookup-warm"):
+                bench_acm_lookup(measurement, lineages, benchmark == "acm-lookup-warm", repeat)
+            else:
+                bench_renewal(
+                    measurement, lineages, root, history, pebble_url, acme_engine, config_store_format, store_options, repeat)
+
+    return 0
+
+
+def usage(fd=stderr):
+    fd.write(__doc__)
+
+
+if __name__ == "__main__":
+    sys_exit(main(argv[1:]))
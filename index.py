@@ -1,240 +1,3187 @@
 """
 Lambda entrypoint for handling Certbot renewals.
+
+boto3, botocore, certbot, and cryptography are imported on first use (see lazy_import) rather than here so that cold starts
+that fail validation or find nothing due don't pay for them.
 """
 # pylint: disable=invalid-name
-from fnmatch import fnmatch
-from hashlib import sha256
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from fcntl import LOCK_EX, LOCK_NB, LOCK_UN, lockf
+from hashlib import md5, sha256
+from importlib import import_module
+from io import BytesIO
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
-from os import chmod, scandir, lstat, makedirs, symlink, unlink, walk
-from os.path import basename, isdir
-from re import compile as re_compile, fullmatch
-from shutil import rmtree
-from stat import S_ISLNK, S_ISREG
-from sys import stderr
+from os import chmod, environ, replace, rmdir, scandir, lstat, makedirs, readlink, rename, symlink, unlink, utime, walk
+from os.path import basename, dirname, isdir, isfile, islink, join, lexists, normpath, realpath
+from random import uniform
+from re import compile as re_compile, escape as re_escape, fullmatch
+from shutil import copyfile, rmtree
+from socket import gethostname
+from stat import S_IMODE, S_ISLNK, S_ISREG
+from sys import modules, stderr
 from tarfile import open as tarfile_open
-from tempfile import TemporaryFile, TemporaryDirectory
-from typing import Any, Dict, NamedTuple, Optional, Set
+from tempfile import TemporaryDirectory
+from threading import Condition, Lock, local
+from time import monotonic, perf_counter, sleep, time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, TypeVar
+from urllib.parse import unquote, urlparse
+from uuid import uuid4
+
+MODULE_LOAD_START = perf_counter()
+
+
+class CertbotCertificate(NamedTuple):
+    certificate: bytes
+    chain: bytes
+    full_chain: bytes
+    private_key: bytes
+
+
+class CertificateExpiry(NamedTuple):
+    not_after: datetime
+    names: List[str]
+
+
+class SsmParameter(NamedTuple):
+    name: str
+    description: str
+    value: str
+    tier: str
+    kms_key: Optional[str]  # Set for SecureString parameters
+
+
+class AcmTarget(NamedTuple):
+    region: Optional[str]  # None for the function's own region
+    arn: Any  # ARN, a mapping of key types to ARNs (when renewing several key types), or None
+    filters: Dict[str, Any]
+
+
+class KeySpec(NamedTuple):
+    key_type: str  # "rsa" or "ecdsa"
+    rsa_key_size: int
+    elliptic_curve: str
+
+
+class RenewalJournal(NamedTuple):
+    domains: List[str]
+    endpoint: str
+    key_spec: KeySpec
+    account_id: Optional[str]
+    issued_at: str  # ISO 8601
+    certificate: CertbotCertificate
+    completed: List[str]  # Publish sinks that finished (save, acm-import, ssm-publish)
+
+
+T = TypeVar("T")
+
+
+STAGING_ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+PRODUCTION_ENDPOINT = "https://acme-v02.api.letsencrypt.org/directory"
+DEFAULT_ENDPOINT = STAGING_ENDPOINT
+DEFAULT_RSA_KEY_SIZE = 2048
+DEFAULT_KMS_KEY = "alias/aws/s3"
+DEFAULT_SSM_KMS_KEY = "alias/aws/ssm"
+DEFAULT_SSM_TIER = "Standard"
+VALID_RSA_KEY_SIZES = (2048, 3072, 4096)
+DEFAULT_KEY_TYPE = "rsa"
+VALID_KEY_TYPES = ("rsa", "ecdsa")
+DEFAULT_ELLIPTIC_CURVE = "secp256r1"
+VALID_ELLIPTIC_CURVES = ("secp256r1", "secp384r1")
+DEFAULT_BATCH_MAX_WORKERS = 8
+DEFAULT_RENEWAL_WINDOW_DAYS = 30
+DEFAULT_ARCHIVE_KEEP_VERSIONS = 3
+CONFIG_STORE_SCHEMES = ("s3", "file")
+CONFIG_STORE_FORMATS = ("tar", "incremental")
+DEFAULT_CONFIG_STORE_FORMAT = "tar"
+INCREMENTAL_STORE_MAX_WORKERS = 8
+# A lease outlives the longest possible Lambda invocation, so it is never taken over from a holder that is still running.
+CONFIG_STORE_LEASE_TTL = 900.0
+CONFIG_STORE_LEASE_POLL = 5.0
+DEFAULT_CONFIG_STORE_LEASE_WAIT = 120.0
+CONFIG_STORE_LEASE_SIDECAR_SUFFIX = ".lease.json"
+# Directory inside a file:// store's config tree holding its sidecars and lease file; not part of the certbot config
+FILESYSTEM_STORE_SIDECAR_DIR = ".certbot-to-acm"
+# S3 error codes for a conditional write whose condition failed, or that raced another conditional write
+S3_CONDITION_ERROR_CODES = {"PreconditionFailed", "ConditionalRequestConflict"}
+MANIFEST_VERSION = 1
+SSM_GET_PARAMETERS_MAX_NAMES = 10
+SSM_PUBLISH_MAX_WORKERS = 4
+THROTTLE_MAX_ATTEMPTS = 6
+THROTTLE_BASE_DELAY = 0.5
+THROTTLE_MAX_DELAY = 20.0
+ACM_INDEX_TTL = 300.0
+CLIENT_MAX_POOL_CONNECTIONS = 32
+WARM_CACHE_DIR = "/tmp/certbot-to-acm"
+WARM_CACHE_MAX_ENTRIES = 32
+ACME_ENGINES = ("certbot", "native")
+DEFAULT_ACME_ENGINE = "certbot"
+ACME_USER_AGENT = "certbot-to-acm/0.1"
+ACME_ACCOUNT_KEY_SIZE = 2048
+ACME_ORDER_TIMEOUT = 180.0
+DNS_CHALLENGE_TTL = 10
+DNS_CHALLENGE_BATCH_WINDOW = 5.0
+ROUTE53_CHANGE_POLL_DELAY = 5
+ROUTE53_CHANGE_MAX_ATTEMPTS = 36
+ROUTE53_ZONE_INDEX_TTL = 3600.0
+ROUTE53_ZONE_INDEX_MISS_REFRESH = 60.0
+ROUTE53_ZONE_INDEX_SIDECAR = "route53-zones.json"
+
+# ACM key-type filter values for each certbot elliptic curve name
+ACM_EC_KEY_TYPES = {"secp256r1": "EC_prime256v1", "secp384r1": "EC_secp384r1"}
+
+# ListCertificates only returns RSA_1024 and RSA_2048 certificates unless other key types are requested explicitly.
+ALL_ACM_KEY_TYPES = ("RSA_1024", "RSA_2048", "RSA_3072", "RSA_4096", "EC_prime256v1", "EC_secp384r1", "EC_secp521r1")
+DEFAULT_ACM_KEY_TYPES = ("RSA_1024", "RSA_2048")
+
+# AWS error codes indicating a request was throttled and should be retried after a delay
+THROTTLING_ERROR_CODES = {
+    "PriorRequestNotComplete", "RequestLimitExceeded", "Throttling", "ThrottlingException", "TooManyRequestsException",
+    "TooManyUpdates"}
+
+# Let's Encrypt rate limits tracked by AcmeRateLimiter: limit kind to (count, window in seconds)
+ACME_RATE_LIMITS = {"account": (300, 3 * 3600.0), "domain": (50, 7 * 86400.0), "names": (5, 7 * 86400.0)}
+ACME_RATE_LIMIT_BASE_BACKOFF = 900.0
+ACME_RATE_LIMIT_MAX_BACKOFF = 86400.0
+ACME_RATE_LIMIT_SIDECAR = "acme-rate-limits.json"
+ACME_RATE_LIMITED_ERROR = "urn:ietf:params:acme:error:rateLimited"
+RENEWAL_JOURNAL_SIDECAR_SUFFIX = ".journal.json"
+MULTI_LABEL_PUBLIC_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "co.nz", "co.jp", "co.kr", "com.br", "com.cn",
+    "com.mx", "co.in", "co.za", "com.sg", "com.tw", "com.hk"}
+
+METRICS_NAMESPACE = "certbot-to-acm"
+
+# Renewal scheduling: certificates per dispatched batch, how batches are dispatched, and the window they are spread over
+DEFAULT_SCHEDULER_BATCH_SIZE = 10
+SCHEDULER_DISPATCH_MODES = ("lambda", "sqs")
+DEFAULT_SCHEDULER_JITTER = 120.0
+SQS_MAX_DELAY_SECONDS = 900
+SCHEDULER_TIME_MARGIN = 15.0
+
+# Event keys that control a batch invocation itself rather than the certificates within it.
+BATCH_CONTROL_KEYS = ("certificates", "max-workers")
+
+# Live files of a lineage, as paths relative to the config directory
+LIVE_FILE_MATCHER = re_compile(r"live/(?P<lineage>[^/]+)/(?P<filetype>cert|chain|fullchain|privkey)\.pem")
+
+# CertbotCertificate field for each file certbot produces
+CERTIFICATE_FIELDS = {"cert": "certificate", "chain": "chain", "fullchain": "full_chain", "privkey": "private_key"}
+
+# Config archive compression: the (minimum, maximum, default) level of each
+ARCHIVE_COMPRESSIONS = {"gzip": (1, 9, 6), "zstd": (1, 22, 3)}
+DEFAULT_ARCHIVE_COMPRESSION = "gzip"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Regular expression for Certbot directories that are valid
+VALID_DOMAIN_DIR_MATCHER = re_compile(
+    r"(?P<domain>(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z])(?:\.(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z]))*)"
+)
+
+# Regular expression for Certbot directories that were created because symbolic links/permissions were an issue
+MOVED_DOMAIN_DIR_MATCHER = re_compile(
+    r"(?P<domain>(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z])(?:\.(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z]))*)-[0-9]{4}"
+)
+
+# Archived filenames
+ARCHIVED_FILE_MATCHER = re_compile(r"(?P<filetype>cert|chain|fullchain|privkey)(?P<version>[0-9]+)\.pem")
+
+# All filetypes that Certbot produces
+ALL_FILETYPES = ("cert", "chain", "fullchain", "privkey")
+
+# The time in an ACME rateLimited error's detail, e.g. "... retry after 2024-01-15 18:48:41 UTC: see ..."
+RETRY_AFTER_MATCHER = re_compile(r"retry after (\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})")
+
+# Top-level renewal configuration entries that hold absolute paths into the config directory
+RENEWAL_CONF_PATH_MATCHER = re_compile(r"(?P<key>archive_dir|cert|privkey|chain|fullchain)\s*=.*")
+
+# Where content digests are recorded so unchanged artifacts aren't rewritten
+CONFIG_DIGEST_METADATA = "config-sha256"
+ARCHIVE_DIGEST_METADATA = "archive-sha256"
+ACM_DIGEST_TAG = "certbot-to-acm:sha256"
+
+# SSM parameter suffix, description, certificate field, and whether the value is secret
+SSM_PARAMETERS = (
+    ("cert", "TLS certificate", "certificate", False),
+    ("chain", "TLS intermediate", "chain", False),
+    ("fullchain", "TLS fullchain", "full_chain", False),
+    ("privkey", "TLS key", "private_key", True),
+)
+
+log = getLogger()
+
+# boto3 clients shared by every renewal in this container; see get_client
+clients: Dict[Tuple[str, Optional[str]], Any] = {}
+clients_lock = Lock()
+
+# Milliseconds spent importing each lazily imported module in this container; see lazy_import
+import_timings: Dict[str, float] = {}
+startup_reported = False
+
+# The RenewalMetrics of the renewal running on each thread; see current_metrics
+metrics_local = local()
+
+# Serializes use of each warm workspace directory; see WarmWorkspace
+workspace_locks: Dict[str, Lock] = {}
+workspace_locks_lock = Lock()
+
+# Serializes renewals in this container that share a config store; see ConfigStoreLease
+config_store_locks: Dict[str, Lock] = {}
+config_store_locks_lock = Lock()
+
+# ACME clients for each (server, account id), shared by every thread and warm invocation in this container; see get_acme_client
+acme_clients: Dict[Tuple[str, str], Any] = {}
+acme_clients_lock = Lock()
+
+# certbot.main.main() reconfigures process-wide logging and display state on every call, so only one certbot run can be in
+# flight at a time. Batch items still overlap their S3, ACM, and SSM work around it.
+certbot_lock = Lock()
+
+
+def lazy_import(name: str) -> Any:
+    """
+    Return the named module, importing it on first use and recording how long the import took in import_timings.
+    """
+    module = modules.get(name)
+    if module is not None:
+        return module
+
+    start = perf_counter()
+    module = import_module(name)
+    import_timings[name] = round((perf_counter() - start) * 1000, 1)
+    return module
+
+
+def log_startup_report() -> None:
+    """
+    Emit a structured log line, once per container, breaking down cold start time: loading this module and each heavy module
+    imported lazily during the first invocation.
+    """
+    global startup_reported  # pylint: disable=global-statement
+    if startup_reported:
+        return
+
+    startup_reported = True
+    report = {"module-load-ms": MODULE_LOAD_MS, "import-ms": import_timings}
+    metrics = {"module-load-ms": MODULE_LOAD_MS, "import-ms-total": round(sum(import_timings.values()), 1)}
+    emf_line = {
+        "_aws": {
+            "Timestamp": int(time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE, "Dimensions": [[]],
+                "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in metrics]}],
+        },
+        "startup": report,
+        **metrics,
+    }
+    print(json_dumps(emf_line, sort_keys=True))
+
+
+class RenewalMetrics:
+    """
+    Timings and counters for one renewal, emitted as a CloudWatch Embedded Metric Format log line. While a renewal runs
+    (with metrics: ...), it is the current metrics of its thread, so code anywhere in the pipeline can add to it through
+    lap_metric, Phase, and count_metric without it being passed around; work handed to other threads carries it over via
+    bind_metrics. API calls made through get_client's clients are counted automatically.
+
+    Phase timings come in two kinds: laps, which split the renewal's wall time into consecutive steps (validation, restore,
+    issue, save, etc.), and nested phases (S3 download, archive, S3 upload, DNS propagation) that measure part of a lap.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.start = perf_counter()
+        self.last_lap = self.start
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.api_calls: Dict[str, int] = {}
+        self.previous: Optional["RenewalMetrics"] = None
+
+    def __enter__(self) -> "RenewalMetrics":
+        self.previous = current_metrics()
+        metrics_local.metrics = self
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        metrics_local.metrics = self.previous
+
+    def add_phase(self, name: str, ms: float) -> None:
+        """
+        Add to the time spent in a phase.
+        """
+        with self.lock:
+            self.phases[name] = round(self.phases.get(name, 0.0) + ms, 1)
+
+    def lap(self, name: str) -> None:
+        """
+        Record the time since the previous lap (or the start) as the named step.
+        """
+        now = perf_counter()
+        with self.lock:
+            last_lap = self.last_lap
+            self.last_lap = now
+        self.add_phase(name, (now - last_lap) * 1000)
+
+    def add(self, name: str, count: int) -> None:
+        """
+        Add to a counter (e.g., bytes transferred).
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def add_api_call(self, operation: str) -> None:
+        """
+        Count an AWS API call.
+        """
+        with self.lock:
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return the timings and counters recorded so far.
+        """
+        with self.lock:
+            return {
+                "total-ms": round((perf_counter() - self.start) * 1000, 1),
+                "phases-ms": dict(self.phases),
+                "counts": dict(self.counters),
+                "api-calls": dict(self.api_calls),
+            }
+
+    def emit(self, dimensions: Dict[str, str], properties: Dict[str, Any]) -> None:
+        """
+        Log the metrics as a CloudWatch Embedded Metric Format line with the given dimensions and extra (non-metric)
+        properties.
+        """
+        summary = self.summary()
+        values: Dict[str, Any] = {"total-ms": summary["total-ms"]}
+        units = {"total-ms": "Milliseconds"}
+
+        for name, ms in summary["phases-ms"].items():
+            values[f"{name}-ms"] = ms
+            units[f"{name}-ms"] = "Milliseconds"
+
+        for name, count in summary["counts"].items():
+            values[name] = count
+            units[name] = "Bytes" if name.endswith("-bytes") else "Count"
+
+        values["api-calls"] = sum(summary["api-calls"].values())
+        units["api-calls"] = "Count"
+
+        emf_line = {
+            "_aws": {
+                "Timestamp": int(time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()],
+                }],
+            },
+            **dimensions,
+            **properties,
+            **values,
+            "api-calls-by-operation": summary["api-calls"],
+        }
+        print(json_dumps(emf_line, sort_keys=True, default=str))
+
+
+def current_metrics() -> Optional[RenewalMetrics]:
+    """
+    Return the metrics of the renewal running on this thread, if any.
+    """
+    return getattr(metrics_local, "metrics", None)
+
+
+def lap_metric(name: str) -> None:
+    """
+    Record the time since the previous lap as the named step of the current renewal, if any.
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.lap(name)
+
+
+def count_metric(name: str, count: int) -> None:
+    """
+    Add to a counter of the current renewal, if any.
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add(name, count)
+
+
+def count_api_call(model: Any, **kwargs: Any) -> None:
+    """
+    botocore before-parameter-build hook counting each API call against the current renewal, if any.
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_api_call(f"{model.service_model.service_name}:{model.name}")
+
+
+def bind_metrics(call: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wrap a callable so that it runs with this thread's current metrics, for handing work to a thread pool.
+    """
+    metrics = current_metrics()
+
+    def bound(*args: Any, **kwargs: Any) -> T:
+        previous = current_metrics()
+        metrics_local.metrics = metrics
+        try:
+            return call(*args, **kwargs)
+        finally:
+            metrics_local.metrics = previous
+
+    return bound
+
+
+class Phase:
+    """
+    Context manager timing a nested phase of the current renewal, if any.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "Phase":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add_phase(self.name, (perf_counter() - self.start) * 1000)
+
+
+def get_client(service: str, region: Optional[str] = None) -> Any:
+    """
+    Return the boto3 client for the given service and region (None for the function's own region). Clients are created on
+    first use and then shared by every thread and warm invocation in this container, with a connection pool large enough for
+    the batch worker threads.
+    """
+    key = (service, region)
+    with clients_lock:
+        client = clients.get(key)
+        if client is None:
+            boto3 = lazy_import("boto3")
+            config = lazy_import("botocore.config").Config(
+                max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS, retries={"mode": "standard"})
+            client = clients[key] = boto3.client(service, region_name=region, config=config)
+            client.meta.events.register("before-parameter-build", count_api_call)
+
+    return client
+
+
+def filter_values(filters: Dict[str, Any], *keys: str) -> Optional[Set[str]]:
+    """
+    Return the set of values for the first of the given keys present in the ACM certificate filters, or None if none are.
+    """
+    for key in keys:
+        values = filters.get(key)
+        if values:
+            return {values} if isinstance(values, str) else set(values)
+
+    return None
+
+
+def summary_from_certificate_detail(detail: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert the CertificateDetail returned by DescribeCertificate to the CertificateSummary shape used by ListCertificates.
+    """
+    return {
+        "CertificateArn": detail["CertificateArn"],
+        "DomainName": detail.get("DomainName"),
+        "SubjectAlternativeNameSummaries": detail.get("SubjectAlternativeNames", []),
+        "HasAdditionalSubjectAlternativeNames": False,
+        "Status": detail.get("Status"),
+        "Type": detail.get("Type"),
+        "KeyAlgorithm": detail.get("KeyAlgorithm"),
+        "KeyUsages": [usage["Name"] for usage in detail.get("KeyUsages", [])],
+        "ExtendedKeyUsages": [usage["Name"] for usage in detail.get("ExtendedKeyUsages", [])],
+        "NotAfter": detail.get("NotAfter"),
+    }
+
+
+class AcmCertificateIndex:
+    """
+    In-process index of the account's ACM certificate summaries in one region, keyed by ARN and by every domain name and SAN.
+    It is built with one paginated ListCertificates pass and shared by every certificate renewed in this container until the
+    TTL expires. Certificates that are imported are re-fetched individually with DescribeCertificate (new ones straight away,
+    replaced ones on their next lookup), so renewals don't force a rebuild.
+    """
+
+    def __init__(self, ttl: float = ACM_INDEX_TTL, region: Optional[str] = None) -> None:
+        self.ttl = ttl
+        self.region = region
+        self.lock = Lock()
+        self.built_at: Optional[float] = None
+        self.by_arn: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Set[str]] = {}
+        self.stale: Set[str] = set()
+
+    def ensure_built(self) -> None:
+        """
+        Build the index if it hasn't been built or has expired.
+        """
+        with self.lock:
+            if self.built_at is not None and monotonic() - self.built_at < self.ttl:
+                return
+
+            self.by_arn = {}
+            self.by_name = {}
+            self.stale = set()
+            list_kw: Dict[str, Any] = {"Includes": {"keyTypes": list(ALL_ACM_KEY_TYPES)}}
+
+            while True:
+                print(f"Calling list_certificates to build the ACM certificate index for {self.region or 'this region'}")
+                list_result = get_client("acm", self.region).list_certificates(**list_kw)
+                for summary in list_result.get("CertificateSummaryList", []):
+                    self.add(summary)
+
+                next_token = list_result.get("NextToken")
+                if not next_token:
+                    break
+
+                list_kw["NextToken"] = next_token
+
+            self.built_at = monotonic()
+
+    def add(self, summary: Dict[str, Any]) -> None:
+        """
+        Add or replace a certificate summary.
+        """
+        arn = summary["CertificateArn"]
+        self.by_arn[arn] = summary
+        for name in [summary.get("DomainName")] + summary.get("SubjectAlternativeNameSummaries", []):
+            if name:
+                self.by_name.setdefault(name.lower(), set()).add(arn)
+
+    def invalidate(self, arn: str) -> None:
+        """
+        Mark a certificate whose details have changed (e.g., because it was just imported) as needing to be re-fetched.
+        """
+        with self.lock:
+            self.stale.add(arn)
+
+    def get(self, arn: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the summary for the given certificate ARN, or None if the certificate doesn't exist.
+        """
+        self.ensure_built()
+        summary = self.by_arn.get(arn)
+        if summary is not None and arn not in self.stale:
+            return summary
+
+        return self.refresh(arn)
+
+    def refresh(self, arn: str) -> Optional[Dict[str, Any]]:
+        """
+        Re-fetch a single certificate's summary with DescribeCertificate.
+        """
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        try:
+            detail = get_client("acm", self.region).describe_certificate(CertificateArn=arn)["Certificate"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("ResourceNotFoundException", "ValidationException", "InvalidArnException"):
+                with self.lock:
+                    self.by_arn.pop(arn, None)
+                    self.stale.discard(arn)
+                return None
+            raise
+
+        summary = summary_from_certificate_detail(detail)
+        with self.lock:
+            self.add(summary)
+            self.stale.discard(arn)
+
+        return summary
+
+    def find(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Return the summaries of the certificates matching the given acm-certificate-filters.
+        """
+        self.ensure_built()
+
+        domain_name = filters.get("domain")
+        if domain_name:
+            arns = sorted(self.by_name.get(domain_name.lower(), set()))
+        else:
+            arns = sorted(self.by_arn)
+
+        candidates = []
+        for arn in arns:
+            summary = self.get(arn)
+            if summary is not None and (not domain_name or summary.get("DomainName") == domain_name):
+                candidates.append(summary)
+
+        statuses = filter_values(filters, "status")
+        types = filter_values(filters, "type")
+        # Filters that don't name a key type match what ListCertificates returns by default, even though the index holds all of
+        # them.
+        key_types = filter_values(filters, "key-type") or set(DEFAULT_ACM_KEY_TYPES)
+        key_usages = filter_values(filters, "key-usage", "key_usage")
+        extended_key_usages = filter_values(filters, "extended-key-usage", "extended_key_usage")
+
+        results = []
+        for summary in candidates:
+            if statuses and summary.get("Status") not in statuses:
+                continue
+            if types and summary.get("Type") not in types:
+                continue
+            if (summary.get("KeyAlgorithm") or "").replace("-", "_") not in key_types:
+                continue
+            if key_usages and not key_usages.intersection(summary.get("KeyUsages", [])):
+                continue
+            if extended_key_usages and not extended_key_usages.intersection(summary.get("ExtendedKeyUsages", [])):
+                continue
+
+            results.append(summary)
+
+        return results
+
+
+# Shared by every certificate renewed by this container: acm_index for the function's own region, and one per other region
+acm_index = AcmCertificateIndex()
+acm_indexes: Dict[str, AcmCertificateIndex] = {}
+acm_indexes_lock = Lock()
+
+
+def get_acm_index(region: Optional[str] = None) -> AcmCertificateIndex:
+    """
+    Return the ACM certificate index for the given region (None for the function's own region).
+    """
+    if region is None:
+        return acm_index
+
+    with acm_indexes_lock:
+        region_index = acm_indexes.get(region)
+        if region_index is None:
+            region_index = acm_indexes[region] = AcmCertificateIndex(region=region)
+
+    return region_index
+
+
+def find_existing_certificate(arn: Optional[str], filters: Dict[str, Any], region: Optional[str] = None) -> Optional[str]:
+    """
+    Search ACM in the given region (None for the function's own region) for an existing certificate matching the specified
+    ARN or the list of filters.
+    """
+    region_index = get_acm_index(region)
+    if arn:
+        if region_index.get(arn) is None:
+            raise ValueError(f"Invalid certificate ARN: {arn}")
+        return arn
+
+    cert_summaries = region_index.find(filters)
+
+    if len(cert_summaries) == 0:
+        return None
+
+    if len(cert_summaries) == 1:
+        return cert_summaries[0]["CertificateArn"]
+
+    raise ValueError("Multiple certificates found: " + " ".join([cs["CertificateArn"] for cs in cert_summaries]))
+
+
+class DigestingReader:
+    """
+    File-like wrapper around a stream (such as a botocore StreamingBody) that computes the SHA-256 digest of everything read
+    through it. Bytes already consumed from the stream to sniff its format can be handed back via prefix.
+    """
+
+    def __init__(self, stream: Any, prefix: bytes = b"") -> None:
+        self.stream = stream
+        self.prefix = prefix
+        self.hasher = sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            data = self.prefix + self.stream.read()
+            self.prefix = b""
+        elif self.prefix:
+            data = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            if len(data) < size:
+                data += self.stream.read(size - len(data))
+        else:
+            data = self.stream.read(size)
+
+        self.hasher.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self) -> str:
+        """
+        Consume the rest of the stream and return the hex digest of the entire stream, including any prefix.
+        """
+        while self.read(65536):
+            pass
+
+        return self.hasher.hexdigest()
+
+
+def clear_directory(path: str) -> None:
+    """
+    Remove everything inside a directory, leaving the directory itself.
+    """
+    for entry in scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            rmtree(entry.path)
+        else:
+            unlink(entry.path)
+
+
+def download_certbot_config(
+        config_bucket: str, config_key: str, certbot_config_dir: str, if_none_match: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Download the configuration tar file from S3 and extract it to the certbot config directory, replacing anything already
+    there. Returns the GetObject response (metadata, ETag, etc.), or None if there was no usable archive.
+
+    The archive is extracted as it streams in rather than being spooled to /tmp first. If the object records an
+    archive-sha256 digest, the downloaded bytes are verified against it.
+
+    If if_none_match is the ETag of the current object, S3 returns 304 Not Modified; the resulting ClientError is raised and
+    the directory is left untouched.
+
+    The compression (gzip or zstd) is detected from the archive itself. zstd archives need the zstandard package.
+    """
+    ClientError = lazy_import("botocore.exceptions").ClientError
+
+    get_kw = {"IfNoneMatch": if_none_match} if if_none_match else {}
+    with Phase("s3-download"):
+        try:
+            result = get_client("s3").get_object(Bucket=config_bucket, Key=config_key, **get_kw)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                clear_directory(certbot_config_dir)
+                return None
+            raise
+
+        clear_directory(certbot_config_dir)
+        body = result["Body"]
+        magic = body.read(4)
+        if magic == b"\x50\x4b\x03\x04":
+            # Legacy ZIP file -- don't use
+            body.close()
+            return None
+
+        # Extraction happens as the archive streams in, so this phase covers both.
+        reader = DigestingReader(body, magic)
+        stream = lazy_import("zstandard").ZstdDecompressor().stream_reader(reader) if magic == ZSTD_MAGIC else reader
+        with tarfile_open(fileobj=stream, mode="r|*") as tf:
+            tf.extractall(certbot_config_dir)
+
+        digest = reader.drain()
+        count_metric("s3-download-bytes", reader.size)
+
+    expected_digest = result.get("Metadata", {}).get(ARCHIVE_DIGEST_METADATA)
+    if expected_digest and digest != expected_digest:
+        clear_directory(certbot_config_dir)
+        raise ValueError(
+            f"Config archive s3://{config_bucket}/{config_key} is corrupt: expected sha256 {expected_digest}, got {digest}")
+
+    return result
+
+
+def create_config_tarfile(
+        config_dir: str, config_tarfile: str, compression: str = DEFAULT_ARCHIVE_COMPRESSION, level: Optional[int] = None
+) -> Dict[str, CertbotCertificate]:
+    """
+    Create the configuration tar file for storage in S3, compressed with gzip or zstd (which needs the zstandard package) at
+    the given level or the compression's default. Returns the live certificate of each complete lineage found, keyed by
+    lineage name.
+    """
+    if level is None:
+        level = ARCHIVE_COMPRESSIONS[compression][2]
+
+    if compression == "zstd":
+        compressor = lazy_import("zstandard").ZstdCompressor(level=level)
+        with open(config_tarfile, "wb") as fd, compressor.stream_writer(fd) as zfd:
+            with tarfile_open(fileobj=zfd, mode="w|") as tf:
+                return add_config_tree(tf, config_dir)
+
+    with tarfile_open(config_tarfile, "w:gz", compresslevel=level) as tf:
+        return add_config_tree(tf, config_dir)
+
+
+def add_config_tree(tf: Any, config_dir: str) -> Dict[str, CertbotCertificate]:
+    """
+    Add everything in the certbot config directory to an open tar file, returning the live certificate of each complete
+    lineage found, keyed by lineage name.
+
+    The directory is walked once, live first, so that the archived files the live symbolic links point at are known before
+    they are reached; each of those is read once, and the same bytes are both archived and returned.
+    """
+    config_dir = normpath(config_dir)
+    live_targets: Dict[str, Tuple[str, str]] = {}  # Path the live link points at to its lineage and filetype
+    found: Dict[str, Dict[str, bytes]] = {}
+    relpath_strip = len(config_dir) + 1
+
+    for path, dirnames, filenames in walk(config_dir):
+        if path == config_dir:
+            dirnames.sort(key=lambda name: name != "live")
+
+        for filename in filenames:
+            pathname = path + "/" + filename
+            relpath = pathname[relpath_strip:]
+            print(f"Adding {relpath} to archive")
+
+            m = LIVE_FILE_MATCHER.fullmatch(relpath)
+            owner = (m.group("lineage"), m.group("filetype")) if m else live_targets.get(pathname)
+            if m and islink(pathname):
+                target = normpath(join(path, readlink(pathname)))
+                if target.startswith(config_dir + "/"):
+                    live_targets[target] = (m.group("lineage"), m.group("filetype"))
+                    owner = None
+
+            if owner is None:
+                tf.add(pathname, relpath, recursive=False)
+                continue
+
+            # Links to files outside the config directory are archived as links, but the target is still captured.
+            with open(pathname, "rb") as fd:
+                data = fd.read()
+
+            if not islink(pathname):
+                tf.addfile(tf.gettarinfo(pathname, relpath), BytesIO(data))
+            else:
+                tf.add(pathname, relpath, recursive=False)
+
+            found.setdefault(owner[0], {})[owner[1]] = data
+
+    return complete_certificates(found)
+
+
+def read_live_certificates(config_dir: str, lineage: Optional[str] = None) -> Dict[str, CertbotCertificate]:
+    """
+    Read the live certificate, chain, full chain, and private key of each complete lineage in the certbot config directory
+    (or just the given lineage), keyed by lineage name.
+    """
+    found: Dict[str, Dict[str, bytes]] = {}
+    live_dir = f"{config_dir}/live"
+    if isdir(live_dir):
+        for entry in scandir(live_dir):
+            if lineage is not None and entry.name != lineage:
+                continue
+
+            for filetype in ALL_FILETYPES:
+                pathname = f"{entry.path}/{filetype}.pem"
+                if entry.is_dir(follow_symlinks=False) and isfile(pathname):
+                    with open(pathname, "rb") as fd:
+                        found.setdefault(entry.name, {})[filetype] = fd.read()
+
+    return complete_certificates(found)
+
+
+def complete_certificates(found: Dict[str, Dict[str, bytes]]) -> Dict[str, CertbotCertificate]:
+    """
+    Given the contents of the live files found, keyed by lineage and filetype, return a CertbotCertificate for each lineage
+    that has all four.
+    """
+    return {
+        lineage: CertbotCertificate(**{CERTIFICATE_FIELDS[filetype]: data for filetype, data in files.items()})
+        for lineage, files in found.items() if len(files) == len(ALL_FILETYPES)}
+
+
+def lineage_name(domains: List[str]) -> str:
+    """
+    Return the name certbot gives the lineage for the given domains by default.
+    """
+    name = domains[0].lower()
+    return name[2:] if name.startswith("*.") else name
+
+
+def lineage_path_filter(lineage: str) -> Callable[[str], bool]:
+    """
+    Return a predicate matching the config directory paths certbot needs to renew the given lineage: the ACME accounts, the
+    renewal configuration, and the live and archive directories (including any moved -NNNN copies).
+    """
+    lineage_re = re_escape(lineage) + r"(?:-[0-9]{4})?"
+    matcher = re_compile(rf"accounts/.*|renewal/{lineage_re}\.conf|(?:live|archive)/{lineage_re}/.*")
+    return lambda relpath: matcher.fullmatch(relpath) is not None
+
+
+def lineage_versions(config_dir: str, lineage: str) -> Dict[int, List[str]]:
+    """
+    Return the archived versions of a lineage, mapping each version number to the filenames archived for it.
+    """
+    versions: Dict[int, List[str]] = {}
+    archive_dir = f"{config_dir}/archive/{lineage}"
+    if not isdir(archive_dir):
+        return versions
+
+    for entry in scandir(archive_dir):
+        m = ARCHIVED_FILE_MATCHER.fullmatch(entry.name)
+        if m:
+            versions.setdefault(int(m.group("version")), []).append(entry.name)
+
+    return versions
+
+
+def link_live_lineage(config_dir: str, lineage: str, version: int) -> None:
+    """
+    Point the live/<lineage>/*.pem symbolic links at the given archived version, replacing whatever is there.
+    """
+    live_dir = f"{config_dir}/live/{lineage}"
+    makedirs(live_dir, exist_ok=True)
+
+    for filetype in ALL_FILETYPES:
+        pathname = f"{live_dir}/{filetype}.pem"
+        if lexists(pathname):
+            unlink(pathname)
+        symlink(f"../../archive/{lineage}/{filetype}{version}.pem", pathname)
+
+
+def rewrite_renewal_conf(config_dir: str, lineage: str) -> None:
+    """
+    Rewrite the absolute paths in a lineage's renewal configuration to point into config_dir. Each invocation extracts the
+    config into a different directory, and certbot treats a configuration pointing elsewhere as broken.
+    """
+    conf = f"{config_dir}/renewal/{lineage}.conf"
+    paths = {filetype: f"{config_dir}/live/{lineage}/{filetype}.pem" for filetype in ALL_FILETYPES}
+    paths["archive_dir"] = f"{config_dir}/archive/{lineage}"
+
+    with open(conf, "r") as fd:
+        lines = fd.readlines()
+
+    for i, line in enumerate(lines):
+        if line.startswith("["):
+            break
+
+        m = RENEWAL_CONF_PATH_MATCHER.fullmatch(line.rstrip("\n"))
+        if m:
+            lines[i] = f"{m.group('key')} = {paths[m.group('key')]}\n"
+
+    with open(conf, "w") as fd:
+        fd.writelines(lines)
+
+
+def fixup_config_dir(config_dir: str) -> List[str]:
+    """
+    Repair a certbot config directory that was stored somewhere that doesn't preserve symbolic links or permissions, returning
+    the relative paths changed or removed. When certbot finds that the live files of a lineage are no longer symbolic links, it
+    gives up on the lineage and starts a new one (<lineage>-0001, -0002, ...) with a brand-new certificate. To undo this:
+    *   each moved -NNNN lineage is collapsed into its canonical lineage: archived certificates the canonical lineage doesn't
+        already have are added to it as newer versions, and the moved archive, live, and renewal entries are removed (the
+        newest moved renewal configuration is kept if the canonical lineage has none);
+    *   the live symbolic links of every lineage are pointed at its newest complete archived version; and
+    *   archived private keys are made readable by the owner only (0600), and the other archived files by everyone (0644).
+    """
+    changed = []
+
+    # Canonical lineage name to the names of its moved copies, from one scan of the archive, live, and renewal directories
+    lineages: Dict[str, Set[str]] = {}
+    for parent in ("archive", "live", "renewal"):
+        parent_dir = f"{config_dir}/{parent}"
+        if not isdir(parent_dir):
+            continue
+
+        for entry in scandir(parent_dir):
+            if parent == "renewal":
+                if not entry.name.endswith(".conf"):
+                    continue
+                name = entry.name[:-5]
+            elif entry.is_dir(follow_symlinks=False):
+                name = entry.name
+            else:
+                continue
+
+            m = MOVED_DOMAIN_DIR_MATCHER.fullmatch(name)
+            if m:
+                lineages.setdefault(m.group("domain"), set()).add(name)
+            elif VALID_DOMAIN_DIR_MATCHER.fullmatch(name):
+                lineages.setdefault(name, set())
+
+    for lineage, moved_names in sorted(lineages.items()):
+        archive_dir = f"{config_dir}/archive/{lineage}"
+        conf = f"{config_dir}/renewal/{lineage}.conf"
+        versions = lineage_versions(config_dir, lineage)
+        known = {file_digest(f"{archive_dir}/cert{version}.pem") for version, filenames in versions.items()
+                 if f"cert{version}.pem" in filenames}
+        lineage_changed = False
+
+        for name in sorted(moved_names):
+            moved_versions = lineage_versions(config_dir, name)
+            for version, filenames in sorted(moved_versions.items()):
+                if len(filenames) != len(ALL_FILETYPES):
+                    continue
+
+                digest = file_digest(f"{config_dir}/archive/{name}/cert{version}.pem")
+                if digest in known:
+                    continue
+
+                known.add(digest)
+                new_version = max(versions, default=0) + 1
+                makedirs(archive_dir, exist_ok=True)
+                for filetype in ALL_FILETYPES:
+                    rename(f"{config_dir}/archive/{name}/{filetype}{version}.pem", f"{archive_dir}/{filetype}{new_version}.pem")
+                    changed.append(f"archive/{lineage}/{filetype}{new_version}.pem")
+                versions[new_version] = [f"{filetype}{new_version}.pem" for filetype in ALL_FILETYPES]
+
+        for name in sorted(moved_names, reverse=True):
+            moved_conf = f"{config_dir}/renewal/{name}.conf"
+            if lexists(moved_conf):
+                if lexists(conf):
+                    unlink(moved_conf)
+                    changed.append(f"renewal/{name}.conf")
+                else:
+                    rename(moved_conf, conf)
+                    changed.append(f"renewal/{lineage}.conf")
+
+            for parent in ("archive", "live"):
+                if lexists(f"{config_dir}/{parent}/{name}"):
+                    rmtree(f"{config_dir}/{parent}/{name}")
+                    changed.append(f"{parent}/{name}")
+
+            lineage_changed = True
+
+        complete = [version for version, filenames in versions.items() if len(filenames) == len(ALL_FILETYPES)]
+        if complete:
+            latest = max(complete)
+            for filetype in ALL_FILETYPES:
+                pathname = f"{config_dir}/live/{lineage}/{filetype}.pem"
+                if not islink(pathname) or readlink(pathname) != f"../../archive/{lineage}/{filetype}{latest}.pem":
+                    link_live_lineage(config_dir, lineage, latest)
+                    changed.append(f"live/{lineage}")
+                    lineage_changed = True
+                    break
+
+        if lineage_changed and lexists(conf):
+            rewrite_renewal_conf(config_dir, lineage)
+
+        if isdir(archive_dir):
+            for entry in scandir(archive_dir):
+                m = ARCHIVED_FILE_MATCHER.fullmatch(entry.name)
+                if not m or not entry.is_file(follow_symlinks=False):
+                    continue
+
+                mode = 0o600 if m.group("filetype") == "privkey" else 0o644
+                if S_IMODE(entry.stat(follow_symlinks=False).st_mode) != mode:
+                    chmod(entry.path, mode)
+                    changed.append(f"archive/{lineage}/{entry.name}")
+
+    return changed
+
+
+def compact_config_dir(config_dir: str, keep_versions: int) -> List[str]:
+    """
+    Compact the certbot config directory, returning the relative paths removed:
+    *   only the newest keep_versions archived versions of each lineage are kept;
+    *   the live symbolic links are pointed at the newest complete version;
+    *   the renewal configuration paths are pointed at config_dir; and
+    *   archive and live directories without a renewal configuration, and renewal configurations without any archived
+        versions, are dropped.
+    """
+    removed = []
+    lineages = set()
+
+    renewal_dir = f"{config_dir}/renewal"
+    if isdir(renewal_dir):
+        for entry in scandir(renewal_dir):
+            if entry.name.endswith(".conf"):
+                lineages.add(entry.name[:-5])
+
+    for parent in ("archive", "live"):
+        parent_dir = f"{config_dir}/{parent}"
+        if not isdir(parent_dir):
+            continue
+
+        for entry in scandir(parent_dir):
+            if entry.is_dir(follow_symlinks=False) and entry.name not in lineages:
+                rmtree(entry.path)
+                removed.append(f"{parent}/{entry.name}")
+
+    for lineage in sorted(lineages):
+        versions = lineage_versions(config_dir, lineage)
+        complete = [version for version, filenames in versions.items() if len(filenames) == len(ALL_FILETYPES)]
+        if not complete:
+            log.warning("Lineage %s has no complete archived version; dropping it", lineage)
+            unlink(f"{renewal_dir}/{lineage}.conf")
+            removed.append(f"renewal/{lineage}.conf")
+            for parent in ("archive", "live"):
+                if isdir(f"{config_dir}/{parent}/{lineage}"):
+                    rmtree(f"{config_dir}/{parent}/{lineage}")
+                    removed.append(f"{parent}/{lineage}")
+            continue
+
+        latest = max(complete)
+        keep = set(sorted(versions)[-keep_versions:]) | {latest}
+        for version, filenames in versions.items():
+            if version not in keep:
+                for filename in filenames:
+                    unlink(f"{config_dir}/archive/{lineage}/{filename}")
+                    removed.append(f"archive/{lineage}/{filename}")
+
+        link_live_lineage(config_dir, lineage, latest)
+        rewrite_renewal_conf(config_dir, lineage)
+
+    return removed
+
+
+def scan_config_tree(config_dir: str) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """
+    Return the manifest entries for the certbot config directory: a mapping of each file's relative path to its SHA-256
+    digest and mode, and a mapping of each symbolic link's relative path to its target. A file:// store's sidecar directory
+    is left out.
+    """
+    files = {}
+    links = {}
+
+    for path, dirnames, filenames in walk(config_dir):
+        if path == config_dir and FILESYSTEM_STORE_SIDECAR_DIR in dirnames:
+            dirnames.remove(FILESYSTEM_STORE_SIDECAR_DIR)
+
+        for filename in filenames:
+            pathname = path + "/" + filename
+            relpath = pathname[len(config_dir) + 1:]
+            s = lstat(pathname)
+
+            if S_ISLNK(s.st_mode):
+                links[relpath] = readlink(pathname)
+            else:
+                files[relpath] = {"sha256": file_digest(pathname), "mode": S_IMODE(s.st_mode)}
+
+    return files, links
+
+
+class ConfigStore(ABC):
+    """
+    Persistent storage for the certbot config directory between invocations.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.version: Optional[str] = None  # ETag of the stored copy last restored or saved
+        self.lease_wait = DEFAULT_CONFIG_STORE_LEASE_WAIT
+        # Set by stores that keep the config as a directory a renewal can work on in place, instead of restoring a copy
+        self.config_dir: Optional[str] = None
+
+    @property
+    def lock_key(self) -> str:
+        """
+        Identifies the stored config among the stores used in this container, whatever URL each was given as.
+        """
+        return self.url
+
+    @abstractmethod
+    def restore(self, config_dir: str, lineage: Optional[str], cached_version: Optional[str] = None) -> bool:
+        """
+        Populate config_dir with the stored certbot configuration needed to renew the given lineage (or all of it if lineage
+        is None). Returns False if nothing has been stored yet.
+
+        If cached_version is given, config_dir already holds that version from an earlier invocation in this container, and
+        it is reused rather than downloaded again if it is still current.
+        """
+
+    @abstractmethod
+    def save(self, config_dir: str, work_dir: str) -> Dict[str, CertbotCertificate]:
+        """
+        Persist config_dir if it changed since it was restored and return the live certificate of each complete lineage found
+        in it, keyed by lineage name.
+        """
+
+    @abstractmethod
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        """
+        Return the contents of a named auxiliary object stored alongside the config (e.g., a cache shared by every config in
+        the same location), or None if it doesn't exist.
+        """
+
+    @abstractmethod
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        """
+        Store a named auxiliary object alongside the config.
+        """
+
+    @abstractmethod
+    def delete_sidecar(self, name: str) -> None:
+        """
+        Remove a named auxiliary object stored alongside the config, if it exists.
+        """
+
+    def acquire_lease(self, owner: str, ttl: float) -> Optional[Dict[str, Any]]:
+        """
+        Try to take the lease on the stored config for owner, for ttl seconds (see ConfigStoreLease). Returns None if owner now
+        holds it, or the lease (its owner and expiry time) if another invocation does. Stores that can't be shared by
+        invocations always grant it.
+        """
+        return None
+
+    def release_lease(self, owner: str) -> None:
+        """
+        Give up the lease on the stored config taken by owner, unless it has since been taken over.
+        """
+
+
+class S3ConfigStore(ConfigStore):
+    """
+    Base class for config stores kept in an S3 bucket.
+    """
+
+    def __init__(self, url: str, bucket: str, key: str, kms_key: str) -> None:
+        super().__init__(url)
+        self.bucket = bucket
+        self.key = key
+        self.kms_key = kms_key
+        self.stored_digest: Optional[str] = None
+        self.lease_version: Optional[str] = None  # ETag of the lease object, while this invocation holds it
+
+    def sidecar_key(self, name: str) -> str:
+        """
+        Return the S3 key of the named sidecar object: a sibling of the config object.
+        """
+        return self.key.rsplit("/", 1)[0] + "/" + name if "/" in self.key else name
+
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        try:
+            return get_client("s3").get_object(Bucket=self.bucket, Key=self.sidecar_key(name))["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            raise
+
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        get_client("s3").put_object(
+            ACL="private", Body=data, Bucket=self.bucket, Key=self.sidecar_key(name), ServerSideEncryption="aws:kms",
+            SSEKMSKeyId=self.kms_key)
+
+    def delete_sidecar(self, name: str) -> None:
+        get_client("s3").delete_object(Bucket=self.bucket, Key=self.sidecar_key(name))
+
+    def lease_key(self) -> str:
+        """
+        Return the S3 key of the lease object for this config: unlike the shared sidecars, it belongs to this config alone.
+        """
+        return self.sidecar_key(basename(self.key) + CONFIG_STORE_LEASE_SIDECAR_SUFFIX)
+
+    def put_config(self, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Write the config object with the given PutObject arguments. The write is conditional on the object being the version
+        that was restored (or still not existing), so that an invocation that overlapped another can't undo its save.
+        """
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        condition = {}
+        if s3_conditional_writes():
+            condition = {"IfMatch": self.version} if self.version else {"IfNoneMatch": "*"}
+
+        try:
+            return get_client("s3").put_object(
+                ACL="private", Bucket=self.bucket, Key=self.key, ServerSideEncryption="aws:kms", SSEKMSKeyId=self.kms_key,
+                **condition, **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in S3_CONDITION_ERROR_CODES:
+                raise RuntimeError(f"{self.url} was saved by another invocation since it was restored; not overwriting it") from e
+            raise
+
+    def acquire_lease(self, owner: str, ttl: float) -> Optional[Dict[str, Any]]:
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        if not s3_conditional_writes():
+            log.warning("This boto3 can't make conditional S3 writes, so %s is used without a lease", self.url)
+            return None
+
+        s3 = get_client("s3")
+        key = self.lease_key()
+        while True:
+            lease = {"owner": owner, "expires": time() + ttl}
+            body = json_dumps(lease, sort_keys=True).encode("utf-8")
+            try:
+                self.lease_version = s3.put_object(
+                    ACL="private", Body=body, Bucket=self.bucket, Key=key, ContentType="application/json",
+                    IfNoneMatch="*")["ETag"]
+                return None
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in S3_CONDITION_ERROR_CODES:
+                    raise
+
+            try:
+                result = s3.get_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "NoSuchKey":
+                    continue  # Released in the meantime
+                raise
+
+            holder = json_loads(result["Body"].read())
+            if holder.get("expires", 0) > time():
+                return holder
+
+            # The holder died without releasing the lease. Take it over, unless another invocation just did.
+            print(f"Taking over the expired lease on {self.url} from {holder.get('owner')}")
+            try:
+                self.lease_version = s3.put_object(
+                    ACL="private", Body=body, Bucket=self.bucket, Key=key, ContentType="application/json",
+                    IfMatch=result["ETag"])["ETag"]
+                return None
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in S3_CONDITION_ERROR_CODES:
+                    raise
+
+    def release_lease(self, owner: str) -> None:
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        if not s3_conditional_writes():
+            return
+
+        # Only the lease this invocation wrote is deleted, in one request, so that one taken over since is left to its holder.
+        try:
+            get_client("s3").delete_object(Bucket=self.bucket, Key=self.lease_key(), IfMatch=self.lease_version)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in S3_CONDITION_ERROR_CODES | {"412", "404", "NoSuchKey"}:
+                log.warning("The lease on %s was taken over before %s released it", self.url, owner)
+                return
+            raise
+
+
+class S3TarConfigStore(S3ConfigStore):
+    """
+    Stores the certbot config directory as a single tar object in S3, compressed with gzip or zstd.
+    """
+
+    def __init__(
+            self, url: str, bucket: str, key: str, kms_key: str, compression: str = DEFAULT_ARCHIVE_COMPRESSION,
+            compression_level: Optional[int] = None) -> None:
+        super().__init__(url, bucket, key, kms_key)
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def restore(self, config_dir: str, lineage: Optional[str], cached_version: Optional[str] = None) -> bool:
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        try:
+            result = download_certbot_config(self.bucket, self.key, config_dir, if_none_match=cached_version)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "304":
+                raise
+
+            print(f"Reusing cached copy of {self.url} (ETag {cached_version})")
+            self.version = cached_version
+            self.stored_digest = config_tree_digest(config_dir)
+            return True
+
+        if result is None:
+            return False
+
+        self.version = result.get("ETag")
+        self.stored_digest = result.get("Metadata", {}).get(CONFIG_DIGEST_METADATA) or config_tree_digest(config_dir)
+        return True
+
+    def save(self, config_dir: str, work_dir: str) -> Dict[str, CertbotCertificate]:
+        config_tarfile = f"{work_dir}/config.tar"
+        with Phase("archive"):
+            certbot_certs = create_config_tarfile(config_dir, config_tarfile, self.compression, self.compression_level)
+            config_digest = config_tree_digest(config_dir)
+
+        if artifact_changed("S3", self.url, self.stored_digest, config_digest):
+            metadata = {CONFIG_DIGEST_METADATA: config_digest, ARCHIVE_DIGEST_METADATA: file_digest(config_tarfile)}
+            with Phase("s3-upload"), open(config_tarfile, "rb") as fd:
+                result = self.put_config(Body=fd, Metadata=metadata)
+                count_metric("s3-upload-bytes", fd.tell())
+            self.version = result.get("ETag")
+            self.stored_digest = config_digest
+
+        unlink(config_tarfile)
+        return certbot_certs
+
+
+class S3IncrementalConfigStore(S3ConfigStore):
+    """
+    Stores the certbot config directory in S3 as a JSON manifest mapping each path to the SHA-256 digest of its contents,
+    plus one content-addressed blob object per distinct file. Only blobs that aren't already stored are uploaded, and only
+    the files belonging to the lineage being renewed are downloaded; the rest of the manifest is carried over untouched.
+    """
+
+    def __init__(self, url: str, bucket: str, key: str, kms_key: str, blob_prefix: Optional[str] = None) -> None:
+        super().__init__(url, bucket, key, kms_key)
+        if blob_prefix is None:
+            blob_prefix = key.rsplit("/", 1)[0] + "/blobs/" if "/" in key else "blobs/"
+        self.blob_prefix = blob_prefix
+        self.manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "files": {}, "links": {}}
+        self.wanted: Callable[[str], bool] = lambda relpath: True
+
+    def blob_key(self, digest: str) -> str:
+        """
+        Return the S3 key of the blob with the given SHA-256 digest.
+        """
+        return f"{self.blob_prefix}{digest}"
+
+    def restore(self, config_dir: str, lineage: Optional[str], cached_version: Optional[str] = None) -> bool:
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        try:
+            with Phase("s3-download"):
+                result = get_client("s3").get_object(Bucket=self.bucket, Key=self.key)
+                manifest_json = result["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                clear_directory(config_dir)
+                return False
+            raise
+
+        count_metric("s3-download-bytes", len(manifest_json))
+        self.manifest = json_loads(manifest_json)
+        if self.manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported config manifest version in {self.url}: {self.manifest.get('version')}")
+
+        self.version = result.get("ETag")
+        self.stored_digest = content_digest(manifest_json)
+        if lineage:
+            self.wanted = lineage_path_filter(lineage)
+
+        if cached_version and cached_version == self.version:
+            print(f"Reusing cached copy of {self.url} (ETag {cached_version})")
+            return True
+
+        # Bring config_dir in line with the manifest, fetching only the files that are missing or differ locally.
+        files = {relpath: entry for relpath, entry in self.manifest["files"].items() if self.wanted(relpath)}
+        links = {relpath: target for relpath, target in self.manifest["links"].items() if self.wanted(relpath)}
+        local_files, local_links = scan_config_tree(config_dir)
+
+        for relpath in set(local_files) - set(files):
+            unlink(f"{config_dir}/{relpath}")
+
+        for relpath, target in local_links.items():
+            if links.get(relpath) != target:
+                unlink(f"{config_dir}/{relpath}")
+
+        missing = {relpath: entry for relpath, entry in files.items() if local_files.get(relpath) != entry}
+        if missing:
+            download_blob = bind_metrics(self.download_blob)
+            with Phase("s3-download"), ThreadPoolExecutor(max_workers=min(INCREMENTAL_STORE_MAX_WORKERS, len(missing))) as tpe:
+                futures = [tpe.submit(download_blob, f"{config_dir}/{relpath}", entry) for relpath, entry in missing.items()]
+
+            for future in futures:
+                future.result()
+
+        for relpath, target in links.items():
+            if local_links.get(relpath) != target:
+                pathname = f"{config_dir}/{relpath}"
+                makedirs(dirname(pathname), exist_ok=True)
+                symlink(target, pathname)
+
+        return True
+
+    def download_blob(self, pathname: str, entry: Dict[str, Any]) -> None:
+        """
+        Download the blob for a manifest entry to pathname, verifying its digest.
+        """
+        data = get_client("s3").get_object(Bucket=self.bucket, Key=self.blob_key(entry["sha256"]))["Body"].read()
+        count_metric("s3-download-bytes", len(data))
+        if sha256(data).hexdigest() != entry["sha256"]:
+            raise ValueError(f"Config blob {self.blob_key(entry['sha256'])} in s3://{self.bucket} is corrupt")
+
+        makedirs(dirname(pathname), exist_ok=True)
+        with open(pathname, "wb") as fd:
+            fd.write(data)
+        chmod(pathname, entry["mode"])
+
+    def upload_blob(self, pathname: str, digest: str) -> None:
+        """
+        Upload the file at pathname as the blob with the given digest unless the blob already exists.
+        """
+        ClientError = lazy_import("botocore.exceptions").ClientError
+
+        try:
+            get_client("s3").head_object(Bucket=self.bucket, Key=self.blob_key(digest))
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+
+        print(f"Uploading {pathname} as blob {digest}")
+        with open(pathname, "rb") as fd:
+            get_client("s3").put_object(
+                ACL="private", Body=fd, Bucket=self.bucket, Key=self.blob_key(digest), ServerSideEncryption="aws:kms",
+                SSEKMSKeyId=self.kms_key)
+            count_metric("s3-upload-bytes", fd.tell())
+
+    def save(self, config_dir: str, work_dir: str) -> Dict[str, CertbotCertificate]:
+        files, links = scan_config_tree(config_dir)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "files": {
+                **{relpath: entry for relpath, entry in self.manifest["files"].items() if not self.wanted(relpath)},
+                **files},
+            "links": {
+                **{relpath: target for relpath, target in self.manifest["links"].items() if not self.wanted(relpath)},
+                **links},
+        }
+        manifest_json = json_dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        manifest_digest = content_digest(manifest_json)
+
+        if artifact_changed("S3", self.url, self.stored_digest, manifest_digest):
+            known = {entry["sha256"] for entry in self.manifest["files"].values()}
+            new_blobs = {entry["sha256"]: relpath for relpath, entry in files.items() if entry["sha256"] not in known}
+            if new_blobs:
+                upload_blob = bind_metrics(self.upload_blob)
+                with Phase("s3-upload"), ThreadPoolExecutor(
+                        max_workers=min(INCREMENTAL_STORE_MAX_WORKERS, len(new_blobs))) as tpe:
+                    futures = [tpe.submit(upload_blob, f"{config_dir}/{relpath}", digest) for digest, relpath in new_blobs.items()]
+
+                for future in futures:
+                    future.result()
+
+            # The manifest is written last so it never references a blob that hasn't been stored yet.
+            with Phase("s3-upload"):
+                result = self.put_config(Body=manifest_json, ContentType="application/json")
+            count_metric("s3-upload-bytes", len(manifest_json))
+            self.version = result.get("ETag")
+            self.manifest = manifest
+            self.stored_digest = manifest_digest
+
+        return read_live_certificates(config_dir)
+
+
+class FilesystemConfigStore(ConfigStore):
+    """
+    Keeps the certbot config directory as a plain directory tree on a filesystem: an EFS mount in Lambda, or a local directory
+    for tests and on-premises runners. Renewals work on the tree in place (see config_dir), so there is nothing to archive,
+    download, or upload; a copy restored elsewhere (as compaction does) is mirrored back file by file. Sidecars are files in a
+    reserved subdirectory (FILESYSTEM_STORE_SIDECAR_DIR), since the directory above may not be writable (as for /mnt in
+    Lambda), and the lease is a lock on one of them, which the filesystem (NFS, for EFS) releases if its holder dies.
+    """
+
+    def __init__(self, url: str, path: str) -> None:
+        super().__init__(url)
+        self.path = path
+        self.config_dir = path
+        self.lease_file: Optional[Any] = None  # The locked lease file, while this invocation holds it
+
+    @property
+    def lock_key(self) -> str:
+        # Locks on the lease file are per process, so every spelling of the path (file://localhost/..., symlinks) must share
+        # the lock that keeps a second renewal in this container from taking the lease too and then dropping it on release.
+        return realpath(self.path)
+
+    def restore(self, config_dir: str, lineage: Optional[str], cached_version: Optional[str] = None) -> bool:
+        makedirs(self.path, exist_ok=True)
+        if normpath(config_dir) != normpath(self.path):
+            mirror_config_tree(self.path, config_dir)
+
+        with scandir(self.path) as entries:
+            return any(entry.name != FILESYSTEM_STORE_SIDECAR_DIR for entry in entries)
+
+    def save(self, config_dir: str, work_dir: str) -> Dict[str, CertbotCertificate]:
+        if normpath(config_dir) != normpath(self.path):
+            mirror_config_tree(config_dir, self.path)
+
+        return read_live_certificates(self.path)
+
+    def sidecar_path(self, name: str) -> str:
+        """
+        Return the path of the named sidecar file in the store's sidecar directory.
+        """
+        return join(self.path, FILESYSTEM_STORE_SIDECAR_DIR, name)
+
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self.sidecar_path(name), "rb") as fd:
+                return fd.read()
+        except FileNotFoundError:
+            return None
+
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        # Written to a temporary file and renamed into place, so readers never see a partial file.
+        pathname = self.sidecar_path(name)
+        temp_pathname = f"{pathname}.{uuid4().hex}.tmp"
+        makedirs(dirname(pathname), exist_ok=True)
+        with open(temp_pathname, "wb") as fd:
+            chmod(temp_pathname, 0o600)
+            fd.write(data)
+        replace(temp_pathname, pathname)
+
+    def delete_sidecar(self, name: str) -> None:
+        try:
+            unlink(self.sidecar_path(name))
+        except FileNotFoundError:
+            pass
+
+    def acquire_lease(self, owner: str, ttl: float) -> Optional[Dict[str, Any]]:
+        # The lock lasts as long as the file is held open, so ttl isn't needed.
+        pathname = self.sidecar_path("config" + CONFIG_STORE_LEASE_SIDECAR_SUFFIX)
+        makedirs(dirname(pathname), exist_ok=True)
+        lease_file = open(pathname, "a+")
+        try:
+            lockf(lease_file.fileno(), LOCK_EX | LOCK_NB)
+        except OSError:
+            lease_file.seek(0)
+            holder = lease_file.read()
+            lease_file.close()
+            try:
+                return json_loads(holder)
+            except ValueError:
+                # Empty, or still being written by the holder.
+                return {"owner": None}
+
+        lease_file.seek(0)
+        lease_file.truncate()
+        lease_file.write(json_dumps({"owner": owner}))
+        lease_file.flush()
+        self.lease_file = lease_file
+        return None
+
+    def release_lease(self, owner: str) -> None:
+        if self.lease_file is None:
+            return
+
+        try:
+            self.lease_file.truncate(0)
+            lockf(self.lease_file.fileno(), LOCK_UN)
+        finally:
+            self.lease_file.close()
+            self.lease_file = None
+
+
+def mirror_config_tree(src_dir: str, dst_dir: str) -> None:
+    """
+    Make dst_dir an exact copy of the certbot config tree in src_dir, copying only the files that are missing or differ. Each
+    file is copied to a temporary name and renamed into place, so a copy interrupted part way never leaves a truncated file.
+    """
+    files, links = scan_config_tree(src_dir)
+    dst_files, dst_links = scan_config_tree(dst_dir) if isdir(dst_dir) else ({}, {})
+
+    for relpath in set(dst_files) - set(files):
+        unlink(f"{dst_dir}/{relpath}")
+
+    for relpath, target in dst_links.items():
+        if links.get(relpath) != target:
+            unlink(f"{dst_dir}/{relpath}")
+
+    for relpath, entry in files.items():
+        if dst_files.get(relpath) != entry:
+            pathname = f"{dst_dir}/{relpath}"
+            temp_pathname = f"{pathname}.{uuid4().hex}.tmp"
+            makedirs(dirname(pathname), exist_ok=True)
+            copyfile(f"{src_dir}/{relpath}", temp_pathname)
+            chmod(temp_pathname, entry["mode"])
+            replace(temp_pathname, pathname)
+
+    for relpath, target in links.items():
+        if dst_links.get(relpath) != target:
+            pathname = f"{dst_dir}/{relpath}"
+            makedirs(dirname(pathname), exist_ok=True)
+            symlink(target, pathname)
+
+    # Drop the directories left empty (by compaction, say), deepest first.
+    sidecar_dir = join(dst_dir, FILESYSTEM_STORE_SIDECAR_DIR)
+    for path, _, _ in walk(dst_dir, topdown=False):
+        if path != dst_dir and not (path + "/").startswith(sidecar_dir + "/"):
+            try:
+                rmdir(path)
+            except OSError:
+                pass  # Not empty
+
+
+def s3_conditional_writes() -> bool:
+    """
+    Indicates whether the boto3 in use can make conditional S3 writes (If-Match and If-None-Match on PutObject, and If-Match
+    on DeleteObject to release a lease). Older releases, such as the one bundled with the python3.8 runtime, can't; config
+    stores are then saved unconditionally and used without a lease.
+    """
+    service_model = get_client("s3").meta.service_model
+    return ("IfNoneMatch" in service_model.operation_model("PutObject").input_shape.members and
+            "IfMatch" in service_model.operation_model("DeleteObject").input_shape.members)
+
+
+class ConfigStoreLease:
+    """
+    Lease on a config store, held while a renewal (or compaction) restores, changes, and saves it so that overlapping
+    invocations (retries, manual runs, batch shards) don't both order a certificate and then overwrite each other's config.
+    Renewals in this container sharing the store queue on a lock for as long as it takes, since each of them has its own work
+    to do. Other invocations are kept out by the store itself (see ConfigStore.acquire_lease), and are polled for until the
+    store's lease wait runs out. If the lease isn't acquired by then, holder is set to the lease that is in the way and the
+    caller should leave the work to its holder.
+    """
+
+    def __init__(self, config_store: ConfigStore) -> None:
+        self.config_store = config_store
+        self.owner = f"{environ.get('AWS_LAMBDA_LOG_STREAM_NAME') or gethostname()}/{uuid4().hex}"
+        self.holder: Optional[Dict[str, Any]] = None
+        self.held = False
+
+        with config_store_locks_lock:
+            self.lock = config_store_locks.setdefault(config_store.lock_key, Lock())
+
+    def __enter__(self) -> "ConfigStoreLease":
+        self.lock.acquire()
+        deadline = monotonic() + self.config_store.lease_wait
+        try:
+            while True:
+                holder = self.config_store.acquire_lease(self.owner, CONFIG_STORE_LEASE_TTL)
+                if holder is None:
+                    self.held = True
+                    return self
+
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self.holder = holder
+                    self.lock.release()
+                    return self
+
+                sleep(min(uniform(0.5, 1.0) * CONFIG_STORE_LEASE_POLL, remaining))
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if not self.held:
+            return
+
+        try:
+            self.config_store.release_lease(self.owner)
+        finally:
+            self.held = False
+            self.lock.release()
+
+
+class WarmWorkspace:
+    """
+    Working directory (config, work, and log) for one config store that persists in /tmp across invocations handled by the
+    same warm container. When a renewal finishes cleanly, the config store version left in the directory is recorded so the
+    next invocation can reuse the extracted config instead of downloading it again. If a renewal fails part way, the
+    directory can't be trusted and is discarded.
+    """
+
+    def __init__(self, key: str, config_dir: Optional[str] = None) -> None:
+        self.base_dir = f"{WARM_CACHE_DIR}/{content_digest(key.encode('utf-8'))[:32]}"
+        self.config_dir = config_dir or f"{self.base_dir}/config"
+        self.work_dir = f"{self.base_dir}/work"
+        self.log_dir = f"{self.base_dir}/log"
+        self.version_file = f"{self.base_dir}/version"
+        self.cached_version: Optional[str] = None
+        self.version: Optional[str] = None
+
+        with workspace_locks_lock:
+            self.lock = workspace_locks.setdefault(self.base_dir, Lock())
+
+    def __enter__(self) -> "WarmWorkspace":
+        self.lock.acquire()
+        try:
+            if lexists(self.version_file):
+                with open(self.version_file, "r") as fd:
+                    self.cached_version = fd.read().strip() or None
+
+                # The directory is dirty until this renewal finishes cleanly.
+                unlink(self.version_file)
+
+            if isdir(self.log_dir):
+                rmtree(self.log_dir)
+
+            for path in (self.config_dir, self.work_dir, self.log_dir):
+                makedirs(path, exist_ok=True)
+
+            utime(self.base_dir)
+        except BaseException:
+            self.lock.release()
+            raise
+
+        evict_warm_workspaces()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        try:
+            if exc_type is not None:
+                rmtree(self.base_dir, ignore_errors=True)
+            elif self.version:
+                with open(self.version_file, "w") as fd:
+                    fd.write(self.version)
+        finally:
+            self.lock.release()
+
+
+def evict_warm_workspaces() -> None:
+    """
+    Remove the least recently used warm workspaces beyond WARM_CACHE_MAX_ENTRIES, skipping any that are in use.
+    """
+    entries = sorted(scandir(WARM_CACHE_DIR), key=lambda entry: entry.stat(follow_symlinks=False).st_mtime, reverse=True)
+
+    for entry in entries[WARM_CACHE_MAX_ENTRIES:]:
+        with workspace_locks_lock:
+            lock = workspace_locks.setdefault(entry.path, Lock())
+
+        if lock.acquire(blocking=False):
+            try:
+                rmtree(entry.path, ignore_errors=True)
+            finally:
+                lock.release()
+
+
+def config_store_from_event(event: Dict[str, Any], errors: List[str]) -> Optional[ConfigStore]:
+    """
+    Return the config store described by the config-store-* fields of an event. Problems with those fields are appended to
+    errors and None is returned.
+    """
+    config_store_url = event.get("config-store-url")
+    config_store_kms_key = event.get("config-store-kms-key", DEFAULT_KMS_KEY)
+    config_store_format = event.get("config-store-format", DEFAULT_CONFIG_STORE_FORMAT)
+    config_store_blob_prefix = event.get("config-store-blob-prefix")
+    config_store_compression = event.get("config-store-compression", DEFAULT_ARCHIVE_COMPRESSION)
+    config_store_compression_level = event.get("config-store-compression-level")
+    config_store_lease_wait = event.get("config-store-lease-wait-seconds", DEFAULT_CONFIG_STORE_LEASE_WAIT)
+
+    if config_store_format not in CONFIG_STORE_FORMATS:
+        errors.append(f"config-store-format must be one of {', '.join(CONFIG_STORE_FORMATS)}: {config_store_format}")
+        return None
+
+    if config_store_compression not in ARCHIVE_COMPRESSIONS:
+        errors.append(
+            f"config-store-compression must be one of {', '.join(ARCHIVE_COMPRESSIONS)}: {config_store_compression}")
+        return None
+
+    if config_store_compression_level is not None:
+        min_level, max_level, _ = ARCHIVE_COMPRESSIONS[config_store_compression]
+        if (not isinstance(config_store_compression_level, int) or
+                not min_level <= config_store_compression_level <= max_level):
+            errors.append(
+                f"config-store-compression-level must be an integer from {min_level} to {max_level} for "
+                f"{config_store_compression}: {config_store_compression_level}")
+            return None
+
+    if not isinstance(config_store_lease_wait, (int, float)) or config_store_lease_wait < 0:
+        errors.append(f"config-store-lease-wait-seconds must be a non-negative number: {config_store_lease_wait}")
+        return None
+
+    if not config_store_url:
+        errors.append("config-store-url must be specified")
+        return None
+
+    scheme = urlparse(config_store_url).scheme
+    if scheme not in CONFIG_STORE_SCHEMES:
+        errors.append(f"config-store-url must be an {' or '.join(f'{s}://' for s in CONFIG_STORE_SCHEMES)} url: {config_store_url}")
+        return None
+
+    config_store: ConfigStore
+    if scheme == "file":
+        parsed = urlparse(config_store_url)
+        if parsed.netloc not in ("", "localhost") or not parsed.path.startswith("/") or normpath(parsed.path) == "/":
+            errors.append(f"config-store-url is not a valid file:// url (file:///absolute/path): {config_store_url}")
+            return None
+
+        config_store = FilesystemConfigStore(config_store_url, normpath(unquote(parsed.path)))
+        config_store.lease_wait = config_store_lease_wait
+        return config_store
+
+    m = fullmatch(r"s3://([a-z0-9][-\.a-z0-9]*)/(.*)", config_store_url)
+    if not m:
+        errors.append("config-store-url is not a valid s3:// url")
+        return None
+
+    config_bucket = m.group(1)
+    config_key = m.group(2)
+
+    if config_store_format == "incremental":
+        config_store = S3IncrementalConfigStore(
+            config_store_url, config_bucket, config_key, config_store_kms_key, config_store_blob_prefix)
+    else:
+        config_store = S3TarConfigStore(
+            config_store_url, config_bucket, config_key, config_store_kms_key, config_store_compression,
+            config_store_compression_level)
+
+    config_store.lease_wait = config_store_lease_wait
+    return config_store
+
+
+def acm_targets_from_event(event: Dict[str, Any], errors: List[str]) -> List[AcmTarget]:
+    """
+    Return the ACM certificates a renewal imports into, as described by the acm-regions, acm-certificate-arn, and
+    acm-certificate-filters fields of an event: one per acm-regions entry, or just one in the function's own region. Problems
+    with those fields are appended to errors.
+    """
+    regions = event.get("acm-regions")
+    arn = event.get("acm-certificate-arn")
+    filters = event.get("acm-certificate-filters") or {}
+
+    if regions is None:
+        return [AcmTarget(region=None, arn=arn, filters=filters)]
+
+    if not isinstance(regions, list) or not regions:
+        errors.append(f"acm-regions must be a non-empty list: {regions}")
+        return []
+
+    if arn:
+        errors.append("acm-certificate-arn can't be used with acm-regions; set it for each region instead")
+
+    targets = []
+    seen: Set[str] = set()
+    for entry in regions:
+        if isinstance(entry, str):
+            entry = {"region": entry}
+
+        region = entry.get("region") if isinstance(entry, dict) else None
+        if not isinstance(region, str) or not fullmatch(r"[a-z]{2}(?:-[a-z]+)+-[0-9]+", region):
+            errors.append(f"acm-regions entries must be a region name or an object with a region: {entry}")
+            continue
+
+        if region in seen:
+            errors.append(f"acm-regions lists {region} more than once")
+            continue
+
+        seen.add(region)
+
+        # Filters apply in every region, but an ARN only in its own.
+        target_arn = entry.get("acm-certificate-arn")
+        target_filters = entry.get("acm-certificate-filters") or ({} if target_arn else filters)
+        if not target_arn and not target_filters:
+            errors.append(
+                f"acm-regions entry for {region} needs acm-certificate-arn or acm-certificate-filters (its own or the event's)")
+            continue
+
+        targets.append(AcmTarget(region=region, arn=target_arn, filters=target_filters))
+
+    return targets
+
+
+def retry_throttled(call: Callable[[], T], description: str) -> T:
+    """
+    Invoke an AWS API call, retrying with exponential backoff and full jitter while the service reports throttling.
+    """
+    ClientError = lazy_import("botocore.exceptions").ClientError
+
+    attempt = 1
+    while True:
+        try:
+            return call()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt >= THROTTLE_MAX_ATTEMPTS:
+                raise
+
+            delay = uniform(0, min(THROTTLE_MAX_DELAY, THROTTLE_BASE_DELAY * 2 ** attempt))
+            log.warning("%s throttled (attempt %d); retrying in %.2f s", description, attempt, delay)
+            sleep(delay)
+            attempt += 1
+
+
+def get_ssm_parameters(names: List[str]) -> Dict[str, str]:
+    """
+    Return the current values of the given SSM parameters, fetched in as few GetParameters calls as possible. Parameters that
+    don't exist are omitted.
+    """
+    ssm = get_client("ssm")
+    values = {}
+
+    for start in range(0, len(names), SSM_GET_PARAMETERS_MAX_NAMES):
+        batch = names[start:start + SSM_GET_PARAMETERS_MAX_NAMES]
+        result = retry_throttled(lambda: ssm.get_parameters(Names=batch, WithDecryption=True), "ssm:GetParameters")
+        for parameter in result.get("Parameters", []):
+            values[parameter["Name"]] = parameter["Value"]
+
+    return values
+
+
+def ssm_parameters_for_certificate(
+        prefix: str, domains: List[str], certbot_cert: CertbotCertificate, kms_key: str, tier: str) -> List[SsmParameter]:
+    """
+    Return the SSM parameters to publish for a certificate under the given prefix.
+    """
+    if not prefix.startswith("/"):
+        prefix = "/" + prefix
+    if not prefix.endswith("/"):
+        prefix = prefix + "/"
+
+    return [
+        SsmParameter(
+            name=f"{prefix}{suffix}", description=f"{description} for {' '.join(domains)}",
+            value=getattr(certbot_cert, field).decode("utf-8"), tier=tier, kms_key=kms_key if secret else None)
+        for suffix, description, field, secret in SSM_PARAMETERS]
+
+
+def publish_ssm_parameters(parameters: List[SsmParameter]) -> List[str]:
+    """
+    Write the given SSM parameters (which may span any number of certificates and prefixes), returning the names of those
+    written. Existing values are fetched in bulk, parameters whose values are unchanged are skipped, and the rest are written
+    concurrently, backing off when SSM throttles.
+    """
+    existing = get_ssm_parameters([parameter.name for parameter in parameters])
+    changed = []
+
+    for parameter in parameters:
+        stored = existing.get(parameter.name)
+        stored_digest = content_digest(stored.encode("utf-8")) if stored is not None else None
+        if artifact_changed("SSM", parameter.name, stored_digest, content_digest(parameter.value.encode("utf-8"))):
+            changed.append(parameter)
+
+    if not changed:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(SSM_PUBLISH_MAX_WORKERS, len(changed))) as tpe:
+        futures = [tpe.submit(bind_metrics(put_ssm_parameter), parameter) for parameter in changed]
+
+    for future in futures:
+        future.result()
+
+    return [parameter.name for parameter in changed]
+
+
+def run_publish_sinks(sinks: Dict[str, Callable[[], Any]]) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Run the sinks a renewal publishes to (saving the config, importing into ACM, publishing to SSM) concurrently, each timed
+    as a phase of its own name. Every sink runs to completion whether or not the others fail, so the config is saved even if
+    publishing fails. Returns the results of the sinks that succeeded and the errors of those that failed, both keyed by name.
+    """
+    def run(name: str, sink: Callable[[], Any]) -> Any:
+        with Phase(name):
+            return sink()
+
+    with ThreadPoolExecutor(max_workers=len(sinks)) as tpe:
+        futures = {name: tpe.submit(bind_metrics(run), name, sink) for name, sink in sinks.items()}
+
+    published: Dict[str, Any] = {}
+    failed: Dict[str, Exception] = {}
+    for name, future in futures.items():
+        try:
+            published[name] = future.result()
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Failed to publish to %s", name)
+            failed[name] = e
+
+    return published, failed
+
+
+def put_ssm_parameter(parameter: SsmParameter) -> None:
+    """
+    Write a single SSM parameter, backing off when SSM throttles.
+    """
+    type_args = {"Type": "SecureString", "KeyId": parameter.kms_key} if parameter.kms_key else {"Type": "String"}
+    retry_throttled(
+        lambda: get_client("ssm").put_parameter(
+            Name=parameter.name, Description=parameter.description, Overwrite=True, Value=parameter.value, Tier=parameter.tier,
+            **type_args),
+        f"ssm:PutParameter {parameter.name}")
+
+
+def content_digest(*parts: bytes) -> str:
+    """
+    Return the SHA-256 digest of the given byte strings as a hex string. Each part is length-prefixed so that distinct
+    sequences of parts never produce the same digest.
+    """
+    h = sha256()
+    for part in parts:
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+
+    return h.hexdigest()
+
+
+def file_digest(pathname: str) -> str:
+    """
+    Return the SHA-256 digest of a file's contents as a hex string.
+    """
+    h = sha256()
+    with open(pathname, "rb") as fd:
+        for chunk in iter(lambda: fd.read(65536), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def config_tree_digest(config_dir: str) -> str:
+    """
+    Return a SHA-256 digest of the certbot config directory covering every file's path, mode, and contents and every symbolic
+    link's target. Unlike a digest of the tar archive, this doesn't change when only timestamps do.
+    """
+    h = sha256()
+
+    for path, dirnames, filenames in walk(config_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            pathname = path + "/" + filename
+            relpath = pathname[len(config_dir) + 1:]
+            s = lstat(pathname)
+
+            if S_ISLNK(s.st_mode):
+                kind = "link"
+                body = readlink(pathname).encode("utf-8")
+            else:
+                kind = "file"
+                with open(pathname, "rb") as fd:
+                    body = fd.read()
+
+            h.update(f"{kind} {s.st_mode:o} {len(body)} {relpath}\0".encode("utf-8"))
+            h.update(body)
+
+    return h.hexdigest()
+
+
+def artifact_changed(sink: str, name: str, stored_digest: Optional[str], digest: str) -> bool:
+    """
+    Indicates whether an artifact whose content digest is digest needs to be written to the given sink (S3, ACM, or SSM)
+    when the copy already there has stored_digest (None if there is no copy or its digest is unknown).
+    """
+    if stored_digest == digest:
+        print(f"{sink} {name} is unchanged (sha256 {digest}); skipping write")
+        return False
+
+    return True
+
+
+def get_acm_certificate_digest(arn: str, region: Optional[str] = None) -> Optional[str]:
+    """
+    Return the content digest recorded on an ACM certificate by a previous import, or None if it wasn't recorded.
+    """
+    tags = get_client("acm", region).list_tags_for_certificate(CertificateArn=arn).get("Tags", [])
+    for tag in tags:
+        if tag["Key"] == ACM_DIGEST_TAG:
+            return tag.get("Value")
+
+    return None
+
+
+def certificate_is_due(not_after: datetime, names: Iterable[str], domains: List[str], renewal_window_days: float) -> bool:
+    """
+    Indicates whether a certificate expiring at not_after and covering the given names needs to be renewed. A certificate
+    whose names differ from the requested domains is always due.
+    """
+    if {name.lower() for name in names} != {domain.lower() for domain in domains}:
+        return True
+
+    return not_after - timedelta(days=renewal_window_days) <= datetime.now(timezone.utc)
+
+
+def get_acm_certificate_expiry(arn: str, region: Optional[str] = None) -> Optional[CertificateExpiry]:
+    """
+    Return the expiration time and names of the given ACM certificate, or None if it has not been issued or imported yet.
+    """
+    summary = get_acm_index(region).get(arn)
+    if summary is not None and summary.get("NotAfter") and not summary.get("HasAdditionalSubjectAlternativeNames"):
+        return CertificateExpiry(not_after=summary["NotAfter"], names=summary.get("SubjectAlternativeNameSummaries", []))
+
+    certificate = get_client("acm", region).describe_certificate(CertificateArn=arn)["Certificate"]
+    not_after = certificate.get("NotAfter")
+    if not_after is None:
+        return None
+
+    return CertificateExpiry(not_after=not_after, names=certificate.get("SubjectAlternativeNames", []))
+
+
+def import_acm_certificate(certbot_cert: CertbotCertificate, target: AcmTarget) -> Dict[str, Any]:
+    """
+    Import a certificate into ACM in the target's region, replacing the target's certificate if it has one and doesn't already
+    hold this one. Returns the region's result: its status (renewed or unchanged) and certificate ARN.
+    """
+    arn = target.arn
+    certificate_digest = content_digest(certbot_cert.certificate, certbot_cert.chain)
+    stored_certificate_digest = get_acm_certificate_digest(arn, target.region) if arn else None
+    status = "unchanged"
+
+    sink = f"ACM {target.region}" if target.region else "ACM"
+    if artifact_changed(sink, arn or "certificate", stored_certificate_digest, certificate_digest):
+        acm_args = {}
+        if arn:
+            acm_args["CertificateArn"] = arn
+        acm = get_client("acm", target.region)
+        import_result = acm.import_certificate(
+            Certificate=certbot_cert.certificate, CertificateChain=certbot_cert.chain, PrivateKey=certbot_cert.private_key,
+            **acm_args)
+        arn = import_result["CertificateArn"]
+        acm.add_tags_to_certificate(CertificateArn=arn, Tags=[{"Key": ACM_DIGEST_TAG, "Value": certificate_digest}])
+        if target.arn:
+            get_acm_index(target.region).invalidate(arn)
+        else:
+            # A new certificate has to be findable by its filters at once, or the next lookup would import another one.
+            get_acm_index(target.region).refresh(arn)
+        status = "renewed"
+
+    return {"region": target.region, "status": status, "certificate-arn": arn}
+
+
+def import_acm_certificates(certbot_cert: CertbotCertificate, targets: List[AcmTarget]) -> List[Dict[str, Any]]:
+    """
+    Import a certificate into every target's region concurrently, returning each region's result. A region that fails is
+    reported as failed, with the error, without affecting the others.
+    """
+    with ThreadPoolExecutor(max_workers=len(targets)) as tpe:
+        futures = [tpe.submit(bind_metrics(import_acm_certificate), certbot_cert, target) for target in targets]
+
+    results = []
+    for target, future in zip(targets, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Failed to import the certificate into ACM in %s", target.region)
+            results.append({"region": target.region, "status": "failed", "certificate-arn": target.arn, "error": str(e)})
+
+    return results
+
+
+def key_type_targets(targets: List[AcmTarget], key_spec: KeySpec) -> List[AcmTarget]:
+    """
+    Return the targets with filters that don't name a key type narrowed to the key type being renewed, if ListCertificates
+    doesn't return it by default (ECDSA or RSA_4096, say), so the certificate imported by an earlier renewal is found again.
+    """
+    key_type = acm_key_type(key_spec)
+    if key_type in DEFAULT_ACM_KEY_TYPES:
+        return targets
+
+    return [
+        target._replace(filters={**target.filters, "key-type": [key_type]})
+        if target.filters and not filter_values(target.filters, "key-type") else target
+        for target in targets]
+
+
+def resolve_acm_targets(targets: List[AcmTarget]) -> List[AcmTarget]:
+    """
+    Find the existing certificate of each target that has an ARN or filters, looking in every region concurrently.
+    """
+    def resolve(target: AcmTarget) -> AcmTarget:
+        if not (target.arn or target.filters):
+            return target
+        return target._replace(arn=find_existing_certificate(target.arn, target.filters, target.region))
+
+    if len(targets) == 1:
+        return [resolve(targets[0])]
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as tpe:
+        futures = [tpe.submit(bind_metrics(resolve), target) for target in targets]
+
+    return [future.result() for future in futures]
+
+
+def get_live_certificate_expiry(
+        config_dir: str, domains: List[str], lineage: Optional[str] = None) -> Optional[CertificateExpiry]:
+    """
+    Return the expiration time and names of the live certificate in the certbot config directory that covers the given
+    domains (only looking at the given lineage and its moved -NNNN copies, if set), or None if there is no such certificate.
+    """
+    wanted = {domain.lower() for domain in domains}
+    in_lineage = lineage_path_filter(lineage) if lineage else lambda relpath: True
+
+    for path, _, filenames in walk(config_dir):
+        for filename in filenames:
+            pathname = path + "/" + filename
+            relpath = pathname[len(config_dir) + 1:]
+            m = LIVE_FILE_MATCHER.fullmatch(relpath)
+            if not m or m.group("filetype") != "cert" or not in_lineage(relpath):
+                continue
+
+            with open(pathname, "rb") as fd:
+                expiry = certificate_expiry(fd.read())
+
+            if expiry is not None and {name.lower() for name in expiry.names} == wanted:
+                return expiry
+
+    return None
+
+
+def certificate_expiry(pem: bytes) -> Optional[CertificateExpiry]:
+    """
+    Return the expiration time and names of a PEM certificate, or None if it has no DNS names.
+    """
+    x509 = lazy_import("cryptography.x509")
+    cert = x509.load_pem_x509_certificate(pem)
+
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        names = san.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        return None
+
+    # cryptography 42 added the timezone-aware accessor; older releases return a naive UTC datetime.
+    not_after = getattr(cert, "not_valid_after_utc", None) or cert.not_valid_after.replace(tzinfo=timezone.utc)
+    return CertificateExpiry(not_after=not_after, names=names)
+
+
+def acme_account_dir(config_dir: str, endpoint: str) -> str:
+    """
+    Return the directory certbot keeps its accounts for the given ACME server in.
+    """
+    parsed = urlparse(endpoint)
+    return f"{config_dir}/accounts/{parsed.netloc}{parsed.path}"
+
+
+def load_acme_account(config_dir: str, endpoint: str) -> Optional[Tuple[str, Any, Any]]:
+    """
+    Return the account id, key, and registration of the first certbot account for the given ACME server in the config
+    directory, or None if there isn't one.
+    """
+    account_dir = acme_account_dir(config_dir, endpoint)
+    if not isdir(account_dir):
+        return None
+
+    for entry in sorted(scandir(account_dir), key=lambda entry: entry.name):
+        if not entry.is_dir() or not lexists(f"{entry.path}/private_key.json") or not lexists(f"{entry.path}/regr.json"):
+            continue
+
+        with open(f"{entry.path}/private_key.json", "r") as fd:
+            key = lazy_import("josepy").JWK.json_loads(fd.read())
+
+        with open(f"{entry.path}/regr.json", "r") as fd:
+            regr = lazy_import("acme.messages").RegistrationResource.json_loads(fd.read())
+
+        return entry.name, key, regr
+
+    return None
+
+
+def save_acme_account(config_dir: str, endpoint: str, key: Any, regr: Any) -> str:
+    """
+    Write a newly registered ACME account to the config directory in certbot's format, returning its account id.
+    """
+    serialization = lazy_import("cryptography.hazmat.primitives.serialization")
+    public_key = key.key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    account_id = md5(public_key).hexdigest()
+
+    account_dir = f"{acme_account_dir(config_dir, endpoint)}/{account_id}"
+    makedirs(account_dir, mode=0o700, exist_ok=True)
+
+    meta = {"creation_dt": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "creation_host": gethostname()}
+    with open(f"{account_dir}/meta.json", "w") as fd:
+        fd.write(json_dumps(meta))
+
+    with open(f"{account_dir}/regr.json", "w") as fd:
+        fd.write(json_dumps({"body": {}, "uri": regr.uri}))
+
+    with open(f"{account_dir}/private_key.json", "w") as fd:
+        fd.write(key.json_dumps())
+    chmod(f"{account_dir}/private_key.json", 0o400)
+
+    return account_id
+
+
+def get_acme_client(config_dir: str, endpoint: str, email: Optional[str]) -> Tuple[Any, str]:
+    """
+    Return an ACME client for the certbot account stored in the config directory, and the account's id. If there is no account
+    for the server yet, one is registered and saved. Clients are shared by every thread and warm invocation in this container,
+    so the server directory is only fetched once per account.
+    """
+    client_module = lazy_import("acme.client")
+    account = load_acme_account(config_dir, endpoint)
+
+    if account is not None:
+        account_id, key, regr = account
+        with acme_clients_lock:
+            client = acme_clients.get((endpoint, account_id))
+        if client is not None:
+            return client, account_id
+
+        net = client_module.ClientNetwork(key, account=regr, user_agent=ACME_USER_AGENT)
+        client = client_module.ClientV2(client_module.ClientV2.get_directory(endpoint, net), net)
+    else:
+        rsa = lazy_import("cryptography.hazmat.primitives.asymmetric.rsa")
+        key = lazy_import("josepy").JWKRSA(key=rsa.generate_private_key(public_exponent=65537, key_size=ACME_ACCOUNT_KEY_SIZE))
+        net = client_module.ClientNetwork(key, user_agent=ACME_USER_AGENT)
+        client = client_module.ClientV2(client_module.ClientV2.get_directory(endpoint, net), net)
+        registration = lazy_import("acme.messages").NewRegistration.from_data(email=email, terms_of_service_agreed=True)
+        regr = client.new_account(registration)
+        account_id = save_acme_account(config_dir, endpoint, key, regr)
+        print(f"Registered ACME account {regr.uri} with {endpoint}")
+
+    with acme_clients_lock:
+        return acme_clients.setdefault((endpoint, account_id), client), account_id
+
+
+class HostedZoneIndex:
+    """
+    In-process index of the account's public Route53 hosted zones: a suffix trie keyed by DNS label, right to left, so that the
+    best (longest) matching zone for any name is found without an API call. It is built with one paginated ListHostedZones
+    pass and shared by every certificate renewed in this container until the TTL expires. A name with no matching zone forces
+    a rebuild, in case the zone was just created, if the index is more than ROUTE53_ZONE_INDEX_MISS_REFRESH seconds old. The
+    zone list can also be saved alongside the config and loaded on a cold start while it is still within the TTL.
+    """
+
+    def __init__(self, ttl: float = ROUTE53_ZONE_INDEX_TTL) -> None:
+        self.ttl = ttl
+        self.lock = Lock()
+        self.built_at: Optional[float] = None  # Wall clock time the zone list was fetched
+        self.zones: Dict[str, str] = {}
+        self.trie: Dict[str, Any] = {}
+        self.unsaved = False
+
+    def set_zones(self, zones: Dict[str, str], built_at: float) -> None:
+        """
+        Replace the indexed zones (name to id). Called with the lock held.
+        """
+        self.zones = zones
+        self.trie = {}
+        for zone_name, zone_id in zones.items():
+            node = self.trie
+            for label in reversed(zone_name.rstrip(".").split(".")):
+                node = node.setdefault(label, {})
+            # "." can't appear in a label, so it marks the node of a zone apex.
+            node["."] = zone_id
+
+        self.built_at = built_at
+
+    def build(self) -> None:
+        """
+        Rebuild the index from ListHostedZones. Called with the lock held.
+        """
+        zones: Dict[str, str] = {}
+        print("Calling list_hosted_zones to build the Route53 hosted zone index")
+        for page in get_client("route53").get_paginator("list_hosted_zones").paginate():
+            for zone in page["HostedZones"]:
+                if not zone.get("Config", {}).get("PrivateZone"):
+                    zones.setdefault(zone["Name"].lower(), zone["Id"])
+
+        self.set_zones(zones, time())
+        self.unsaved = True
+
+    def expired(self) -> bool:
+        """
+        Indicates whether the index needs to be (re)built. Called with the lock held.
+        """
+        return self.built_at is None or time() - self.built_at >= self.ttl
+
+    def refresh(self) -> None:
+        """
+        Rebuild the index now, regardless of its age.
+        """
+        with self.lock:
+            self.build()
+
+    def lookup(self, name: str) -> Optional[str]:
+        """
+        Return the id of the longest zone that name falls under, or None. Called with the lock held.
+        """
+        zone_id = None
+        node = self.trie
+        for label in reversed(name.lower().rstrip(".").split(".")):
+            child = node.get(label)
+            if child is None:
+                break
+            node = child
+            zone_id = node.get(".", zone_id)
+
+        return zone_id
+
+    def find(self, name: str) -> str:
+        """
+        Return the id of the public hosted zone with the longest name that is a suffix of the given DNS name.
+        """
+        with self.lock:
+            if self.expired():
+                self.build()
+
+            zone_id = self.lookup(name)
+            if zone_id is None and time() - (self.built_at or 0) >= ROUTE53_ZONE_INDEX_MISS_REFRESH:
+                self.build()
+                zone_id = self.lookup(name)
+
+        if zone_id is None:
+            raise ValueError(f"No Route53 hosted zone found for {name}")
+
+        return zone_id
+
+    def resolve(self, names: Iterable[str]) -> Dict[str, str]:
+        """
+        Map each of the given DNS names to its hosted zone id.
+        """
+        return {name: self.find(name) for name in names}
+
+    def load(self, config_store: ConfigStore) -> None:
+        """
+        Adopt the zone list saved alongside the given config store if this container hasn't built a current index yet and
+        the saved list is still within the TTL.
+        """
+        with self.lock:
+            if not self.expired():
+                return
+
+        data = config_store.read_sidecar(ROUTE53_ZONE_INDEX_SIDECAR)
+        if data is None:
+            return
+
+        saved = json_loads(data)
+        with self.lock:
+            if self.expired() and time() - saved["built-at"] < self.ttl:
+                self.set_zones(saved["zones"], saved["built-at"])
+                self.unsaved = False
+
+    def save(self, config_store: ConfigStore) -> None:
+        """
+        Save the zone list alongside the given config store if it was rebuilt since it was last loaded or saved.
+        """
+        with self.lock:
+            if not self.unsaved:
+                return
+            data = json_dumps({"built-at": self.built_at, "zones": self.zones}, sort_keys=True).encode("utf-8")
+            self.unsaved = False
+
+        config_store.write_sidecar(ROUTE53_ZONE_INDEX_SIDECAR, data)
+
+
+# Shared by every certificate renewed by this container
+hosted_zone_index = HostedZoneIndex()
+
+
+def change_dns_txt_records(action: str, records: Dict[str, List[str]], wait: bool = True) -> None:
+    """
+    Apply an UPSERT or DELETE of the given TXT records (name to values) in Route53, using one change batch per hosted zone.
+    If wait is set, upserts wait for Route53 to report the changes as propagated to its name servers.
+    """
+    route53 = get_client("route53")
+    changes: Dict[str, List[Dict[str, Any]]] = {}
 
-from botocore.exceptions import ClientError
-import boto3
-import certbot.main
+    for name, values in records.items():
+        record_set = {
+            "Name": name, "Type": "TXT", "TTL": DNS_CHALLENGE_TTL,
+            "ResourceRecords": [{"Value": f'"{value}"'} for value in values]}
+        changes.setdefault(hosted_zone_index.find(name), []).append({"Action": action, "ResourceRecordSet": record_set})
 
+    change_ids = []
+    for zone_id, zone_changes in changes.items():
+        result = route53.change_resource_record_sets(
+            HostedZoneId=zone_id, ChangeBatch={"Comment": "certbot-to-acm DNS-01 challenge", "Changes": zone_changes})
+        change_ids.append(result["ChangeInfo"]["Id"])
 
-class CertbotCertificate(NamedTuple):
-    certificate: bytes
-    chain: bytes
-    full_chain: bytes
-    private_key: bytes
+    if action == "DELETE" or not wait:
+        return
 
+    waiter = route53.get_waiter("resource_record_sets_changed")
+    for change_id in change_ids:
+        waiter.wait(Id=change_id, WaiterConfig={"Delay": ROUTE53_CHANGE_POLL_DELAY, "MaxAttempts": ROUTE53_CHANGE_MAX_ATTEMPTS})
 
-STAGING_ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
-PRODUCTION_ENDPOINT = "https://acme-v02.api.letsencrypt.org/directory"
-DEFAULT_ENDPOINT = STAGING_ENDPOINT
-DEFAULT_RSA_KEY_SIZE = 2048
-DEFAULT_KMS_KEY = "alias/aws/s3"
-DEFAULT_SSM_KMS_KEY = "alias/aws/ssm"
-DEFAULT_SSM_TIER = "Standard"
-VALID_RSA_KEY_SIZES = (2048, 3072, 4096)
 
-CERT_FILENAME_PATTERN = "live/*/cert.pem"
-CHAIN_FILENAME_PATTERN = "live/*/chain.pem"
-FULLCHAIN_FILENAME_PATTERN = "live/*/fullchain.pem"
-KEY_FILENAME_PATTERN = "live/*/privkey.pem"
+class DnsChallengeBatch:
+    """
+    Collects the DNS-01 challenge TXT records of concurrently running orders so that they are published together: one Route53
+    change batch per hosted zone and a single propagation wait, instead of one per certificate.
 
-# Regular expression for Certbot directories that are valid
-VALID_DOMAIN_DIR_MATCHER = re_compile(
-    r"(?P<domain>(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z])(?:\.(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z]))*)"
-)
+    Each batch item joins (with batch: ...) while it runs. publish() blocks until the caller's records are live. A round of
+    records is flushed as soon as every running item is waiting in publish(), or DNS_CHALLENGE_BATCH_WINDOW seconds after the
+    caller arrived, whichever comes first. Items that never publish (not due, certbot engine, failures) just leave.
+    """
 
-# Regular expression for Certbot directories that were created because symbolic links/permissions were an issue
-MOVED_DOMAIN_DIR_MATCHER = re_compile(
-    r"(?P<domain>(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z])(?:\.(?:[0-9a-z][-0-9a-z]*[0-9a-z]|[0-9a-z]))*)-[0-9]{4}"
-)
+    def __init__(self, window: float = DNS_CHALLENGE_BATCH_WINDOW) -> None:
+        self.window = window
+        self.condition = Condition()
+        self.running = 0
+        self.waiting = 0
+        self.round = 0
+        self.pending: Dict[str, List[str]] = {}
+        self.live: Dict[str, List[str]] = {}
+        self.results: Dict[int, Optional[Exception]] = {}
+        self.unread: Dict[int, int] = {}  # Waiters yet to read each round's result
+        # Held (without the condition) around each Route53 change, so they are applied in the order live was updated
+        self.change_lock = Lock()
+
+    def __enter__(self) -> "DnsChallengeBatch":
+        with self.condition:
+            self.running += 1
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+    def publish(self, records: Dict[str, List[str]]) -> None:
+        """
+        Publish the given TXT records (name to values) along with those of any other waiting items, returning once they have
+        propagated.
+        """
+        with self.condition:
+            for name, values in records.items():
+                self.pending.setdefault(name, []).extend(values)
+
+            self.waiting += 1
+            my_round = self.round
+            deadline = monotonic() + self.window
+            self.condition.notify_all()
+
+            while my_round not in self.results:
+                if self.round == my_round and (self.waiting >= self.running or monotonic() >= deadline):
+                    self.flush()
+                else:
+                    self.condition.wait(max(deadline - monotonic(), 0.05))
+
+            error = self.results[my_round]
+            self.unread[my_round] -= 1
+            if not self.unread[my_round]:
+                del self.results[my_round], self.unread[my_round]
+
+        if error is not None:
+            raise RuntimeError(f"Failed to publish DNS-01 challenge records: {error}") from error
+
+    def flush(self) -> None:
+        """
+        Publish the pending round of records. Called with the condition held; it is released while waiting on Route53.
+        """
+        flush_round = self.round
+        self.round += 1
+        print(f"Publishing {len(self.pending)} DNS-01 challenge record(s) for {self.waiting} order(s)")
+
+        pending = self.pending
+        self.unread[flush_round] = self.waiting
+        self.pending = {}
+        self.waiting = 0
+
+        error = None
+        self.condition.release()
+        try:
+            with self.change_lock:
+                with self.condition:
+                    for name, values in pending.items():
+                        self.live[name] = self.live.get(name, []) + values
+                    records = {name: list(self.live[name]) for name in pending}
+
+                change_dns_txt_records("UPSERT", records)
+        except Exception as e:  # pylint: disable=broad-except
+            error = e
+        finally:
+            self.condition.acquire()
+
+        self.results[flush_round] = error
+        self.condition.notify_all()
+
+    def release(self, records: Dict[str, List[str]]) -> None:
+        """
+        Remove the given TXT records once their authorizations are done. A name shared with orders still in flight keeps their
+        values; the record set is deleted when its last value is released.
+        """
+        with self.change_lock:
+            deletes = {}
+            upserts = {}
+
+            with self.condition:
+                for name, values in records.items():
+                    live = self.live.get(name, [])
+                    remaining = list(live)
+                    for value in values:
+                        if value in remaining:
+                            remaining.remove(value)
+
+                    if remaining:
+                        upserts[name] = self.live[name] = remaining
+                    elif live:
+                        deletes[name] = live
+                        del self.live[name]
+
+            if deletes:
+                change_dns_txt_records("DELETE", deletes)
+
+            if upserts:
+                change_dns_txt_records("UPSERT", upserts, wait=False)
+
+
+def split_full_chain(full_chain: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split a PEM full chain into the leaf certificate and the intermediate chain.
+    """
+    marker = b"-----END CERTIFICATE-----"
+    end = full_chain.index(marker) + len(marker)
+    return full_chain[:end].lstrip() + b"\n", full_chain[end:].lstrip()
 
-# Archived filenames
-ARCHIVED_FILE_MATCHER = re_compile(r"(?P<filetype>cert|chain|fullchain|privkey)(?P<version>[0-9]+)\.pem")
 
-# All filetypes that Certbot produces
-ALL_FILETYPES = ("cert", "chain", "fullchain", "privkey")
+def generate_private_key(key_spec: KeySpec) -> bytes:
+    """
+    Generate a certificate private key of the given type and return it in PEM (PKCS#8) form, as certbot does.
+    """
+    serialization = lazy_import("cryptography.hazmat.primitives.serialization")
 
-s3 = boto3.client("s3")
-ssm = boto3.client("ssm")
-log = getLogger()
+    if key_spec.key_type == "ecdsa":
+        ec = lazy_import("cryptography.hazmat.primitives.asymmetric.ec")
+        key = ec.generate_private_key(getattr(ec, key_spec.elliptic_curve.upper())())
+    else:
+        rsa = lazy_import("cryptography.hazmat.primitives.asymmetric.rsa")
+        key = rsa.generate_private_key(public_exponent=65537, key_size=key_spec.rsa_key_size)
+
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption())
+
+
+def certbot_key_args(key_spec: KeySpec) -> List[str]:
+    """
+    Return the certbot command line arguments selecting the given key type.
+    """
+    if key_spec.key_type == "ecdsa":
+        return ["--key-type", "ecdsa", "--elliptic-curve", key_spec.elliptic_curve]
+
+    return ["--key-type", "rsa", "--rsa-key-size", str(key_spec.rsa_key_size)]
+
+
+def acm_key_type(key_spec: KeySpec) -> str:
+    """
+    Return the ACM key-type filter value matching the given key type.
+    """
+    if key_spec.key_type == "ecdsa":
+        return ACM_EC_KEY_TYPES[key_spec.elliptic_curve]
 
+    return f"RSA_{key_spec.rsa_key_size}"
 
-def get_list_certs_kw(filters: Dict[str, Any]) -> Dict[str, Any]:
+
+def install_lineage_version(
+        config_dir: str, lineage: str, cert: CertbotCertificate, account_id: str, endpoint: str, key_spec: KeySpec) -> int:
+    """
+    Record a newly issued certificate as the next archived version of a lineage, point the live links at it, and write the
+    renewal configuration certbot expects if the lineage is new. Returns the version number.
     """
-    Return the keyword arguments to use for list_certificates given the list of filters.
+    versions = lineage_versions(config_dir, lineage)
+    version = max(versions, default=0) + 1
+
+    archive_dir = f"{config_dir}/archive/{lineage}"
+    makedirs(archive_dir, exist_ok=True)
+    for field, filetype in (("certificate", "cert"), ("chain", "chain"), ("full_chain", "fullchain"), ("private_key", "privkey")):
+        pathname = f"{archive_dir}/{filetype}{version}.pem"
+        with open(pathname, "wb") as fd:
+            chmod(pathname, 0o600 if filetype == "privkey" else 0o644)
+            fd.write(getattr(cert, field))
+
+    link_live_lineage(config_dir, lineage, version)
+
+    conf = f"{config_dir}/renewal/{lineage}.conf"
+    if lexists(conf):
+        rewrite_renewal_conf(config_dir, lineage)
+        return version
+
+    makedirs(f"{config_dir}/renewal", exist_ok=True)
+    live_dir = f"{config_dir}/live/{lineage}"
+    with open(conf, "w") as fd:
+        fd.write(
+            f"archive_dir = {archive_dir}\n"
+            f"cert = {live_dir}/cert.pem\n"
+            f"privkey = {live_dir}/privkey.pem\n"
+            f"chain = {live_dir}/chain.pem\n"
+            f"fullchain = {live_dir}/fullchain.pem\n"
+            "\n"
+            "# Options used in the renewal process\n"
+            "[renewalparams]\n"
+            f"account = {account_id}\n"
+            "pref_challs = dns-01,\n"
+            f"server = {endpoint}\n"
+            "authenticator = dns-route53\n"
+            f"key_type = {key_spec.key_type}\n"
+            + (f"elliptic_curve = {key_spec.elliptic_curve}\n" if key_spec.key_type == "ecdsa" else
+               f"rsa_key_size = {key_spec.rsa_key_size}\n"))
+
+    return version
+
+
+def issue_certificate_native(
+        config_dir: str, lineage: str, domains: List[str], endpoint: str, email: Optional[str], key_spec: KeySpec,
+        challenge_batch: Optional[DnsChallengeBatch] = None) -> CertbotCertificate:
     """
-    acm_kw = {}
-    includes = {}
+    Obtain a certificate for the given domains by driving the ACME protocol directly (no certbot CLI, plugin discovery, or
+    global lock), answering the DNS-01 challenges through Route53. The challenge records are published through challenge_batch
+    so that concurrent orders share change batches and propagation waits. The certificate is recorded as a new version of the
+    lineage in config_dir, so the certbot engine can carry on from it, and returned from memory.
+    """
+    if challenge_batch is None:
+        challenge_batch = DnsChallengeBatch()
+
+    challenges = lazy_import("acme.challenges")
+    messages = lazy_import("acme.messages")
+
+    client, account_id = get_acme_client(config_dir, endpoint, email)
+    account_key = client.net.key
+
+    private_key = generate_private_key(key_spec)
+    order = client.new_order(lazy_import("acme.crypto_util").make_csr(private_key, domains))
 
-    status = filters.get("status")
-    if status:
-        if isinstance(status, str):
-            status = [status]
-        acm_kw["CertificateStatuses"] = status
+    records: Dict[str, List[str]] = {}
+    responses = []
+    for authz in order.authorizations:
+        if authz.body.status == messages.STATUS_VALID:
+            continue
 
-    key_type = filters.get("key-type")
-    if key_type:
-        if isinstance(key_type, str):
-            key_type = [key_type]
-        includes["keyTypes"] = key_type
+        identifier = authz.body.identifier.value
+        challb = next((challb for challb in authz.body.challenges if isinstance(challb.chall, challenges.DNS01)), None)
+        if challb is None:
+            raise RuntimeError(f"ACME server did not offer a dns-01 challenge for {identifier}")
 
-    key_usage = filters.get("key_usage")
-    if key_usage:
-        if isinstance(key_usage, str):
-            key_usage = [key_usage]
-        includes["keyUsage"] = key_usage
+        records.setdefault(challb.chall.validation_domain_name(identifier), []).append(challb.chall.validation(account_key))
+        responses.append((challb, challb.chall.response(account_key)))
 
-    extended_key_usage = filters.get("extended_key_usage")
-    if extended_key_usage:
-        if isinstance(extended_key_usage, str):
-            extended_key_usage = [extended_key_usage]
-        includes["extendedKeyUsage"] = extended_key_usage
+    if records:
+        with Phase("dns-propagation"):
+            challenge_batch.publish(records)
 
-    if includes:
-        acm_kw["Includes"] = includes
+    try:
+        with Phase("acme-validation"):
+            for challb, response in responses:
+                client.answer_challenge(challb, response)
+
+            # The acme library compares deadlines against naive local time.
+            order = client.poll_and_finalize(order, datetime.now() + timedelta(seconds=ACME_ORDER_TIMEOUT))
+    finally:
+        if records:
+            try:
+                challenge_batch.release(records)
+            except Exception:  # pylint: disable=broad-except
+                log.warning("Failed to remove DNS-01 challenge records %s", sorted(records), exc_info=True)
 
-    return acm_kw
+    full_chain = order.fullchain_pem.encode("utf-8")
+    certificate, chain = split_full_chain(full_chain)
+    cert = CertbotCertificate(certificate=certificate, chain=chain, full_chain=full_chain, private_key=private_key)
 
+    version = install_lineage_version(config_dir, lineage, cert, account_id, endpoint, key_spec)
+    print(f"Issued version {version} of {lineage} for {' '.join(domains)}")
+    return cert
 
-def find_existing_certificate(arn: Optional[str], filters: Dict[str, Any]) -> Optional[str]:
+
+def registered_domain(name: str) -> str:
     """
-    Search ACM for an existing certificate matching the specified ARN or the list of filters.
+    Return a best guess at the registered domain a DNS name falls under, as used for the CA's per-domain rate limits: the last
+    two labels, or the last three under a common multi-label public suffix (e.g., co.uk). There is no public suffix list
+    here, so an unusual suffix makes the guess broader than the CA's, which only errs on the side of caution.
     """
-    acm = boto3.client("acm")
+    labels = name.lower().rstrip(".").split(".")
+    if labels[0] == "*":
+        labels = labels[1:]
 
-    if arn:
-        try:
-            result = acm.get_certificate(CertificateArn=arn)
-            if "Certificate" not in result:
-                raise ValueError(f"Invalid certificate ARN: {arn}")
-            return arn
-        except ClientError as e:
-            raise ValueError(f"Invalid certificate ARN: {arn} ({e})")
+    if len(labels) > 2 and ".".join(labels[-2:]) in MULTI_LABEL_PUBLIC_SUFFIXES:
+        return ".".join(labels[-3:])
 
-    cert_summaries = []
-    acm_kw = get_list_certs_kw(filters)
+    return ".".join(labels[-2:])
 
-    while True:
-        print(f"Calling list_certificates with kw={acm_kw}")
-        list_result = acm.list_certificates(**acm_kw)
-        for cert_summary in list_result.get("CertificateSummaryList", []):
-            cert_summaries.append(cert_summary)
 
-        next_token = list_result.get("NextToken")
-        if not next_token:
-            break
+def rate_limit_error(error: BaseException) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    If the given exception (or one it was raised from) is an ACME rateLimited error, return its detail and the time the server
+    said to retry after (as a Unix timestamp), if it gave one. Otherwise, return None.
+    """
+    seen: Set[int] = set()
+    current: Optional[BaseException] = error
 
-        acm_kw["NextToken"] = next_token
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        text = str(current)
+        if ACME_RATE_LIMITED_ERROR in (getattr(current, "typ", None) or "") or "rateLimited" in text:
+            detail = getattr(current, "detail", None) or text
+            m = RETRY_AFTER_MATCHER.search(detail)
+            if m:
+                retry_at = datetime.strptime(m.group(1).replace("T", " "), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+                return detail, retry_at.timestamp()
+            return detail, None
 
-    domain_name = filters.get("domain")
-    if domain_name:
-        # Filter out any certificates whose domain name doesn't match
-        cert_summaries = [cs for cs in cert_summaries if cs.get("DomainName") == domain_name]
+        current = current.__cause__ or current.__context__
+
+    return None
+
+
+class AcmeRateLimiter:
+    """
+    Tracks the orders placed with each ACME server against the CA's rate limits (see ACME_RATE_LIMITS), so that renewals that
+    would exceed them are deferred rather than sent to fail. The counts cover:
+    *   every order, per account (server);
+    *   new certificates (not renewals of the same names), per registered domain; and
+    *   every order, per exact set of names (the duplicate certificate limit).
+
+    When the server rejects an order as rate limited anyway, the limit it names is blocked until its Retry-After time, or for
+    an exponentially growing backoff if it gave none. The state is shared by every renewal in this container and saved
+    alongside the config so other containers and later invocations see it.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.orders: Dict[str, Dict[str, Any]] = {}  # Order id to {"at": timestamp, "keys": [limit keys]}
+        self.blocks: Dict[str, Dict[str, Any]] = {}  # Limit key to {"until": timestamp, "strikes": count}
+
+    @staticmethod
+    def limit_keys(endpoint: str, domains: List[str], renewal: bool) -> List[str]:
+        """
+        Return the keys of the limits an order for the given domains counts against.
+        """
+        keys = [f"account {endpoint}", f"names {endpoint} {','.join(sorted(domain.lower() for domain in domains))}"]
+        if not renewal:
+            keys += sorted({f"domain {endpoint} {registered_domain(domain)}" for domain in domains})
+        return keys
+
+    def prune(self, now: float) -> None:
+        """
+        Drop orders older than the longest window and expired blocks. Called with the lock held.
+        """
+        horizon = now - max(window for _, window in ACME_RATE_LIMITS.values())
+        self.orders = {order_id: order for order_id, order in self.orders.items() if order["at"] > horizon}
+        # Blocks are kept for a while after they end so that repeated rejections keep growing the backoff.
+        self.blocks = {
+            key: block for key, block in self.blocks.items() if block["until"] > now - ACME_RATE_LIMIT_MAX_BACKOFF}
+
+    def admit(self, endpoint: str, domains: List[str], renewal: bool) -> Optional[float]:
+        """
+        Reserve capacity for an order for the given domains and return None, or return the time (as a Unix timestamp) at
+        which it could be placed without exceeding a rate limit.
+        """
+        now = time()
+        keys = self.limit_keys(endpoint, domains, renewal)
+
+        with self.lock:
+            self.prune(now)
+            retry_at = 0.0
+            for key in keys:
+                block = self.blocks.get(key)
+                if block is not None and block["until"] > now:
+                    retry_at = max(retry_at, block["until"])
+
+                limit, window = ACME_RATE_LIMITS[key.split(" ", 1)[0]]
+                recent = sorted(
+                    order["at"] for order in self.orders.values() if key in order["keys"] and order["at"] > now - window)
+                if len(recent) >= limit:
+                    retry_at = max(retry_at, recent[-limit] + window)
+
+            if retry_at:
+                return retry_at
+
+            self.orders[uuid4().hex] = {"at": now, "keys": keys}
+            for key in keys:
+                if key in self.blocks:
+                    self.blocks[key]["strikes"] = 0
 
-    if len(cert_summaries) == 0:
         return None
 
-    if len(cert_summaries) == 1:
-        return cert_summaries[0]["CertificateArn"]
+    def rate_limited(self, endpoint: str, domains: List[str], renewal: bool, detail: str, retry_at: Optional[float]) -> float:
+        """
+        Record that the server rejected an order for the given domains as rate limited, blocking the limit named in its error
+        detail until retry_at, or for a backoff that doubles with each consecutive rejection. Returns the time the block ends.
+        """
+        now = time()
+        keys = self.limit_keys(endpoint, domains, renewal)
+        lowered = detail.lower()
+        if "new orders" in lowered or "account" in lowered:
+            blocked = keys[:1]
+        elif "registered domain" in lowered or ("certificates already issued" in lowered and "exact set" not in lowered):
+            blocked = keys[2:] or keys[1:2]
+        else:
+            blocked = keys[1:2]
+
+        with self.lock:
+            until = now
+            for key in blocked:
+                block = self.blocks.setdefault(key, {"until": now, "strikes": 0})
+                block["strikes"] += 1
+                backoff = min(ACME_RATE_LIMIT_MAX_BACKOFF, ACME_RATE_LIMIT_BASE_BACKOFF * 2 ** (block["strikes"] - 1))
+                block["until"] = max(block["until"], retry_at or now + backoff)
+                until = max(until, block["until"])
+
+        return until
+
+    def load(self, config_store: ConfigStore) -> None:
+        """
+        Merge in the state saved alongside the given config store.
+        """
+        data = config_store.read_sidecar(ACME_RATE_LIMIT_SIDECAR)
+        if data is None:
+            return
+
+        saved = json_loads(data)
+        with self.lock:
+            self.orders.update(saved.get("orders", {}))
+            for key, block in saved.get("blocks", {}).items():
+                current = self.blocks.get(key)
+                if current is None or block["until"] > current["until"]:
+                    self.blocks[key] = block
+
+    def save(self, config_store: ConfigStore) -> None:
+        """
+        Save the state alongside the given config store.
+        """
+        with self.lock:
+            self.prune(time())
+            data = json_dumps({"orders": self.orders, "blocks": self.blocks}, sort_keys=True).encode("utf-8")
+
+        config_store.write_sidecar(ACME_RATE_LIMIT_SIDECAR, data)
+
+
+# Shared by every certificate renewed by this container
+acme_rate_limiter = AcmeRateLimiter()
+
+
+def renewal_journal_sidecar(config_store: ConfigStore, lineage: str) -> str:
+    """
+    Return the name of the sidecar holding the journal of a lineage's renewal: unlike the shared sidecars, it belongs to one
+    config and lineage.
+    """
+    return f"{config_store.url.rsplit('/', 1)[-1]}.{lineage}{RENEWAL_JOURNAL_SIDECAR_SUFFIX}"
 
-    raise ValueError("Multiple certificates found: " + " ".join([cs["CertificateArn"] for cs in cert_summaries]))
+
+def write_renewal_journal(config_store: ConfigStore, lineage: str, journal: RenewalJournal) -> None:
+    """
+    Checkpoint a renewal in its journal alongside the config, encrypted like the config since it holds the private key.
+    """
+    data = {
+        "domains": journal.domains,
+        "endpoint": journal.endpoint,
+        "key-spec": journal.key_spec._asdict(),
+        "account-id": journal.account_id,
+        "issued-at": journal.issued_at,
+        "certificate": {field: getattr(journal.certificate, field).decode("ascii") for field in CertbotCertificate._fields},
+        "completed": journal.completed,
+    }
+    config_store.write_sidecar(renewal_journal_sidecar(config_store, lineage), json_dumps(data, sort_keys=True).encode("utf-8"))
 
 
-def download_certbot_config(config_bucket: str, config_key: str, certbot_config_dir: str, certbot_work_dir: str) -> None:
+def read_renewal_journal(config_store: ConfigStore, lineage: str) -> Optional[RenewalJournal]:
     """
-    Download the configuration tar file from S3 and extract it to the certbot config directory.
+    Return the journal left alongside the config by a renewal of the lineage that didn't finish, or None if there isn't one
+    (or it can't be read).
     """
-    with TemporaryFile(prefix="config", suffix=".tar.gz", dir=certbot_work_dir) as fd:
-        try:
-            result = s3.get_object(Bucket=config_bucket, Key=config_key)
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                return
-            raise
+    data = config_store.read_sidecar(renewal_journal_sidecar(config_store, lineage))
+    if data is None:
+        return None
 
-        body = result["Body"]
-        first_chunk = True
+    try:
+        saved = json_loads(data)
+        return RenewalJournal(
+            domains=saved["domains"], endpoint=saved["endpoint"], key_spec=KeySpec(**saved["key-spec"]),
+            account_id=saved.get("account-id"), issued_at=saved["issued-at"],
+            certificate=CertbotCertificate(**{field: value.encode("ascii") for field, value in saved["certificate"].items()}),
+            completed=saved.get("completed", []))
+    except (KeyError, TypeError, ValueError):
+        log.warning("Ignoring the unreadable renewal journal for %s in %s", lineage, config_store.url, exc_info=True)
+        return None
 
-        while True:
-            chunk = body.read(65536)
-            if not chunk:
-                break
-            
-            if first_chunk:
-                if chunk[:4] == b'\x50\x4b\x03\x04':
-                    # Legacy ZIP file -- don't use
-                    return
-                first_chunk = False
 
-            fd.write(chunk)
+def delete_renewal_journal(config_store: ConfigStore, lineage: str) -> None:
+    """
+    Delete the lineage's renewal journal once it's no longer needed. A journal left behind is only discarded (or resumed
+    harmlessly) by a later renewal, so failing to delete it doesn't fail this one.
+    """
+    try:
+        config_store.delete_sidecar(renewal_journal_sidecar(config_store, lineage))
+    except Exception:  # pylint: disable=broad-except
+        log.warning("Unable to delete the renewal journal for %s in %s", lineage, config_store.url, exc_info=True)
 
-        fd.seek(0)
 
-        with tarfile_open(fd, "r") as tf:
-            tf.extractall(certbot_config_dir)
+def resume_renewal(
+        config_store: ConfigStore, config_dir: str, lineage: str, domains: List[str], endpoint: str, key_spec: KeySpec,
+        renewal_window_days: float) -> Optional[RenewalJournal]:
+    """
+    Pick up a renewal of the lineage that was cut short after its certificate was issued (by a timeout, or by a failure to
+    save or publish it), returning its journal, or None if there is nothing to resume. If the config that was
+    restored doesn't hold the certificate yet, it is installed as the lineage's next version, just as if it had been issued
+    again. A journal left by a renewal with different settings, or whose certificate is itself due, is discarded.
+    """
+    journal = read_renewal_journal(config_store, lineage)
+    if journal is None:
+        return None
+
+    expiry = certificate_expiry(journal.certificate.certificate)
+    if (expiry is None or certificate_is_due(expiry.not_after, expiry.names, domains, renewal_window_days) or
+            journal.endpoint != endpoint or journal.key_spec != key_spec):
+        print(f"Discarding the renewal journal for {lineage}, which was left by a renewal that no longer applies")
+        delete_renewal_journal(config_store, lineage)
+        return None
+
+    print(
+        f"Resuming the renewal of {lineage} with the certificate issued at {journal.issued_at}" +
+        (f" (already completed: {', '.join(journal.completed)})" if journal.completed else ""))
+    if read_live_certificates(config_dir, lineage).get(lineage) != journal.certificate:
+        install_lineage_version(config_dir, lineage, journal.certificate, journal.account_id or "", endpoint, key_spec)
 
+    return journal
 
-def create_config_tarfile(config_dir: str, config_tarfile: str) -> CertbotCertificate:
+
+def run_certbot(
+        config_dir: str, work_dir: str, log_dir: str, lineage: str, domains: List[str], endpoint: str, email: Optional[str],
+        key_spec: KeySpec) -> None:
     """
-    Create the configuration tar file for storage in S3 and return a dictionary containing Certificate, CertificateChain, and
-    PrivateKey with those elements found.
+    Obtain or renew a certificate by running certbot certonly with the dns-route53 plugin. Only called once the certificate
+    is known to be due (by renewal-window-days, which may be wider than certbot's own window) or force-renewal is set, so
+    certbot is always told to renew; otherwise it could exit successfully without placing an order.
     """
-    certificate = None
-    chain = None
-    full_chain = None
-    private_key = None
+    cmd = [
+        "certonly", "--non-interactive", "--preferred-challenges", "dns", "--user-agent-comment", ACME_USER_AGENT,
+        "--agree-tos", "--config-dir", config_dir, "--work-dir", work_dir, "--logs-dir", log_dir,
+        "--server", endpoint, "--dns-route53", "--cert-name", lineage,
+        "--force-renewal",
+    ] + certbot_key_args(key_spec)
+
+    if email:
+        cmd += ["--email", email]
+    else:
+        cmd += ["--register-unsafely-without-email"]
 
-    with tarfile_open(config_tarfile, "w:gz") as tf:
-        for path, _, filenames in walk(config_dir):
-            for filename in filenames:
-                pathname = path + "/" + filename
-                relpath_strip = len(config_dir) + 1
-                relpath = pathname[relpath_strip:]
-                print(f"Adding {relpath} to archive")
-                tf.add(pathname, relpath, recursive=False)
+    for domain in domains:
+        cmd += ["--domain", domain]
 
-                if fnmatch(relpath, CERT_FILENAME_PATTERN):
-                    with open(pathname, "rb") as fd:
-                        certificate = fd.read()
-                elif fnmatch(relpath, CHAIN_FILENAME_PATTERN):
-                    with open(pathname, "rb") as fd:
-                        chain = fd.read()
-                elif fnmatch(relpath, FULLCHAIN_FILENAME_PATTERN):
-                    with open(pathname, "rb") as fd:
-                        full_chain = fd.read()
-                elif fnmatch(relpath, KEY_FILENAME_PATTERN):
-                    with open(pathname, "rb") as fd:
-                        private_key = fd.read()
+    with certbot_lock:
+        result = lazy_import("certbot.main").main(cmd)
+
+    if result:
+        print(f"certbot command failed: {result}", file=stderr)
+        raise RuntimeError(f"certbot command exited with exit code {result}")
 
-    if certificate is None:
-        raise ValueError(f"Did not find live certificate in {config_dir}")
 
-    if chain is None:
-        raise ValueError(f"Did not find intermediate certificate in {config_dir}")
+def load_inventory(url: str) -> Dict[str, Any]:
+    """
+    Load the renewal inventory from an s3://<bucket>/<key> URL. The inventory is a batch event (see lambda_handler) in JSON,
+    or in YAML if the key ends in .yaml or .yml and PyYAML is available.
+    """
+    m = fullmatch(r"s3://([a-z0-9][-\.a-z0-9]*)/(.*)", url)
+    if not m:
+        raise ValueError(f"Invalid event: inventory-url is not a valid s3:// url: {url}")
 
-    if full_chain is None:
-        raise ValueError(f"Did not find full certificate chain in {config_dir}")
+    data = get_client("s3").get_object(Bucket=m.group(1), Key=m.group(2))["Body"].read()
+    if m.group(2).endswith((".yaml", ".yml")):
+        inventory = lazy_import("yaml").safe_load(data)
+    else:
+        inventory = json_loads(data)
 
-    if private_key is None:
-        raise ValueError(f"Did not find private key in {config_dir}")
+    if not isinstance(inventory, dict) or not isinstance(inventory.get("certificates"), list):
+        raise ValueError(f"Inventory {url} must be an object with a certificates list")
 
-    return CertbotCertificate(certificate=certificate, chain=chain, full_chain=full_chain, private_key=private_key)
+    return inventory
 
 
-def get_ssm_parameter(parameter_name: str) -> Optional[str]:
+def certificate_spec_is_due(spec: Dict[str, Any]) -> bool:
     """
-    Return the given SSM parameter, or None if it doesn't exist.
+    Indicates whether a certificate in the inventory should be dispatched for renewal, judging by the expiry of the ACM
+    certificate it is imported into (read from the shared ACM index, so planning a whole inventory costs one ListCertificates
+    pass). Certificates without an ACM certificate to check, or whose check fails, are dispatched and left to the renewal
+    itself to decide.
     """
-    try:
-        result = ssm.get_parameter(Name=parameter_name, WithDecryption=True)
-        return result["Parameter"]["Value"]
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ParameterNotFound":
-            return None
-        raise
+    domains = spec.get("domains", [])
+    if isinstance(domains, str):
+        domains = [domains]
+
+    if spec.get("force-renewal") or isinstance(spec.get("key-type"), list):
+        return True
+
+    errors: List[str] = []
+    targets = acm_targets_from_event(spec, errors)
+    if errors or any(isinstance(target.arn, dict) or not (target.arn or target.filters) for target in targets):
+        return True
+
+    key_spec = KeySpec(
+        key_type=spec.get("key-type", DEFAULT_KEY_TYPE), rsa_key_size=spec.get("rsa-key-size", DEFAULT_RSA_KEY_SIZE),
+        elliptic_curve=spec.get("elliptic-curve", DEFAULT_ELLIPTIC_CURVE))
+    if key_spec.key_type not in VALID_KEY_TYPES or key_spec.elliptic_curve not in ACM_EC_KEY_TYPES:
+        return True
+
+    targets = key_type_targets(targets, key_spec)
+
+    # With several regions, the certificate is due as soon as any one of them needs it.
+    for target in targets:
+        try:
+            arn = find_existing_certificate(target.arn, target.filters, target.region)
+            expiry = get_acm_certificate_expiry(arn, target.region) if arn else None
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Unable to check the expiry of the certificate for %s; dispatching it", domains, exc_info=True)
+            return True
+
+        if expiry is None or certificate_is_due(
+                expiry.not_after, expiry.names, domains, spec.get("renewal-window-days", DEFAULT_RENEWAL_WINDOW_DAYS)):
+            return True
+
+    return False
+
+
+def dispatch_renewal_batch(batch_event: Dict[str, Any], mode: str, target: str, delay: float) -> None:
+    """
+    Send a batch event to be renewed asynchronously: as an asynchronous invocation of the target Lambda function, or as a
+    message on the target SQS queue delivered after delay seconds.
+    """
+    payload = json_dumps(batch_event, sort_keys=True)
+
+    if mode == "sqs":
+        retry_throttled(
+            lambda: get_client("sqs").send_message(QueueUrl=target, MessageBody=payload, DelaySeconds=int(delay)),
+            f"SendMessage to {target}")
+    else:
+        retry_throttled(
+            lambda: get_client("lambda").invoke(FunctionName=target, InvocationType="Event", Payload=payload.encode("utf-8")),
+            f"Invoke {target}")
 
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -255,41 +3202,430 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "status": ["PENDING_VALIDTION", "ISSUED", "INACTIVE", "EXPIRED", "VALIDATION_TIMED_OUT", "REVOKED", "FAILED"],
             "type": ["AMAZON_ISSUED", "IMPORTED"],
         },
+        "acm-regions": [
+            "us-east-1",
+            {"region": "eu-west-1", "acm-certificate-arn": "arn:aws:acm:eu-west-1:<account-id>:certificate/..."},
+            {"region": "ap-southeast-2", "acm-certificate-filters": {...}},
+            ...
+        ],
+        "acme-engine": "certbot",
         "agree-tos": true,
+        "archive-keep-versions": 3,
+        "cert-name": "name1.example.com",
         "config-store-url": "s3://bucket/key.tar.gz",
         "config-store-kms-key": "alias/key-name",
+        "config-store-format": "tar",
+        "config-store-blob-prefix": "prefix/blobs/",
+        "config-store-compression": "gzip",
+        "config-store-compression-level": 6,
+        "config-store-lease-wait-seconds": 120,
         "domains": ["name1.example.com", "name2.example.com", ...],
+        "elliptic-curve": "secp256r1",
         "email": "email@example.com",
         "endpoint": "https://acme-staging-v02.api.letsencrypt.org/directory",
+        "force-renewal": false,
+        "key-type": "rsa",
+        "renewal-window-days": 30,
         "rsa-key-size": 2048,
         "ssm-parameter-prefix": "/path/parameter",
         "ssm-kms-key": "alias/key-name"
     }
 
+    Alternatively, a batch of certificates can be renewed in a single invocation:
+    {
+        "certificates": [
+            {"domains": ["name1.example.com"], "config-store-url": "s3://bucket/name1.tar.gz", ...},
+            {"domains": ["name2.example.com"], "config-store-url": "s3://bucket/name2.tar.gz", ...},
+            ...
+        ],
+        "max-workers": 8,
+        ...
+    }
+
     *   acm-certificate-arn is optional. If set, any new certificates are imported into this ACM certificate.
     *   acm-certificate-filters is a list of filters to use to find an existing certificate to import into. This must return zero
-        or one certificates.
+        or one certificates. Unless the filters include key-type, they only match RSA_1024 and RSA_2048 certificates (as
+        ListCertificates does by default), or only the key type being renewed if it is another one (e.g., EC_prime256v1).
+    *   acm-regions is optional. If set, the certificate is issued once and imported into the ACM certificate of each listed
+        region concurrently (for example, us-east-1 for CloudFront alongside the regions of the load balancers). Each entry
+        is a region name or an object with its own acm-certificate-arn or acm-certificate-filters; entries with neither
+        use the event's acm-certificate-filters, and the event's acm-certificate-arn must not be set. A certificate that
+        isn't due is still imported into regions that are missing it or hold an older copy. The result then has a "regions"
+        list with the status and certificate-arn of each region in place of certificate-arn; a region that fails to import
+        gets a "failed" status and an "error" without affecting the others, and makes the overall status "failed".
+    *   acme-engine is optional and defaults to "certbot", which runs certbot certonly with the dns-route53 plugin. If set to
+        "native", the certificate is obtained by driving the ACME protocol directly from this process (account, order, DNS-01
+        challenges in Route53, finalize). The native engine reads and writes the same certbot account, archive, live, and
+        renewal files, so the two can be switched freely; it skips certbot's argument parsing and plugin discovery, and
+        batch items using it don't wait on each other. Hosted zones are looked up in an index built from one ListHostedZones
+        pass per hour, which is saved next to the config (as route53-zones.json) for cold starts to reuse.
     *   agree-tos is NOT optional and must be set.
-    *   config-store-url is NOT optional and must be an s3://<bucket>/<key> URL. The certbot config directory is stored here as a
-        tar.gz archive.
+    *   archive-keep-versions is optional. If set, the stored config is compacted after certbot runs: only this many archived
+        versions of each lineage are kept, and orphaned lineages are dropped (see compact_config_dir).
+    *   cert-name is optional and sets the name of the certbot lineage. It defaults to the first domain (without any leading
+        "*.").
+    *   config-store-url is NOT optional and must be an s3://<bucket>/<key> or file:///<path> URL. With s3://, the certbot config
+        directory is stored here as a tar.gz archive. With file://, it is kept as a plain directory at that path (on an EFS
+        mount attached to the function, or a local directory for tests and runners outside Lambda), and renewals work on it
+        in place, with no archive to download or upload; sidecars are files in its .certbot-to-acm subdirectory, and the
+        lease is a lock on one of them. The remaining config-store-* fields (other than config-store-lease-wait-seconds)
+        only apply to s3:// stores. Note that a renewal that fails part way leaves whatever certbot had written in a file://
+        store. Lost symbolic links and permissions in a restored config are repaired, and the duplicate -NNNN lineages
+        certbot creates when it finds them are collapsed back into the lineage (see fixup_config_dir).
     *   config-store-kms-key is a KMS alias or ARN used to encrypt the certbot config archive. If omitted, it defaults
         to "alias/aws/s3".
+    *   config-store-format is optional and defaults to "tar". If set to "incremental", config-store-url names a JSON
+        manifest instead of a tar.gz archive, and each file is stored as a content-addressed blob under
+        config-store-blob-prefix (by default, "blobs/" next to the manifest). Only new or modified files are uploaded, and
+        only the files for the lineage being renewed are downloaded. Manifests in the same folder share blobs.
+    *   config-store-compression is optional and defaults to "gzip". It sets how a tar archive is compressed when it is saved:
+        "gzip", or "zstd", which is several times faster at a similar ratio but needs the zstandard package. Archives are
+        read whichever way they were compressed, so this can be changed at any time.
+    *   config-store-compression-level is optional and defaults to 6 for gzip (1-9) and 3 for zstd (1-22). Lower levels are
+        faster; higher levels give smaller archives.
+    *   config-store-lease-wait-seconds is optional and defaults to 120. A renewal holds a lease on its config store from
+        restoring the config to saving it (a <config object>.lease.json object created with a conditional S3 write, expiring
+        after 15 minutes in case its holder dies), so overlapping invocations don't both order a certificate. A renewal that
+        finds the lease held by another invocation waits up to this many seconds for it, and then (having found the
+        certificate already renewed) usually has nothing to do; if the wait runs out, the status is "busy", with the holder in
+        lease-owner. Set it to 0 to skip such renewals at once. Renewals in the same batch that share a config store take turns
+        however long that takes. Independently, a config is only saved if it is still the version that was restored, so a
+        stale copy never overwrites a newer one. Both need a boto3 recent enough for conditional writes.
+    *   elliptic-curve is optional and defaults to "secp256r1" (P-256). "secp384r1" (P-384) is also supported. It is only used
+        when key-type is "ecdsa".
     *   endpoint is optional and defaults to the LetsEncrypt staging server.
-    *   rsa-key-size is optional and defaults to 2048.
+    *   force-renewal is optional and defaults to false. If set, the certificate is renewed even if it is not due for renewal.
+    *   renewal-window-days is optional and defaults to 30. If the existing certificate (from ACM, or from the stored certbot
+        config) covers exactly the requested domains and does not expire within this many days, the invocation returns
+        without running certbot or touching S3, ACM, or SSM.
+    *   key-type is optional and defaults to "rsa". Set it to "ecdsa" for a certificate with an elliptic-curve key, which is
+        much faster to generate than RSA and gives smaller certificates and cheaper TLS handshakes. Set it to ["rsa", "ecdsa"]
+        to maintain both: the ECDSA certificate gets its own lineage (<cert-name>-ecdsa) and ACM certificate, and
+        acm-certificate-arn, if given, must map each key type to an ARN ({"rsa": "arn:...", "ecdsa": "arn:..."}).
+        acm-certificate-filters are narrowed by key type, and SSM parameters are published under
+        <ssm-parameter-prefix>/rsa and <ssm-parameter-prefix>/ecdsa. The result then has a "certificates" list with one
+        entry per key type in place of certificate-arn.
+    *   rsa-key-size is optional and defaults to 2048. It is only used when key-type is "rsa".
     *   ssm-parameter-prefix is optional. If set, the resulting certificate, chain, and key files are save to the SSM parameter
         store under the given prefix.
     *   ssm-kms-key is optional. If ssm-parameter-prefix is set, this specifies the KMS alias or ARN used to encrypt the TLS key.
         If omitted, it defaults to "alias/aws/ssm".
     *   ssm-tier is optional and defaults to "Standard". Use "Advanced" to enable the use of advanced SSM features.
+
+    Rather than one scheduled rule per certificate, a single schedule can invoke the function with a renewal plan:
+    {
+        "inventory-url": "s3://bucket/inventory.json",
+        "batch-size": 10,
+        "dispatch": "lambda",
+        "queue-url": "https://sqs.<region>.amazonaws.com/<account-id>/queue-name",
+        "jitter-seconds": 120
+    }
+
+    *   inventory-url is NOT optional. It names a batch event (as below) stored as JSON, or as YAML if the key ends in .yaml
+        or .yml (this requires PyYAML).
+    *   batch-size is optional and defaults to 10. Certificates that are due are dispatched in batches of this size.
+    *   dispatch is optional and defaults to "lambda", which invokes this function asynchronously for each batch. If set to
+        "sqs", each batch is sent as a message to queue-url instead; this function can then consume the queue.
+    *   jitter-seconds is optional and defaults to 120. Batches are spread at random over this many seconds so that they
+        don't all hit the ACME server and Route53 at once: SQS messages are delayed (up to 15 minutes), and Lambda invocations
+        are staggered for as long as this invocation has time left.
+
+    Whether a certificate is due is judged from the expiry of its ACM certificate, found by acm-certificate-arn or
+    acm-certificate-filters with one ListCertificates pass for the whole inventory. Certificates that can't be checked this
+    way are always dispatched, and the renewal itself decides. The result counts the certificates in the inventory, those
+    dispatched, and the batches sent.
+
+    SQS events are handled by renewing the batch (or single certificate) event in each message body. Messages that fail as a
+    whole are reported in batchItemFailures so that SQS redelivers them when the event source mapping enables
+    ReportBatchItemFailures; failures of individual certificates are reported in the results.
+
+    The first invocation in each container logs a {"startup": ...} line giving the module load time and the time spent
+    importing each heavy dependency (boto3, certbot, etc.), all in milliseconds.
+
+    Each renewal logs a CloudWatch Embedded Metric Format line (namespace certbot-to-acm, dimensioned by AcmeEngine and
+    Status) with its total time and the time spent in each step: validation, acm-lookup, restore, issue, compaction, and
+    publish, plus the s3-download, archive, s3-upload, dns-propagation, and acme-validation parts of those and the time of
+    each sink that publish runs concurrently (save, acm-import, and ssm-publish). It also counts the S3 bytes downloaded and
+    uploaded and the AWS API calls made. The same figures are returned in the result under "metrics" (with the API calls
+    broken down by operation). The startup line is in the same format.
+
+    Once the certificate is in hand, the config is saved and the certificate imported into ACM and published to SSM
+    concurrently. The config is always saved, even if publishing fails, and the renewal only succeeds once it is; if any sink
+    fails, the renewal fails with an error naming each failed sink. A certificate that didn't reach ACM is imported by the
+    next invocation, which finds the ACM certificate due but the saved one current.
+
+    Each newly issued certificate is checkpointed first, in a journal next to the config (<config object>.<lineage>.journal.json,
+    encrypted with config-store-kms-key since it holds the private key), and the journal is removed once every sink has the
+    certificate. If the invocation times out or fails before then, the next one finds the journal and carries on with the
+    certificate it holds (installing it in the config if the config was never saved) instead of ordering another one, so a
+    retry costs no ACME order, DNS-01 challenges, or rate limit.
+
+    Orders are checked against the CA's rate limits before they are placed (see AcmeRateLimiter): orders per account, new
+    certificates per registered domain, and duplicate certificates per set of names, counted over their rolling windows and
+    saved alongside the config as acme-rate-limits.json. An order that would exceed a limit, or that the server rejects as
+    rate limited, is not attempted again until the limit allows (the server's Retry-After time, if it gave one); the status is
+    then "deferred", with the time in retry-after, rather than "failed".
+
+    SHA-256 digests of the config tree, the certificate and chain, and each SSM parameter value are compared against the
+    copies already stored (S3 object metadata, an ACM certificate tag, and the current SSM values) so that only artifacts
+    whose bytes changed are written. If the certificate itself is unchanged, the status is "unchanged" rather than "renewed".
+
+    The extracted config is kept in /tmp between invocations handled by the same warm container and reused as long as the
+    stored copy hasn't changed (by S3 ETag), so warm invocations skip the download.
+
+    In batch mode, each entry in certificates accepts the fields above. Any other top-level fields are used as defaults for
+    every entry (e.g. agree-tos, email, endpoint). max-workers is optional and bounds the number of certificates renewed
+    concurrently; it defaults to 8. Certificates using the native ACME engine publish their DNS-01 challenge records together:
+    one Route53 change batch per hosted zone and one propagation wait per change, however many certificates are in the zone.
+    Each certificate is renewed in its own config/work/log directories, and a failure in one does not affect the others. The
+    result contains a per-certificate report:
+    {
+        "results": [
+            {"domains": [...], "status": "renewed", "certificate-arn": "arn:aws:acm:..."},
+            {"domains": [...], "status": "unchanged", "certificate-arn": "arn:aws:acm:..."},
+            {"domains": [...], "status": "not-due", "certificate-arn": "arn:aws:acm:...", "not-after": "..."},
+            {"domains": [...], "status": "deferred", "certificate-arn": "arn:aws:acm:...", "retry-after": "..."},
+            {"domains": [...], "status": "busy", "certificate-arn": "arn:aws:acm:...", "lease-owner": "..."},
+            {"domains": [...], "status": "failed", "error": "..."},
+            ...
+        ],
+        "renewed": 1,
+        "unchanged": 1,
+        "not-due": 1,
+        "deferred": 1,
+        "busy": 1,
+        "failed": 1
+    }
+    """
+    try:
+        if "Records" in event:
+            return renew_certificate_messages(event)
+
+        if "inventory-url" in event:
+            return schedule_renewals(event, context)
+
+        if "certificates" in event:
+            return renew_certificate_batch(event)
+
+        return renew_certificate(event)
+    finally:
+        log_startup_report()
+
+
+def compact_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Lambda entry point for compacting a stored certbot config without renewing anything. The input event has the following
+    fields:
+    {
+        "archive-keep-versions": 3,
+        "config-store-url": "s3://bucket/key.tar.gz",
+        "config-store-kms-key": "alias/key-name",
+        "config-store-format": "tar"
+    }
+
+    The config-store-* fields are as described in lambda_handler. archive-keep-versions is optional and defaults to 3.
+    """
+    archive_keep_versions = event.get("archive-keep-versions", DEFAULT_ARCHIVE_KEEP_VERSIONS)
+
+    errors: List[str] = []
+    config_store = config_store_from_event(event, errors)
+
+    if not isinstance(archive_keep_versions, int) or archive_keep_versions < 1:
+        errors.append(f"archive-keep-versions must be a positive integer: {archive_keep_versions}")
+
+    if errors:
+        raise ValueError("Invalid event: " + "\n".join(errors))
+
+    assert config_store is not None
+
+    with ConfigStoreLease(config_store) as lease, TemporaryDirectory("certbot") as certbot_base_dir:
+        if lease.holder is not None:
+            print(f"Not compacting {config_store.url}: {lease.holder.get('owner')} holds the lease on it")
+            return {"removed": [], "lease-owner": lease.holder.get("owner")}
+
+        certbot_config_dir = f"{certbot_base_dir}/config"
+        certbot_work_dir = f"{certbot_base_dir}/work"
+        makedirs(certbot_config_dir)
+        makedirs(certbot_work_dir)
+
+        if not config_store.restore(certbot_config_dir, None):
+            return {"removed": []}
+
+        for relpath in fixup_config_dir(certbot_config_dir):
+            print(f"Repaired {relpath} in {config_store.url}")
+
+        removed = compact_config_dir(certbot_config_dir, archive_keep_versions)
+        for relpath in removed:
+            print(f"Removed {relpath} from {config_store.url}")
+
+        config_store.save(certbot_config_dir, certbot_work_dir)
+
+    return {"removed": removed}
+
+
+def schedule_renewals(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Read the renewal inventory, work out which certificates are due, and dispatch them in batches spread over the jitter
+    window, as described in lambda_handler.
+    """
+    inventory_url = event.get("inventory-url")
+    batch_size = event.get("batch-size", DEFAULT_SCHEDULER_BATCH_SIZE)
+    dispatch = event.get("dispatch", "lambda")
+    queue_url = event.get("queue-url")
+    jitter = event.get("jitter-seconds", DEFAULT_SCHEDULER_JITTER)
+
+    errors = []
+    if not inventory_url:
+        errors.append("inventory-url must be specified")
+
+    if not isinstance(batch_size, int) or batch_size < 1:
+        errors.append(f"batch-size must be a positive integer: {batch_size}")
+
+    if dispatch not in SCHEDULER_DISPATCH_MODES:
+        errors.append(f"dispatch must be one of {', '.join(SCHEDULER_DISPATCH_MODES)}: {dispatch}")
+    elif dispatch == "sqs" and not queue_url:
+        errors.append("queue-url must be specified when dispatch is sqs")
+
+    if not isinstance(jitter, (int, float)) or jitter < 0:
+        errors.append(f"jitter-seconds must be a non-negative number: {jitter}")
+
+    if errors:
+        raise ValueError("Invalid event: " + "\n".join(errors))
+
+    assert inventory_url is not None
+    inventory = load_inventory(inventory_url)
+    defaults = {key: value for key, value in inventory.items() if key not in BATCH_CONTROL_KEYS}
+    specs = [{**defaults, **certificate} for certificate in inventory["certificates"]]
+    due = [spec for spec in specs if certificate_spec_is_due(spec)]
+    batches = [due[i:i + batch_size] for i in range(0, len(due), batch_size)]
+    target = queue_url if dispatch == "sqs" else context.invoked_function_arn
+    assert target is not None
+
+    # Each batch gets a random offset within its own slice of the jitter window, so batches are spread evenly but don't land
+    # on a fixed grid.
+    slice_length = jitter / len(batches) if batches else 0.0
+    start = monotonic()
+    for i, batch in enumerate(batches):
+        offset = slice_length * (i + uniform(0, 1))
+        batch_event = {"certificates": batch, "max-workers": inventory.get("max-workers", DEFAULT_BATCH_MAX_WORKERS)}
+
+        if dispatch == "sqs":
+            dispatch_renewal_batch(batch_event, dispatch, target, min(offset, SQS_MAX_DELAY_SECONDS))
+        else:
+            time_left = context.get_remaining_time_in_millis() / 1000 - SCHEDULER_TIME_MARGIN
+            wait = min(offset - (monotonic() - start), time_left)
+            if wait > 0:
+                sleep(wait)
+            dispatch_renewal_batch(batch_event, dispatch, target, 0)
+
+        print(f"Dispatched batch {i + 1}/{len(batches)} of {len(batch)} certificate(s) via {dispatch}")
+
+    return {"certificates": len(specs), "dispatched": len(due), "batches": len(batches)}
+
+
+def renew_certificate_messages(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Renew the batch or single certificate event in the body of each SQS message, reporting the messages that failed.
+    """
+    results = []
+    failures = []
+
+    for record in event["Records"]:
+        try:
+            body = json_loads(record["body"])
+            results.append(renew_certificate_batch(body) if "certificates" in body else renew_certificate(body))
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Failed to process message %s", record.get("messageId"))
+            failures.append({"itemIdentifier": record.get("messageId")})
+            results.append({"status": "failed", "error": str(e)})
+
+    return {"results": results, "batchItemFailures": failures}
+
+
+def renew_certificate_batch(event: Dict[str, Any]) -> Dict[str, Any]:
     """
-    acm_certificate_arn = event.get("acm-certificate-arn")
-    acm_certificate_filters = event.get("acm-certificate-filters", {})
+    Renew each certificate in a batch event concurrently, returning a per-certificate report.
+    """
+    certificates = event["certificates"]
+    max_workers = event.get("max-workers", DEFAULT_BATCH_MAX_WORKERS)
+
+    if not isinstance(certificates, list):
+        raise ValueError("Invalid event: certificates must be a list")
+
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError(f"Invalid event: max-workers must be a positive integer: {max_workers}")
+
+    defaults = {key: value for key, value in event.items() if key not in BATCH_CONTROL_KEYS}
+    specs = [{**defaults, **certificate} for certificate in certificates]
+    if not specs:
+        return {"results": [], "renewed": 0, "unchanged": 0, "not-due": 0, "deferred": 0, "busy": 0, "failed": 0}
+
+    challenge_batch = DnsChallengeBatch()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(specs))) as tpe:
+        futures = [tpe.submit(renew_batch_item, spec, challenge_batch) for spec in specs]
+
+    results = []
+    for spec, future in zip(specs, futures):
+        try:
+            result = future.result()
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Failed to renew certificate for %s", spec.get("domains"))
+            result = {"domains": spec.get("domains"), "status": "failed", "error": str(e)}
+
+        results.append(result)
+
+    report: Dict[str, Any] = {"results": results}
+    for status in ("renewed", "unchanged", "not-due", "deferred", "busy", "failed"):
+        report[status] = sum(1 for result in results if result["status"] == status)
+
+    return report
+
+
+def renew_batch_item(spec: Dict[str, Any], challenge_batch: DnsChallengeBatch) -> Dict[str, Any]:
+    """
+    Renew one certificate of a batch as a participant in the batch's DNS challenge publishing.
+    """
+    with challenge_batch:
+        return renew_certificate(spec, challenge_batch)
+
+
+def renew_certificate(event: Dict[str, Any], challenge_batch: Optional[DnsChallengeBatch] = None) -> Dict[str, Any]:
+    """
+    Renew a single certificate as described by the event fields documented in lambda_handler, timing each phase. The result
+    includes a summary of the timings, bytes transferred, and API calls, which are also logged in CloudWatch Embedded Metric
+    Format.
+    """
+    metrics = RenewalMetrics()
+    status = "failed"
+    try:
+        with metrics:
+            result = perform_renewal(event, challenge_batch)
+        status = result["status"]
+        result["metrics"] = metrics.summary()
+        return result
+    finally:
+        domains = event.get("domains")
+        metrics.emit(
+            {"AcmeEngine": str(event.get("acme-engine", DEFAULT_ACME_ENGINE)), "Status": status},
+            {"Domains": " ".join(domains) if isinstance(domains, list) else domains})
+
+
+def perform_renewal(event: Dict[str, Any], challenge_batch: Optional[DnsChallengeBatch] = None) -> Dict[str, Any]:
+    """
+    Renew a single certificate (see renew_certificate). The native ACME engine publishes its DNS-01 challenge records through
+    challenge_batch, if given, alongside those of other certificates renewed concurrently.
+    """
+    acme_engine = event.get("acme-engine", DEFAULT_ACME_ENGINE)
     agree_tos = event.get("agree-tos")
-    config_store_url = event.get("config-store-url")
-    config_store_kms_key = event.get("config-store-kms-key", DEFAULT_KMS_KEY)
+    archive_keep_versions = event.get("archive-keep-versions")
+    cert_name = event.get("cert-name")
     domains = event.get("domains", [])
+    elliptic_curve = event.get("elliptic-curve", DEFAULT_ELLIPTIC_CURVE)
     email = event.get("email")
     endpoint = event.get("endpoint", DEFAULT_ENDPOINT)
+    force_renewal = event.get("force-renewal", False)
+    key_type = event.get("key-type", DEFAULT_KEY_TYPE)
+    renewal_window_days = event.get("renewal-window-days", DEFAULT_RENEWAL_WINDOW_DAYS)
     rsa_key_size = event.get("rsa-key-size", DEFAULT_RSA_KEY_SIZE)
     ssm_parameter_prefix = event.get("ssm-parameter-prefix")
     ssm_kms_key = event.get("ssm-kms-key", DEFAULT_SSM_KMS_KEY)
@@ -299,108 +3635,323 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if not agree_tos:
         errors.append("agree-tos must be specified and set to true")
 
-    if not config_store_url:
-        errors.append("config-store-url must be specified")
-    else:
-        m = fullmatch(r"s3://([a-z0-9][-\.a-z0-9]*)/(.*)", config_store_url)
-        if not m:
-            errors.append("config-store-url is not a valid s3:// url")
-        else:
-            config_bucket = m.group(1)
-            config_key = m.group(2)
+    config_store = config_store_from_event(event, errors)
+    targets = acm_targets_from_event(event, errors)
 
     if not domains:
         errors.append("domains not specified or is empty")
+    elif isinstance(domains, str):
+        domains = [domains]
+
+    if not isinstance(renewal_window_days, (int, float)) or renewal_window_days < 0:
+        errors.append(f"renewal-window-days must be a non-negative number: {renewal_window_days}")
+
+    if archive_keep_versions is not None and (not isinstance(archive_keep_versions, int) or archive_keep_versions < 1):
+        errors.append(f"archive-keep-versions must be a positive integer: {archive_keep_versions}")
+
+    if acme_engine not in ACME_ENGINES:
+        errors.append(f"acme-engine must be one of {', '.join(ACME_ENGINES)}: {acme_engine}")
 
     if rsa_key_size not in VALID_RSA_KEY_SIZES:
         errors.append(f"rsa-key-size must be one of {', '.join([str(s) for s in VALID_RSA_KEY_SIZES])}: " f"{rsa_key_size}")
 
+    if isinstance(key_type, list) and len(key_type) == 1:
+        key_type = key_type[0]
+
+    if isinstance(key_type, list):
+        if sorted(key_type) != sorted(VALID_KEY_TYPES):
+            errors.append(f"key-type must be one of {', '.join(VALID_KEY_TYPES)}, or a list of both: {key_type}")
+    elif key_type not in VALID_KEY_TYPES:
+        errors.append(f"key-type must be one of {', '.join(VALID_KEY_TYPES)}, or a list of both: {key_type}")
+
+    if elliptic_curve not in VALID_ELLIPTIC_CURVES:
+        errors.append(f"elliptic-curve must be one of {', '.join(VALID_ELLIPTIC_CURVES)}: {elliptic_curve}")
+
+    for target in targets:
+        arn_field = f"acm-certificate-arn for {target.region}" if target.region else "acm-certificate-arn"
+        if isinstance(target.arn, dict) and not isinstance(key_type, list):
+            errors.append(f"{arn_field} can only be a mapping of key types to ARNs if key-type is a list")
+        elif isinstance(key_type, list) and target.arn and not isinstance(target.arn, dict):
+            errors.append(f"{arn_field} must be a mapping of key types to ARNs if key-type is a list")
+
     if errors:
         raise ValueError("Invalid event: " + "\n".join(errors))
 
-    acm = boto3.client("acm")
-    if acm_certificate_arn or acm_certificate_filters:
-        acm_certificate_arn = find_existing_certificate(acm_certificate_arn, acm_certificate_filters)
+    assert config_store is not None
+    lap_metric("validation")
+
+    if isinstance(key_type, list):
+        return renew_certificate_key_types(event, key_type, challenge_batch)
+
+    key_spec = KeySpec(key_type=key_type, rsa_key_size=rsa_key_size, elliptic_curve=elliptic_curve)
+    lineage = cert_name or lineage_name(domains)
+
+    targets = resolve_acm_targets(key_type_targets(targets, key_spec))
+    multi_region = targets[0].region is not None
+
+    if not force_renewal and all(target.arn for target in targets):
+        # Cheapest check first: if ACM already holds certificates that aren't due, there is nothing to download or run.
+        expiries = [get_acm_certificate_expiry(target.arn, target.region) for target in targets]
+        not_afters = [expiry.not_after for expiry in expiries
+                      if expiry and not certificate_is_due(expiry.not_after, expiry.names, domains, renewal_window_days)]
+        if len(not_afters) == len(targets):
+            print(f"Certificate for {' '.join(domains)} is not due for renewal in ACM until {min(not_afters)}")
+            return {"domains": domains, "status": "not-due", **acm_target_fields(targets), "not-after": min(not_afters).isoformat()}
+
+    lap_metric("acm-lookup")
+
+    # Another invocation renewing from the same config store will have saved the certificate by the time the lease is free,
+    # so this one then finds it current instead of ordering another.
+    with ConfigStoreLease(config_store) as lease:
+        if lease.holder is not None:
+            return busy_result(domains, targets, config_store, lease.holder)
+
+        with WarmWorkspace(f"{config_store.url}#{lineage}", config_store.config_dir) as workspace:
+            certbot_config_dir = workspace.config_dir
+            certbot_work_dir = workspace.work_dir
+            certbot_log_dir = workspace.log_dir
+
+            config_store.restore(certbot_config_dir, lineage, workspace.cached_version)
+            repaired = fixup_config_dir(certbot_config_dir)
+            for relpath in repaired:
+                print(f"Repaired {relpath} in {config_store.url}")
+
+            # The next warm invocation may only reuse this directory as the stored version if it still matches it. Repairs
+            # are kept only if this renewal goes on to save them; otherwise the config is downloaded (and repaired) again.
+            workspace.version = None if repaired else config_store.version
+            lap_metric("restore")
+
+            expiry = get_live_certificate_expiry(certbot_config_dir, domains, lineage)
+            live_is_current = (
+                not force_renewal and expiry is not None and
+                not certificate_is_due(expiry.not_after, expiry.names, domains, renewal_window_days))
+            if live_is_current:
+                assert expiry is not None
+                print(f"Certificate for {' '.join(domains)} is not due for renewal until {expiry.not_after}")
+                if not multi_region and not targets[0].arn:
+                    return {
+                        "domains": domains, "status": "not-due", **acm_target_fields(targets),
+                        "not-after": expiry.not_after.isoformat()}
+
+                # An ACM certificate is missing or due (or the ACM check would have returned), so the live one is published again:
+                # a region without it yet, or an earlier renewal whose import failed after the config was saved.
+
+            journal = None
+            if not live_is_current:
+                # A renewal cut short after its certificate was issued left it in the journal; carry on with it rather than order
+                # another one.
+                journal = resume_renewal(
+                    config_store, certbot_config_dir, lineage, domains, endpoint, key_spec, renewal_window_days)
+
+            issued_cert = journal.certificate if journal is not None else None
+            if not live_is_current and journal is None:
+                # A certificate for exactly these names already exists, so this order is a renewal as far as the CA's limits go.
+                renewal = expiry is not None
+                acme_rate_limiter.load(config_store)
+                retry_at = acme_rate_limiter.admit(endpoint, domains, renewal)
+                if retry_at is not None:
+                    return deferred_result(domains, targets, retry_at)
+
+                try:
+                    if acme_engine == "native":
+                        # Map every domain to its hosted zone up front (failing fast if one is missing), reusing the zone list
+                        # saved alongside the config on a cold start and saving it again if it had to be rebuilt.
+                        hosted_zone_index.load(config_store)
+                        hosted_zone_index.resolve(domains)
+                        hosted_zone_index.save(config_store)
+                        issued_cert = issue_certificate_native(
+                            certbot_config_dir, lineage, domains, endpoint, email, key_spec, challenge_batch)
+                    else:
+                        run_certbot(
+                            certbot_config_dir, certbot_work_dir, certbot_log_dir, lineage, domains, endpoint, email, key_spec)
+                except Exception as e:
+                    limited = rate_limit_error(e)
+                    if limited is None:
+                        raise
+
+                    # The ACME engine may have changed the config (registering an account, say) without it being saved.
+                    workspace.version = None
+                    detail, server_retry_at = limited
+                    log.warning("ACME server rate limited the order for %s: %s", domains, detail)
+                    retry_at = acme_rate_limiter.rate_limited(endpoint, domains, renewal, detail, server_retry_at)
+                    acme_rate_limiter.save(config_store)
+                    return deferred_result(domains, targets, retry_at)
+
+                # Checkpoint the new certificate before anything else can fail, so it isn't lost if the config is never saved.
+                if issued_cert is None:
+                    issued_cert = read_live_certificates(certbot_config_dir, lineage).get(lineage)
+                if issued_cert is not None:
+                    account = load_acme_account(certbot_config_dir, endpoint)
+                    journal = RenewalJournal(
+                        domains=domains, endpoint=endpoint, key_spec=key_spec, account_id=account[0] if account else None,
+                        issued_at=datetime.now(timezone.utc).isoformat(), certificate=issued_cert, completed=[])
+                    try:
+                        write_renewal_journal(config_store, lineage, journal)
+                    except Exception:  # pylint: disable=broad-except
+                        # Carry on regardless: losing the checkpoint only matters if the config can't be saved either.
+                        log.warning("Unable to write the renewal journal for %s", lineage, exc_info=True)
+                        journal = None
+
+                acme_rate_limiter.save(config_store)
+                lap_metric("issue")
+
+            if archive_keep_versions:
+                compact_config_dir(certbot_config_dir, archive_keep_versions)
+                lap_metric("compaction")
+
+            certbot_cert = issued_cert
+            if certbot_cert is None:
+                certbot_cert = read_live_certificates(certbot_config_dir, lineage).get(lineage)
+            if certbot_cert is None:
+                raise ValueError(f"Did not find the live certificate for {lineage} in {config_store.url}")
+
+            # The certificate is in hand, so saving the config and publishing it to ACM and SSM don't depend on each other. One
+            # issuance serves every region; the imports run concurrently, and a region that fails doesn't stop the others.
+            sinks: Dict[str, Callable[[], Any]] = {"save": lambda: config_store.save(certbot_config_dir, certbot_work_dir)}
+            if multi_region:
+                sinks["acm-import"] = lambda: import_acm_certificates(certbot_cert, targets)
+            else:
+                sinks["acm-import"] = lambda: [import_acm_certificate(certbot_cert, targets[0])]
+            if ssm_parameter_prefix:
+                sinks["ssm-publish"] = lambda: publish_ssm_parameters(
+                    ssm_parameters_for_certificate(ssm_parameter_prefix, domains, certbot_cert, ssm_kms_key, ssm_tier))
+
+            published, failed = run_publish_sinks(sinks)
+            import_results = published.get("acm-import", [])
+            completed = [name for name in published if name != "acm-import" or all(r["status"] != "failed" for r in import_results)]
+            if journal is not None and len(completed) < len(sinks):
+                # Keep the journal, noting what was done, until every sink (and every region) has the certificate.
+                try:
+                    write_renewal_journal(config_store, lineage, journal._replace(completed=sorted(completed)))
+                except Exception:  # pylint: disable=broad-except
+                    # The journal written after issuance still holds the certificate; the sink's error is the one to raise.
+                    log.warning("Unable to update the renewal journal for %s", lineage, exc_info=True)
+            elif journal is not None and len(completed) == len(sinks):
+                delete_renewal_journal(config_store, lineage)
+            lap_metric("publish")
+            if failed:
+                raise RuntimeError(
+                    f"Failed to publish the certificate for {' '.join(domains)} to {', '.join(failed)}: " +
+                    "; ".join(f"{name}: {e}" for name, e in failed.items())) from next(iter(failed.values()))
+
+            # Only a committed config is recorded for the next warm invocation to reuse.
+            workspace.version = config_store.version
+
+    if not multi_region:
+        return {"domains": domains, "status": import_results[0]["status"], "certificate-arn": import_results[0]["certificate-arn"]}
+
+    statuses = {result["status"] for result in import_results}
+    status = "failed" if "failed" in statuses else "renewed" if "renewed" in statuses else "unchanged"
+    return {"domains": domains, "status": status, "regions": import_results}
+
+
+def acm_target_fields(targets: List[AcmTarget]) -> Dict[str, Any]:
+    """
+    Return the fields of a renewal result that identify its ACM certificates: the certificate-arn, or for a multi-region
+    renewal, the regions with the certificate-arn of each.
+    """
+    if targets[0].region is None:
+        return {"certificate-arn": targets[0].arn}
 
-    with TemporaryDirectory("certbot") as certbot_base_dir:
-        certbot_config_dir = f"{certbot_base_dir}/config"
-        certbot_work_dir = f"{certbot_base_dir}/work"
-        certbot_log_dir = f"{certbot_base_dir}/log"
-        certbot_config_tarfile = f"{certbot_base_dir}/config.tar.gz"
+    return {"regions": [{"region": target.region, "certificate-arn": target.arn} for target in targets]}
 
-        makedirs(certbot_config_dir)
-        makedirs(certbot_work_dir)
-        makedirs(certbot_log_dir)
 
-        download_certbot_config(config_bucket, config_key, certbot_config_dir, certbot_work_dir)
+def busy_result(
+        domains: List[str], targets: List[AcmTarget], config_store: ConfigStore, holder: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the result for a renewal left to another invocation holding the lease on its config store.
+    """
+    print(f"Leaving the renewal of {' '.join(domains)} to {holder.get('owner')}, which holds the lease on {config_store.url}")
+    return {"domains": domains, "status": "busy", **acm_target_fields(targets), "lease-owner": holder.get("owner")}
 
-        cmd = [
-            "certonly", "--non-interactive", "--preferred-challenges", "dns", "--user-agent-comment", "certbot-to-acm/0.1",
-            "--agree-tos", "--config-dir", certbot_config_dir, "--work-dir", certbot_work_dir, "--logs-dir", certbot_log_dir,
-            "--server", endpoint, "--dns-route53",
-        ]
 
-        if email:
-            cmd += ["--email", email]
-        else:
-            cmd += ["--register-unsafely-without-email"]
+def deferred_result(domains: List[str], targets: List[AcmTarget], retry_at: float) -> Dict[str, Any]:
+    """
+    Return the result for a renewal deferred to stay within the CA's rate limits.
+    """
+    retry_after = datetime.fromtimestamp(retry_at, timezone.utc)
+    print(f"Deferring renewal of {' '.join(domains)} until {retry_after} to stay within ACME rate limits")
+    return {"domains": domains, "status": "deferred", **acm_target_fields(targets), "retry-after": retry_after.isoformat()}
+
+
+def renew_certificate_key_types(
+        event: Dict[str, Any], key_types: List[str], challenge_batch: Optional[DnsChallengeBatch] = None) -> Dict[str, Any]:
+    """
+    Renew one certificate per key type for the same domains, each in its own lineage and ACM certificate. The first key type
+    keeps the default lineage name; the others get a -<key-type> suffix. The certificates are renewed one after the other
+    since they share the stored config.
+    """
+    domains = event["domains"]
+    if isinstance(domains, str):
+        domains = [domains]
+
+    arns = event.get("acm-certificate-arn") or {}
+    filters = event.get("acm-certificate-filters") or {}
+    regions = event.get("acm-regions")
+    base_lineage = event.get("cert-name") or lineage_name(domains)
+    ssm_parameter_prefix = event.get("ssm-parameter-prefix")
 
-        if isinstance(domains, str):
-            domains = [domains]
+    results = []
+    for i, key_type in enumerate(key_types):
+        key_spec = KeySpec(
+            key_type=key_type, rsa_key_size=event.get("rsa-key-size", DEFAULT_RSA_KEY_SIZE),
+            elliptic_curve=event.get("elliptic-curve", DEFAULT_ELLIPTIC_CURVE))
+        key_event = {
+            **event,
+            "key-type": key_type,
+            "cert-name": base_lineage if i == 0 else f"{base_lineage}-{key_type}",
+            "acm-certificate-arn": arns.get(key_type) if isinstance(arns, dict) else None,
+            # Both certificates cover the same domains, so ACM lookups must also match on the key type.
+            "acm-certificate-filters": key_type_filters(filters, key_spec),
+        }
+        if isinstance(regions, list):
+            key_event["acm-regions"] = [key_type_region(entry, key_type, key_spec) for entry in regions]
+        if ssm_parameter_prefix:
+            key_event["ssm-parameter-prefix"] = f"{ssm_parameter_prefix.rstrip('/')}/{key_type}"
+
+        results.append({"key-type": key_type, **perform_renewal(key_event, challenge_batch)})
+
+    statuses = {result["status"] for result in results}
+    if "failed" in statuses:
+        status = "failed"
+    elif "renewed" in statuses:
+        status = "renewed"
+    elif "deferred" in statuses:
+        status = "deferred"
+    elif "busy" in statuses:
+        status = "busy"
+    elif statuses == {"not-due"}:
+        status = "not-due"
+    else:
+        status = "unchanged"
 
-        for domain in domains:
-            cmd += ["--domain", domain]
+    return {"domains": domains, "status": status, "certificates": results}
 
-        result = certbot.main.main(cmd)
-        if result:
-            print(f"certbot command failed: {result}", file=stderr)
-            raise RuntimeError(f"certbot command exited with exit code {result}")
 
-        certbot_cert = create_config_tarfile(certbot_config_dir, certbot_config_tarfile)
-        with open(certbot_config_tarfile, "rb") as fd:
-            s3.put_object(
-                ACL="private", Body=fd, Bucket=config_bucket, Key=config_key, ServerSideEncryption="aws:kms",
-                SSEKMSKeyId=config_store_kms_key)
-        unlink(certbot_config_tarfile)
+def key_type_region(entry: Any, key_type: str, key_spec: KeySpec) -> Any:
+    """
+    Return the acm-regions entry for one key type of a multi-key-type renewal: the region's ARN for that key type, and its
+    filters narrowed to that key type.
+    """
+    if not isinstance(entry, dict):
+        return entry
 
-        acm_args = {}
-        if acm_certificate_arn:
-            acm_args["CertificateArn"] = acm_certificate_arn
-        acm.import_certificate(
-            Certificate=certbot_cert.certificate, CertificateChain=certbot_cert.chain, PrivateKey=certbot_cert.private_key,
-            **acm_args)
+    entry = dict(entry)
+    arn = entry.get("acm-certificate-arn")
+    if isinstance(arn, dict):
+        entry["acm-certificate-arn"] = arn.get(key_type)
+    if entry.get("acm-certificate-filters"):
+        entry["acm-certificate-filters"] = key_type_filters(entry["acm-certificate-filters"], key_spec)
 
-        if ssm_parameter_prefix:
-            if not ssm_parameter_prefix.startswith("/"):
-                ssm_parameter_prefix = "/" + ssm_parameter_prefix
-            if not ssm_parameter_prefix.endswith("/"):
-                ssm_parameter_prefix = ssm_parameter_prefix + "/"
-
-            existing_cert = get_ssm_parameter(f"{ssm_parameter_prefix}cert")
-            existing_chain = get_ssm_parameter(f"{ssm_parameter_prefix}chain")
-            existing_fullchain = get_ssm_parameter(f"{ssm_parameter_prefix}fullchain")
-            existing_key = get_ssm_parameter(f"{ssm_parameter_prefix}key")
-
-            cert = certbot_cert.certificate.decode("utf-8")
-            chain = certbot_cert.chain.decode("utf-8")
-            fullchain = certbot_cert.full_chain.decode("utf-8")
-            key = certbot_cert.private_key.decode("utf-8")
-
-            if existing_cert != cert:
-                ssm.put_parameter(
-                    Name=f"{ssm_parameter_prefix}cert", Description=f"TLS certificate for {' '.join(domains)}", Overwrite=True,
-                    Value=cert, Type="String", Tier=ssm_tier)
-            if existing_chain != chain:
-                ssm.put_parameter(
-                    Name=f"{ssm_parameter_prefix}chain", Description=f"TLS intermediate for {' '.join(domains)}", Overwrite=True,
-                    Value=chain, Type="String", Tier=ssm_tier)
-            if existing_fullchain != fullchain:
-                ssm.put_parameter(
-                    Name=f"{ssm_parameter_prefix}fullchain", Description=f"TLS fullchain for {' '.join(domains)}", Overwrite=True,
-                    Value=fullchain, Type="String", Tier=ssm_tier)
-            if existing_key != key:
-                ssm.put_parameter(
-                    Name=f"{ssm_parameter_prefix}privkey", Description=f"TLS key for {' '.join(domains)}", KeyId=ssm_kms_key,
-                    Overwrite=True, Value=key, Type="SecureString", Tier=ssm_tier)
-
-    return {}
+    return entry
+
+
+def key_type_filters(filters: Dict[str, Any], key_spec: KeySpec) -> Dict[str, Any]:
+    """
+    Return acm-certificate-filters narrowed to one key type of a multi-key-type renewal. The narrowing replaces any key-type
+    filter of the user's, which would otherwise let every key type's renewal find (and overwrite) the same certificate.
+    """
+    return {**filters, "key-type": [acm_key_type(key_spec)]} if filters else {}
+
+
+MODULE_LOAD_MS = round((perf_counter() - MODULE_LOAD_START) * 1000, 1)
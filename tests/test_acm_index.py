@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+from unittest import TestCase
+from unittest.mock import patch
+import index
+
+CERT = index.CertbotCertificate(certificate=b"cert\n", chain=b"chain\n", full_chain=b"cert\nchain\n", private_key=b"key\n")
+FILTERS = {"domain": "a.example.com"}
+
+
+class FakeAcm:
+    def __init__(self, region):
+        self.region = region
+        self.certificates = {}
+        self.key_algorithms = {}
+        self.tags = {}
+        self.imports = []
+
+    def list_certificates(self, **kwargs):
+        return {"CertificateSummaryList": [
+            {"CertificateArn": arn, "DomainName": "a.example.com", "SubjectAlternativeNameSummaries": ["a.example.com"],
+             "KeyAlgorithm": self.key_algorithms.get(arn, "RSA_2048")}
+            for arn in self.certificates]}
+
+    def describe_certificate(self, CertificateArn):
+        return {"Certificate": {
+            "CertificateArn": CertificateArn, "DomainName": "a.example.com", "SubjectAlternativeNames": ["a.example.com"],
+            "Status": "ISSUED", "Type": "IMPORTED",
+            "KeyAlgorithm": self.key_algorithms.get(CertificateArn, "RSA_2048").replace("_", "-")}}
+
+    def import_certificate(self, Certificate, CertificateChain, PrivateKey, CertificateArn=None):
+        arn = CertificateArn or f"arn:aws:acm:{self.region}:123456789012:certificate/{len(self.certificates)}"
+        self.certificates[arn] = Certificate
+        self.imports.append(arn)
+        return {"CertificateArn": arn}
+
+    def add_tags_to_certificate(self, CertificateArn, Tags):
+        self.tags[CertificateArn] = Tags
+
+    def list_tags_for_certificate(self, CertificateArn):
+        return {"Tags": self.tags.get(CertificateArn, [])}
+
+
+class TestAcmCertificateIndex(TestCase):
+    def setUp(self):
+        self.acms = {}
+
+        def get_client(service, region=None):
+            return self.acms.setdefault(region, FakeAcm(region))
+
+        self.patches = [
+            patch.object(index, "get_client", get_client),
+            patch.object(index, "acm_index", index.AcmCertificateIndex()),
+            patch.object(index, "acm_indexes", {}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_new_certificate_is_found(self):
+        self.assertIsNone(index.find_existing_certificate(None, FILTERS))
+        result = index.import_acm_certificate(CERT, index.AcmTarget(None, None, FILTERS))
+        self.assertEqual(result["status"], "renewed")
+
+        # Found without waiting for the index to expire.
+        self.assertEqual(index.find_existing_certificate(None, FILTERS), result["certificate-arn"])
+
+    def test_regions_renewed_twice(self):
+        targets = [index.AcmTarget("us-east-1", None, FILTERS), index.AcmTarget("eu-west-1", None, FILTERS)]
+        first = index.import_acm_certificates(CERT, index.resolve_acm_targets(targets))
+        self.assertEqual([result["status"] for result in first], ["renewed", "renewed"])
+
+        # A warm re-run finds the certificates just imported in each region instead of importing more.
+        resolved = index.resolve_acm_targets(targets)
+        self.assertEqual([target.arn for target in resolved], [result["certificate-arn"] for result in first])
+        second = index.import_acm_certificates(CERT, resolved)
+        self.assertEqual([result["status"] for result in second], ["unchanged", "unchanged"])
+        self.assertEqual({region: len(acm.imports) for region, acm in self.acms.items()}, {"us-east-1": 1, "eu-west-1": 1})
+
+    def test_key_types(self):
+        acm = self.acms[None] = FakeAcm(None)
+        rsa = index.import_acm_certificate(CERT, index.AcmTarget(None, None, FILTERS))["certificate-arn"]
+        ec = acm.import_certificate(Certificate=b"ec", CertificateChain=b"", PrivateKey=b"")["CertificateArn"]
+        acm.key_algorithms[ec] = "EC_prime256v1"
+        index.acm_index.built_at = None
+
+        # Filters without a key type only match the key types ListCertificates returns by default.
+        self.assertEqual(index.find_existing_certificate(None, FILTERS), rsa)
+
+        # An ECDSA renewal looks for its own key type, which the user's filters didn't have to name.
+        ecdsa = index.KeySpec(key_type="ecdsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+        target = index.key_type_targets([index.AcmTarget(None, None, FILTERS)], ecdsa)[0]
+        self.assertEqual(index.find_existing_certificate(None, target.filters), ec)
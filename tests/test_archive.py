@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+from importlib.util import find_spec
+from os.path import dirname
+from tarfile import open as tarfile_open
+from tempfile import TemporaryDirectory
+from unittest import skipUnless, TestCase
+from zipfile import ZipFile
+import index
+
+ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+ACCOUNT_ID = "163d41460d6e33e6772f92a5a732949c"
+RSA_2048 = index.KeySpec(key_type="rsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+OTHER = index.CertbotCertificate(
+    certificate=b"other cert\n", chain=b"other chain\n", full_chain=b"other cert\nother chain\n", private_key=b"other key\n")
+
+
+class TestConfigArchive(TestCase):
+    def setUp(self):
+        self.config_test = TemporaryDirectory()
+        self.config_dir = f"{self.config_test.name}/config"
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(self.config_dir)
+
+        index.fixup_config_dir(self.config_dir)
+        index.install_lineage_version(self.config_dir, "other.kanga.org", OTHER, ACCOUNT_ID, ENDPOINT, RSA_2048)
+
+    def tearDown(self):
+        self.config_test.cleanup()
+
+    def check_archive(self, config_tarfile, certs):
+        self.assertEqual(set(certs), {"test1.kanga.org", "other.kanga.org"})
+        self.assertEqual(certs["other.kanga.org"], OTHER)
+        with open(f"{self.config_dir}/live/test1.kanga.org/fullchain.pem", "rb") as fd:
+            self.assertEqual(certs["test1.kanga.org"].full_chain, fd.read())
+
+        with tarfile_open(config_tarfile, "r:*") as tf:
+            link = tf.getmember("live/other.kanga.org/privkey.pem")
+            self.assertTrue(link.issym())
+            self.assertEqual(link.linkname, "../../archive/other.kanga.org/privkey1.pem")
+            self.assertEqual(tf.extractfile("archive/other.kanga.org/privkey1.pem").read(), OTHER.private_key)
+
+    def test_lineages(self):
+        config_tarfile = f"{self.config_test.name}/config.tar"
+        certs = index.create_config_tarfile(self.config_dir, config_tarfile, "gzip", 1)
+        self.check_archive(config_tarfile, certs)
+        self.assertEqual(index.read_live_certificates(self.config_dir), certs)
+
+    @skipUnless(find_spec("zstandard"), "zstandard is not installed")
+    def test_zstd(self):
+        config_tarfile = f"{self.config_test.name}/config.tar"
+        certs = index.create_config_tarfile(self.config_dir, config_tarfile, "zstd")
+        with open(config_tarfile, "rb") as fd:
+            self.assertEqual(fd.read(4), index.ZSTD_MAGIC)
+
+        decompressed = f"{self.config_test.name}/decompressed.tar"
+        with open(config_tarfile, "rb") as src, open(decompressed, "wb") as dst:
+            index.lazy_import("zstandard").ZstdDecompressor().copy_stream(src, dst)
+        self.check_archive(decompressed, certs)
+
+    def test_invalid_compression(self):
+        errors = []
+        event = {"config-store-url": "s3://bucket/key.tar", "config-store-compression": "gzip",
+                 "config-store-compression-level": 12}
+        self.assertIsNone(index.config_store_from_event(event, errors))
+        self.assertIn("from 1 to 9", errors[0])
+
+        store = index.config_store_from_event({**event, "config-store-compression": "zstd"}, [])
+        self.assertEqual((store.compression, store.compression_level), ("zstd", 12))
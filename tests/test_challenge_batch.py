@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+from threading import Barrier, Thread
+from unittest import TestCase
+from unittest.mock import patch
+import index
+
+
+class TestDnsChallengeBatch(TestCase):
+    def setUp(self):
+        self.changes = []
+        self.batch = None
+        self.unlocked = []
+        patcher = patch.object(index, "change_dns_txt_records", self.record_change)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record_change(self, action, records, wait=True):
+        self.changes.append((action, {name: sorted(values) for name, values in records.items()}))
+        if self.batch is not None:
+            # Other items can still use the batch while Route53 is called.
+            probe = Thread(target=self.probe_condition)
+            probe.start()
+            probe.join()
+
+    def probe_condition(self):
+        acquired = self.batch.condition.acquire(timeout=5)
+        self.unlocked.append(acquired)
+        if acquired:
+            self.batch.condition.release()
+
+    def test_publish_together(self):
+        # A long window: the flush must be triggered by every running item waiting, not by the timeout.
+        batch = index.DnsChallengeBatch(window=30)
+        items = [
+            {"_acme-challenge.a.example.com": ["a"]},
+            {"_acme-challenge.b.example.com": ["b"]},
+            {"_acme-challenge.example.com": ["apex"]},
+            None,
+        ]
+
+        joined = Barrier(len(items))
+
+        def run(records):
+            with batch:
+                joined.wait()
+                if records:
+                    batch.publish(records)
+
+        threads = [Thread(target=run, args=(records,)) for records in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+        self.assertEqual(self.changes, [("UPSERT", {
+            "_acme-challenge.a.example.com": ["a"],
+            "_acme-challenge.b.example.com": ["b"],
+            "_acme-challenge.example.com": ["apex"]})])
+
+    def test_release_shared_name(self):
+        batch = index.DnsChallengeBatch()
+        batch.publish({"_acme-challenge.example.com": ["apex"]})
+        batch.publish({"_acme-challenge.example.com": ["wildcard"]})
+        self.assertEqual(self.changes[-1], ("UPSERT", {"_acme-challenge.example.com": ["apex", "wildcard"]}))
+
+        batch.release({"_acme-challenge.example.com": ["apex"]})
+        self.assertEqual(self.changes[-1], ("UPSERT", {"_acme-challenge.example.com": ["wildcard"]}))
+
+        batch.release({"_acme-challenge.example.com": ["wildcard"]})
+        self.assertEqual(self.changes[-1], ("DELETE", {"_acme-challenge.example.com": ["wildcard"]}))
+        self.assertEqual(batch.results, {})
+
+    def test_route53_called_unlocked(self):
+        self.batch = batch = index.DnsChallengeBatch()
+        batch.publish({"_acme-challenge.example.com": ["apex"]})
+        batch.release({"_acme-challenge.example.com": ["apex"]})
+        self.assertEqual(self.unlocked, [True, True])
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+from os import listdir, readlink
+from os.path import dirname, exists
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from zipfile import ZipFile
+import index
+
+
+class TestCompaction(TestCase):
+    def setUp(self):
+        self.config_test = TemporaryDirectory()
+        self.config_dir = self.config_test.name
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(self.config_dir)
+
+        # Simulate four renewals of the lineage.
+        archive = f"{self.config_dir}/archive/test1.kanga.org"
+        for version in range(2, 6):
+            for filetype in index.ALL_FILETYPES:
+                copyfile(f"{archive}/{filetype}1.pem", f"{archive}/{filetype}{version}.pem")
+
+    def tearDown(self):
+        self.config_test.cleanup()
+
+    def test_compact(self):
+        removed = index.compact_config_dir(self.config_dir, 2)
+        archive = f"{self.config_dir}/archive"
+        live = f"{self.config_dir}/live"
+
+        self.assertEqual(
+            sorted(listdir(f"{archive}/test1.kanga.org")),
+            sorted(f"{filetype}{version}.pem" for filetype in index.ALL_FILETYPES for version in (4, 5)))
+        self.assertIn("archive/test1.kanga.org/cert1.pem", removed)
+
+        for filetype in index.ALL_FILETYPES:
+            self.assertEqual(readlink(f"{live}/test1.kanga.org/{filetype}.pem"), f"../../archive/test1.kanga.org/{filetype}5.pem")
+
+        for n in range(1, 7):
+            self.assertFalse(exists(f"{archive}/test1.kanga.org-{n:04d}"))
+            self.assertIn(f"archive/test1.kanga.org-{n:04d}", removed)
+
+        with open(f"{self.config_dir}/renewal/test1.kanga.org.conf", "r") as fd:
+            conf = fd.read()
+
+        self.assertIn(f"archive_dir = {archive}/test1.kanga.org\n", conf)
+        self.assertIn(f"cert = {live}/test1.kanga.org/cert.pem\n", conf)
+        self.assertIn(f"fullchain = {live}/test1.kanga.org/fullchain.pem\n", conf)
+        self.assertIn("account = 163d41460d6e33e6772f92a5a732949c\n", conf)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+from fcntl import LOCK_EX, lockf
+from json import loads as json_loads
+from os import listdir, unlink
+from os.path import dirname, isdir
+from subprocess import run
+from sys import executable
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from zipfile import ZipFile
+import index
+
+ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+ACCOUNT_ID = "163d41460d6e33e6772f92a5a732949c"
+RSA_2048 = index.KeySpec(key_type="rsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+OTHER = index.CertbotCertificate(
+    certificate=b"other cert\n", chain=b"other chain\n", full_chain=b"other cert\nother chain\n", private_key=b"other key\n")
+
+# Run in a separate process, since a process never conflicts with its own locks.
+ACQUIRE_LEASE = """
+import index, json, sys
+store = index.config_store_from_event({"config-store-url": sys.argv[1]}, [])
+print(json.dumps(store.acquire_lease("child", 60)))
+"""
+
+
+class TestFilesystemConfigStore(TestCase):
+    def setUp(self):
+        self.test_dir = TemporaryDirectory()
+        self.root = self.test_dir.name
+        self.url = f"file://{self.root}/store/test1"
+        self.store = index.config_store_from_event({"config-store-url": self.url}, [])
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_factory(self):
+        self.assertIsInstance(self.store, index.FilesystemConfigStore)
+        self.assertEqual(self.store.config_dir, f"{self.root}/store/test1")
+
+        for url in ("file://host/certbot", "file:///", "ftp://host/certbot.tar.gz"):
+            errors = []
+            self.assertIsNone(index.config_store_from_event({"config-store-url": url}, errors))
+            self.assertEqual(len(errors), 1)
+
+    def test_mirror_round_trip(self):
+        config_dir = f"{self.root}/config"
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(config_dir)
+
+        index.fixup_config_dir(config_dir)
+        self.assertFalse(self.store.restore(f"{self.root}/empty", None))
+        self.store.save(config_dir, None)
+
+        # Compact a copy, as compact_handler does, and mirror it back.
+        copy_dir = f"{self.root}/copy"
+        self.assertTrue(self.store.restore(copy_dir, None))
+        self.assertEqual(index.scan_config_tree(copy_dir), index.scan_config_tree(config_dir))
+        index.install_lineage_version(copy_dir, "other.kanga.org", OTHER, ACCOUNT_ID, ENDPOINT, RSA_2048)
+        unlink(f"{copy_dir}/live/test1.kanga.org/README")
+        index.compact_config_dir(copy_dir, 1)
+
+        certs = self.store.save(copy_dir, None)
+        self.assertEqual(certs["other.kanga.org"], OTHER)
+        self.assertEqual(index.scan_config_tree(self.store.path), index.scan_config_tree(copy_dir))
+        self.assertEqual(
+            isdir(f"{self.store.path}/archive/test1.kanga.org-0001"), isdir(f"{copy_dir}/archive/test1.kanga.org-0001"))
+
+    def test_sidecars_and_lease(self):
+        self.assertFalse(self.store.restore(self.store.path, None))
+        self.assertIsNone(self.store.read_sidecar("acme-rate-limits.json"))
+        self.store.write_sidecar("acme-rate-limits.json", b"{}")
+        self.assertEqual(self.store.read_sidecar("acme-rate-limits.json"), b"{}")
+
+        # Sidecars stay inside the store (its parent may not be writable) without becoming part of the config.
+        self.assertEqual(listdir(f"{self.root}/store"), ["test1"])
+        self.assertFalse(self.store.restore(self.store.path, None))
+        self.assertEqual(index.scan_config_tree(self.store.path), ({}, {}))
+        index.mirror_config_tree(f"{self.root}/store/none", self.store.path)
+        self.assertEqual(self.store.read_sidecar("acme-rate-limits.json"), b"{}")
+        self.store.delete_sidecar("acme-rate-limits.json")
+        self.store.delete_sidecar("acme-rate-limits.json")
+        self.assertIsNone(self.store.read_sidecar("acme-rate-limits.json"))
+
+        def child_acquire():
+            result = run([executable, "-c", ACQUIRE_LEASE, self.url], capture_output=True, text=True, check=True,
+                         cwd=dirname(dirname(__file__)))
+            return json_loads(result.stdout.splitlines()[-1])
+
+        self.assertIsNone(self.store.acquire_lease("parent", 60))
+        self.assertEqual(child_acquire(), {"owner": "parent"})
+        self.store.release_lease("parent")
+        self.assertIsNone(child_acquire())
+
+        # A lease file caught part way through being written is still held.
+        with open(self.store.sidecar_path("config.lease.json"), "w") as fd:
+            fd.write('{"own')
+            fd.flush()
+            lockf(fd.fileno(), LOCK_EX)
+            self.assertEqual(child_acquire(), {"owner": None})
+
+    def test_lock_shared_by_urls(self):
+        # Another spelling of the same store in this process must queue on the same lock, since its lease file lock wouldn't
+        # keep it out.
+        other = index.config_store_from_event({"config-store-url": f"file://localhost{self.root}/store/./test1"}, [])
+        self.assertEqual(other.lock_key, self.store.lock_key)
+        self.assertIs(index.ConfigStoreLease(other).lock, index.ConfigStoreLease(self.store).lock)
@@ -99,4 +99,32 @@ def gid_to_groupname(gid: int) -> str:
     try:
         return getgrgid(gid).gr_name
     except KeyError:
-        return str(gid)
\ No newline at end of file
+        return str(gid)
+
+
+class TestFixupMerge(TestCase):
+    def setUp(self):
+        self.config_test = TemporaryDirectory()
+        self.config_dir = self.config_test.name
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(self.config_dir)
+
+    def tearDown(self):
+        self.config_test.cleanup()
+
+    def test_distinct_certificate_is_kept(self):
+        # A moved lineage holding a certificate the canonical lineage doesn't have becomes its newest version.
+        moved_cert = f"{self.config_dir}/archive/test1.kanga.org-0006/cert1.pem"
+        with open(moved_cert, "ab") as fd:
+            fd.write(b"\n")
+
+        index.fixup_config_dir(self.config_dir)
+        self.assertEqual(sorted(index.lineage_versions(self.config_dir, "test1.kanga.org")), [1, 2])
+        self.assertEqual(
+            readlink(f"{self.config_dir}/live/test1.kanga.org/cert.pem"), "../../archive/test1.kanga.org/cert2.pem")
+
+        with open(f"{self.config_dir}/renewal/test1.kanga.org.conf", "r") as fd:
+            self.assertIn(f"archive_dir = {self.config_dir}/archive/test1.kanga.org\n", fd.read())
+
+        # A second pass finds nothing left to do.
+        self.assertEqual(index.fixup_config_dir(self.config_dir), [])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+from time import time
+from unittest import TestCase
+import index
+
+ZONES = {"example.com.": "/hostedzone/Z1", "sub.example.com.": "/hostedzone/Z2", "example.org.": "/hostedzone/Z3"}
+
+
+class SidecarStore(index.ConfigStore):
+    def __init__(self):
+        super().__init__("memory://test")
+        self.sidecars = {}
+
+    def restore(self, config_dir, lineage, cached_version=None):
+        return False
+
+    def save(self, config_dir, work_dir):
+        return {}
+
+    def read_sidecar(self, name):
+        return self.sidecars.get(name)
+
+    def write_sidecar(self, name, data):
+        self.sidecars[name] = data
+
+    def delete_sidecar(self, name):
+        self.sidecars.pop(name, None)
+
+
+class TestHostedZoneIndex(TestCase):
+    def test_longest_suffix(self):
+        zones = index.HostedZoneIndex()
+        zones.set_zones(ZONES, time())
+
+        self.assertEqual(zones.find("_acme-challenge.www.example.com"), "/hostedzone/Z1")
+        self.assertEqual(zones.find("_acme-challenge.a.sub.example.com."), "/hostedzone/Z2")
+        self.assertEqual(zones.find("sub.example.com"), "/hostedzone/Z2")
+        self.assertEqual(zones.resolve(["*.example.org", "EXAMPLE.COM"]),
+                         {"*.example.org": "/hostedzone/Z3", "EXAMPLE.COM": "/hostedzone/Z1"})
+
+    def test_persist(self):
+        store = SidecarStore()
+        zones = index.HostedZoneIndex()
+        zones.set_zones(ZONES, time() - 60)
+        zones.unsaved = True
+        zones.save(store)
+        self.assertIn(index.ROUTE53_ZONE_INDEX_SIDECAR, store.sidecars)
+
+        cold = index.HostedZoneIndex()
+        cold.load(store)
+        self.assertEqual(cold.find("www.sub.example.com"), "/hostedzone/Z2")
+
+        # A saved list past the TTL is ignored.
+        expired = index.HostedZoneIndex(ttl=30)
+        expired.load(store)
+        self.assertIsNone(expired.built_at)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+from datetime import datetime, timedelta, timezone
+from os.path import dirname
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from zipfile import ZipFile
+import index
+
+ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+ACCOUNT_ID = "163d41460d6e33e6772f92a5a732949c"
+DOMAINS = ["test1.kanga.org"]
+ECDSA_P256 = index.KeySpec(key_type="ecdsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+
+
+class SidecarStore(index.ConfigStore):
+    def __init__(self):
+        super().__init__("s3://bucket/test1.tar.gz")
+        self.sidecars = {}
+
+    def restore(self, config_dir, lineage, cached_version=None):
+        return False
+
+    def save(self, config_dir, work_dir):
+        return {}
+
+    def read_sidecar(self, name):
+        return self.sidecars.get(name)
+
+    def write_sidecar(self, name, data):
+        self.sidecars[name] = data
+
+    def delete_sidecar(self, name):
+        self.sidecars.pop(name, None)
+
+
+def make_certificate(days_left):
+    """
+    Return a self-signed certificate for DOMAINS expiring in the given number of days.
+    """
+    x509 = index.lazy_import("cryptography.x509")
+    hashes = index.lazy_import("cryptography.hazmat.primitives.hashes")
+    serialization = index.lazy_import("cryptography.hazmat.primitives.serialization")
+
+    private_key = index.generate_private_key(ECDSA_P256)
+    key = serialization.load_pem_private_key(private_key, password=None)
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, DOMAINS[0])])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=days_left))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain) for domain in DOMAINS]), critical=False)
+        .sign(key, hashes.SHA256()))
+
+    certificate = cert.public_bytes(serialization.Encoding.PEM)
+    return index.CertbotCertificate(certificate=certificate, chain=b"", full_chain=certificate, private_key=private_key)
+
+
+class TestRenewalJournal(TestCase):
+    def setUp(self):
+        self.config_test = TemporaryDirectory()
+        self.config_dir = self.config_test.name
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(self.config_dir)
+
+        self.store = SidecarStore()
+
+    def tearDown(self):
+        self.config_test.cleanup()
+
+    def journal(self, cert, key_spec=ECDSA_P256):
+        return index.RenewalJournal(
+            domains=DOMAINS, endpoint=ENDPOINT, key_spec=key_spec, account_id=ACCOUNT_ID,
+            issued_at="2026-10-17T00:00:00+00:00", certificate=cert, completed=["acm-import"])
+
+    def resume(self):
+        return index.resume_renewal(self.store, self.config_dir, "test1.kanga.org", DOMAINS, ENDPOINT, ECDSA_P256, 30)
+
+    def test_resume_installs_certificate(self):
+        cert = make_certificate(90)
+        index.write_renewal_journal(self.store, "test1.kanga.org", self.journal(cert))
+        self.assertEqual(list(self.store.sidecars), ["test1.tar.gz.test1.kanga.org.journal.json"])
+
+        self.assertEqual(self.resume(), self.journal(cert))
+        self.assertEqual(index.read_live_certificates(self.config_dir, "test1.kanga.org"), {"test1.kanga.org": cert})
+        versions = index.lineage_versions(self.config_dir, "test1.kanga.org")
+
+        # Resuming again (the config having been saved this time) doesn't install another version.
+        self.resume()
+        self.assertEqual(index.lineage_versions(self.config_dir, "test1.kanga.org"), versions)
+
+    def test_stale_journal_is_discarded(self):
+        index.write_renewal_journal(self.store, "test1.kanga.org", self.journal(make_certificate(10)))
+        self.assertIsNone(self.resume())
+        self.assertEqual(self.store.sidecars, {})
+
+        index.write_renewal_journal(self.store, "test1.kanga.org", self.journal(make_certificate(90), key_spec=index.KeySpec(
+            key_type="rsa", rsa_key_size=2048, elliptic_curve="secp256r1")))
+        self.assertIsNone(self.resume())
+        self.assertEqual(self.store.sidecars, {})
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+from threading import Thread
+from time import time
+from unittest import TestCase
+from unittest.mock import patch
+import index
+
+
+class LeaseStore(index.ConfigStore):
+    def __init__(self, url="s3://bucket/leased.tar.gz"):
+        super().__init__(url)
+        self.owner = None
+        self.expires = 0.0
+        self.released = []
+
+    def restore(self, config_dir, lineage, cached_version=None):
+        return False
+
+    def save(self, config_dir, work_dir):
+        return {}
+
+    def read_sidecar(self, name):
+        return None
+
+    def write_sidecar(self, name, data):
+        pass
+
+    def delete_sidecar(self, name):
+        pass
+
+    def acquire_lease(self, owner, ttl):
+        if self.owner is not None and self.expires > time():
+            return {"owner": self.owner, "expires": self.expires}
+
+        self.owner = owner
+        self.expires = time() + ttl
+        return None
+
+    def release_lease(self, owner):
+        self.released.append(owner)
+        if self.owner == owner:
+            self.owner = None
+
+
+class FakeS3:
+    def __init__(self, error_code=None):
+        self.error_code = error_code
+        self.calls = []
+
+    def put_object(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error_code:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": self.error_code}}, "PutObject")
+        return {"ETag": '"new"'}
+
+    def delete_object(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error_code:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": self.error_code}}, "DeleteObject")
+        return {}
+
+
+class TestConfigStoreLease(TestCase):
+    def test_lease_held_elsewhere(self):
+        store = LeaseStore()
+        store.lease_wait = 0
+        store.owner, store.expires = "other-invocation", time() + 60
+
+        with index.ConfigStoreLease(store) as lease:
+            self.assertFalse(lease.held)
+            self.assertEqual(lease.holder["owner"], "other-invocation")
+
+        self.assertEqual(store.released, [])
+
+        # Once the holder's lease expires, it can be taken over.
+        store.expires = time() - 1
+        with index.ConfigStoreLease(store) as lease:
+            self.assertTrue(lease.held)
+            self.assertEqual(store.owner, lease.owner)
+
+        self.assertEqual(store.released, [lease.owner])
+        self.assertIsNone(store.owner)
+
+    def test_renewals_in_container_queue(self):
+        store = LeaseStore("s3://bucket/queued.tar.gz")
+        store.lease_wait = 0
+        other = LeaseStore(store.url)
+        other.lease_wait = 0
+        order = []
+
+        def second_renewal():
+            # Queued behind the first renewal for longer than the lease wait, but never turned away.
+            with index.ConfigStoreLease(other) as second:
+                order.append(("second", second.held))
+
+        with index.ConfigStoreLease(store) as first:
+            thread = Thread(target=second_renewal)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            order.append(("first", first.held))
+
+        thread.join(5)
+        self.assertEqual(order, [("first", True), ("second", True)])
+
+
+class TestConfigStoreInterface(TestCase):
+    def test_incomplete_store_is_rejected(self):
+        class NoSidecars(index.ConfigStore):
+            def restore(self, config_dir, lineage, cached_version=None):
+                return False
+
+            def save(self, config_dir, work_dir):
+                return {}
+
+        with self.assertRaises(TypeError):
+            NoSidecars("s3://bucket/incomplete.tar.gz")
+
+
+class TestConditionalSave(TestCase):
+    def put_config(self, s3, version):
+        store = index.S3TarConfigStore("s3://bucket/config.tar.gz", "bucket", "config.tar.gz", "alias/aws/s3")
+        store.version = version
+        with patch.object(index, "get_client", lambda service, region=None: s3), \
+                patch.object(index, "s3_conditional_writes", lambda: True):
+            return store.put_config(Body=b"config")
+
+    def test_conditions(self):
+        s3 = FakeS3()
+        self.put_config(s3, '"restored"')
+        self.put_config(s3, None)
+        self.assertEqual(s3.calls[0]["IfMatch"], '"restored"')
+        self.assertEqual(s3.calls[1]["IfNoneMatch"], "*")
+        self.assertNotIn("IfMatch", s3.calls[1])
+
+    def test_stale_save_is_rejected(self):
+        with self.assertRaises(RuntimeError) as cm:
+            self.put_config(FakeS3("PreconditionFailed"), '"restored"')
+
+        self.assertIn("saved by another invocation", str(cm.exception))
+
+
+class TestS3LeaseRelease(TestCase):
+    def release_lease(self, s3):
+        store = index.S3TarConfigStore("s3://bucket/config.tar.gz", "bucket", "config.tar.gz", "alias/aws/s3")
+        store.lease_version = '"leased"'
+        with patch.object(index, "get_client", lambda service, region=None: s3), \
+                patch.object(index, "s3_conditional_writes", lambda: True):
+            store.release_lease("owner")
+
+    def test_release_is_conditional(self):
+        s3 = FakeS3()
+        self.release_lease(s3)
+        self.assertEqual(s3.calls, [{"Bucket": "bucket", "Key": s3.calls[0]["Key"], "IfMatch": '"leased"'}])
+
+    def test_lease_taken_over(self):
+        for code in ("PreconditionFailed", "NoSuchKey"):
+            with self.assertLogs(index.log, "WARNING"):
+                self.release_lease(FakeS3(code))
+
+        from botocore.exceptions import ClientError
+        with self.assertRaises(ClientError):
+            self.release_lease(FakeS3("AccessDenied"))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from json import loads as json_loads
+from unittest import TestCase
+import index
+
+
+class TestRenewalMetrics(TestCase):
+    def test_phases_and_counters(self):
+        metrics = index.RenewalMetrics()
+        with metrics:
+            index.lap_metric("validation")
+            with index.Phase("s3-download"):
+                index.count_metric("s3-download-bytes", 100)
+
+            # Work handed to a thread pool still counts against the renewal.
+            with ThreadPoolExecutor(max_workers=2) as tpe:
+                for future in [tpe.submit(index.bind_metrics(index.count_metric), "s3-download-bytes", 10) for _ in range(3)]:
+                    future.result()
+
+            index.lap_metric("restore")
+
+        # Outside the renewal, nothing is recorded.
+        index.count_metric("s3-download-bytes", 1000)
+        self.assertIsNone(index.current_metrics())
+
+        summary = metrics.summary()
+        self.assertEqual(set(summary["phases-ms"]), {"validation", "s3-download", "restore"})
+        self.assertEqual(summary["counts"], {"s3-download-bytes": 130})
+
+    def test_emit(self):
+        metrics = index.RenewalMetrics()
+        metrics.add_phase("issue", 12.5)
+        metrics.add("s3-upload-bytes", 2048)
+        metrics.add_api_call("s3:PutObject")
+
+        output = StringIO()
+        with redirect_stdout(output):
+            metrics.emit({"AcmeEngine": "native", "Status": "renewed"}, {"Domains": "a.example.com"})
+
+        line = json_loads(output.getvalue())
+        directive = line["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(directive["Dimensions"], [["AcmeEngine", "Status"]])
+        units = {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]}
+        self.assertEqual(units["issue-ms"], "Milliseconds")
+        self.assertEqual(units["s3-upload-bytes"], "Bytes")
+        self.assertEqual(line["issue-ms"], 12.5)
+        self.assertEqual(line["api-calls"], 1)
+        self.assertEqual(line["Status"], "renewed")
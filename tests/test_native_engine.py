@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from os import readlink, stat
+from os.path import dirname
+from stat import S_IMODE
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from zipfile import ZipFile
+import index
+
+ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+ACCOUNT_ID = "163d41460d6e33e6772f92a5a732949c"
+LEAF = b"-----BEGIN CERTIFICATE-----\nleaf\n-----END CERTIFICATE-----\n"
+INTERMEDIATE = b"-----BEGIN CERTIFICATE-----\nintermediate\n-----END CERTIFICATE-----\n"
+RSA_2048 = index.KeySpec(key_type="rsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+ECDSA_P384 = index.KeySpec(key_type="ecdsa", rsa_key_size=2048, elliptic_curve="secp384r1")
+
+
+class TestNativeEngine(TestCase):
+    def setUp(self):
+        self.config_test = TemporaryDirectory()
+        self.config_dir = self.config_test.name
+        with ZipFile(f"{dirname(__file__)}/fixtest.zip", "r") as z:
+            z.extractall(self.config_dir)
+
+    def tearDown(self):
+        self.config_test.cleanup()
+
+    def test_split_full_chain(self):
+        self.assertEqual(index.split_full_chain(LEAF + INTERMEDIATE), (LEAF, INTERMEDIATE))
+
+    def test_load_certbot_account(self):
+        account_id, key, regr = index.load_acme_account(self.config_dir, ENDPOINT)
+        self.assertEqual(account_id, ACCOUNT_ID)
+        self.assertEqual(regr.uri, "https://acme-staging-v02.api.letsencrypt.org/acme/acct/15707114")
+        self.assertIsNone(index.load_acme_account(self.config_dir, index.PRODUCTION_ENDPOINT))
+
+        # Saving the same key must reproduce certbot's account id.
+        with TemporaryDirectory() as other_dir:
+            self.assertEqual(index.save_acme_account(other_dir, ENDPOINT, key, regr), ACCOUNT_ID)
+            self.assertEqual(index.load_acme_account(other_dir, ENDPOINT)[0], ACCOUNT_ID)
+
+    def test_install_lineage_version(self):
+        cert = index.CertbotCertificate(
+            certificate=LEAF, chain=INTERMEDIATE, full_chain=LEAF + INTERMEDIATE, private_key=b"key\n")
+        version = index.install_lineage_version(self.config_dir, "test1.kanga.org", cert, ACCOUNT_ID, ENDPOINT, RSA_2048)
+        self.assertEqual(version, 2)
+
+        live = f"{self.config_dir}/live/test1.kanga.org"
+        self.assertEqual(readlink(f"{live}/privkey.pem"), "../../archive/test1.kanga.org/privkey2.pem")
+        self.assertEqual(S_IMODE(stat(f"{live}/privkey.pem").st_mode), 0o600)
+        with open(f"{live}/fullchain.pem", "rb") as fd:
+            self.assertEqual(fd.read(), LEAF + INTERMEDIATE)
+
+        with open(f"{self.config_dir}/renewal/test1.kanga.org.conf", "r") as fd:
+            self.assertIn(f"cert = {live}/cert.pem\n", fd.read())
+
+    def test_install_new_lineage(self):
+        cert = index.CertbotCertificate(
+            certificate=LEAF, chain=INTERMEDIATE, full_chain=LEAF + INTERMEDIATE, private_key=b"key\n")
+        version = index.install_lineage_version(
+            self.config_dir, "new.kanga.org-ecdsa", cert, ACCOUNT_ID, ENDPOINT, ECDSA_P384)
+        self.assertEqual(version, 1)
+
+        with open(f"{self.config_dir}/renewal/new.kanga.org-ecdsa.conf", "r") as fd:
+            conf = fd.read()
+
+        self.assertIn(f"account = {ACCOUNT_ID}\n", conf)
+        self.assertIn("key_type = ecdsa\nelliptic_curve = secp384r1\n", conf)
+        self.assertIn(f"archive_dir = {self.config_dir}/archive/new.kanga.org-ecdsa\n", conf)
+
+    def test_generate_ecdsa_key(self):
+        serialization = index.lazy_import("cryptography.hazmat.primitives.serialization")
+        key = serialization.load_pem_private_key(index.generate_private_key(ECDSA_P384), password=None)
+        self.assertEqual(key.curve.name, "secp384r1")
+        self.assertEqual(index.acm_key_type(ECDSA_P384), "EC_secp384r1")
+        self.assertEqual(index.certbot_key_args(RSA_2048), ["--key-type", "rsa", "--rsa-key-size", "2048"])
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+from threading import Barrier
+from unittest import TestCase
+import index
+
+
+class TestPublishSinks(TestCase):
+    def test_sinks_overlap(self):
+        # Each sink waits for the others, so this only finishes if they all run at once.
+        barrier = Barrier(3, timeout=5)
+        metrics = index.RenewalMetrics()
+        with metrics:
+            published, failed = index.run_publish_sinks({name: barrier.wait for name in ("save", "acm-import", "ssm-publish")})
+
+        self.assertEqual(failed, {})
+        self.assertEqual(set(published), {"save", "acm-import", "ssm-publish"})
+        self.assertTrue({"save", "acm-import", "ssm-publish"} <= set(metrics.summary()["phases-ms"]))
+
+    def test_failure_does_not_stop_save(self):
+        saved = []
+
+        def fail():
+            raise RuntimeError("ThrottlingException")
+
+        published, failed = index.run_publish_sinks({"save": lambda: saved.append(True) or "v2", "acm-import": fail})
+        self.assertEqual(saved, [True])
+        self.assertEqual(published, {"save": "v2"})
+        self.assertEqual(list(failed), ["acm-import"])
+        self.assertEqual(str(failed["acm-import"]), "ThrottlingException")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+from unittest import TestCase
+import index
+
+ENDPOINT = "https://acme-staging-v02.api.letsencrypt.org/directory"
+
+
+class RateLimitedError(Exception):
+    typ = "urn:ietf:params:acme:error:rateLimited"
+    detail = ("too many certificates (5) already issued for this exact set of domains in the last 168h0m0s, "
+              "retry after 2030-01-15 18:48:41 UTC: see https://letsencrypt.org/docs/rate-limits/")
+
+
+class TestRateLimits(TestCase):
+    def test_registered_domain(self):
+        self.assertEqual(index.registered_domain("*.www.example.com"), "example.com")
+        self.assertEqual(index.registered_domain("a.b.example.co.uk."), "example.co.uk")
+
+    def test_duplicate_limit(self):
+        limiter = index.AcmeRateLimiter()
+        domains = ["a.example.com", "b.example.com"]
+        for _ in range(5):
+            self.assertIsNone(limiter.admit(ENDPOINT, domains, True))
+
+        self.assertIsNotNone(limiter.admit(ENDPOINT, domains, True))
+        self.assertIsNone(limiter.admit(ENDPOINT, ["c.example.com"], False))
+
+    def test_server_retry_after(self):
+        try:
+            try:
+                raise RateLimitedError()
+            except RateLimitedError as e:
+                raise RuntimeError("certbot failed") from e
+        except RuntimeError as e:
+            detail, retry_at = index.rate_limit_error(e)
+
+        self.assertIn("exact set of domains", detail)
+        self.assertEqual(retry_at, 1894733321.0)
+        self.assertIsNone(index.rate_limit_error(RuntimeError("certbot command exited with exit code 1")))
+
+        limiter = index.AcmeRateLimiter()
+        self.assertEqual(limiter.rate_limited(ENDPOINT, ["a.example.com"], True, detail, retry_at), retry_at)
+        self.assertEqual(limiter.admit(ENDPOINT, ["a.example.com"], True), retry_at)
+        self.assertIsNone(limiter.admit(ENDPOINT, ["b.example.com"], True))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+from unittest import TestCase
+from unittest.mock import patch
+import index
+
+CERT = index.CertbotCertificate(certificate=b"cert\n", chain=b"chain\n", full_chain=b"cert\nchain\n", private_key=b"key\n")
+EU_ARN = "arn:aws:acm:eu-west-1:123456789012:certificate/eu"
+
+
+class TestAcmRegions(TestCase):
+    def test_targets(self):
+        errors = []
+        event = {
+            "acm-certificate-filters": {"domain": "a.example.com"},
+            "acm-regions": ["us-east-1", {"region": "eu-west-1", "acm-certificate-arn": EU_ARN}],
+        }
+        targets = index.acm_targets_from_event(event, errors)
+        self.assertEqual(errors, [])
+        self.assertEqual(targets, [
+            index.AcmTarget(region="us-east-1", arn=None, filters={"domain": "a.example.com"}),
+            index.AcmTarget(region="eu-west-1", arn=EU_ARN, filters={}),
+        ])
+
+        # Without acm-regions, there is a single target in the function's own region.
+        self.assertEqual(
+            index.acm_targets_from_event({"acm-certificate-arn": EU_ARN}, errors), [index.AcmTarget(None, EU_ARN, {})])
+
+    def test_invalid_targets(self):
+        errors = []
+        index.acm_targets_from_event(
+            {"acm-certificate-arn": EU_ARN, "acm-regions": ["us-east-1", "us-east-1", "Europe", {"region": "eu-west-2"}]},
+            errors)
+        self.assertEqual(len(errors), 5)
+        self.assertIn("can't be used with acm-regions", errors[0])
+        self.assertIn("more than once", errors[2])
+        self.assertIn("region name", errors[3])
+        self.assertIn("eu-west-2 needs", errors[4])
+
+    def test_failed_region_is_isolated(self):
+        def import_acm_certificate(certbot_cert, target):
+            if target.region == "eu-west-1":
+                raise RuntimeError("AccessDenied")
+            return {"region": target.region, "status": "renewed", "certificate-arn": "arn:new"}
+
+        targets = [index.AcmTarget("us-east-1", None, {"domain": "a.example.com"}), index.AcmTarget("eu-west-1", EU_ARN, {})]
+        with patch.object(index, "import_acm_certificate", import_acm_certificate):
+            results = index.import_acm_certificates(CERT, targets)
+
+        self.assertEqual(results[0], {"region": "us-east-1", "status": "renewed", "certificate-arn": "arn:new"})
+        self.assertEqual(
+            results[1], {"region": "eu-west-1", "status": "failed", "certificate-arn": EU_ARN, "error": "AccessDenied"})
+
+    def test_key_type_filters(self):
+        ecdsa = index.KeySpec(key_type="ecdsa", rsa_key_size=2048, elliptic_curve="secp256r1")
+        entry = {"region": "eu-west-1", "acm-certificate-filters": {"domain": "a.example.com", "key-type": "RSA_2048"}}
+
+        # A key-type filter of the user's can't point both key types' renewals at the same certificate.
+        self.assertEqual(index.key_type_region(entry, "ecdsa", ecdsa)["acm-certificate-filters"],
+                         {"domain": "a.example.com", "key-type": ["EC_prime256v1"]})
+        self.assertEqual(index.key_type_filters({}, ecdsa), {})
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+from json import dumps as json_dumps
+from unittest import TestCase
+import index
+
+
+class TestScheduler(TestCase):
+    def test_unchecked_certificates_are_due(self):
+        self.assertTrue(index.certificate_spec_is_due({"domains": ["a.example.com"]}))
+        self.assertTrue(index.certificate_spec_is_due({"domains": ["a.example.com"], "force-renewal": True}))
+        self.assertTrue(index.certificate_spec_is_due(
+            {"domains": ["a.example.com"], "key-type": ["rsa", "ecdsa"], "acm-certificate-filters": {"domain": "a.example.com"}}))
+
+    def test_invalid_schedule(self):
+        with self.assertRaises(ValueError) as cm:
+            index.schedule_renewals({"inventory-url": "s3://bucket/inventory.json", "dispatch": "sqs", "batch-size": 0}, None)
+
+        self.assertIn("batch-size", str(cm.exception))
+        self.assertIn("queue-url", str(cm.exception))
+
+    def test_failed_messages_are_reported(self):
+        event = {"Records": [
+            {"messageId": "1", "body": json_dumps({"domains": ["a.example.com"]})},
+            {"messageId": "2", "body": "not json"},
+        ]}
+        result = index.renew_certificate_messages(event)
+        self.assertEqual(result["batchItemFailures"], [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}])
+        self.assertIn("agree-tos", result["results"][0]["error"])
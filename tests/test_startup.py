@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+from json import loads as json_loads
+from os.path import dirname
+from subprocess import run
+from sys import executable
+from unittest import TestCase
+
+# Cold-start import budget for index.py. Importing it should only pull in the standard library; boto3, botocore, certbot, and
+# cryptography are imported lazily when first needed. Keep this well above the measured time (roughly 30 ms on a developer
+# laptop) so that only real regressions, such as a heavy top-level import, trip it.
+IMPORT_BUDGET_MS = 150
+HEAVY_MODULES = ("boto3", "botocore", "certbot", "cryptography", "josepy", "acme")
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import index
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({"elapsed": elapsed, "modules": sorted(m.split(".")[0] for m in sys.modules)}))
+"""
+
+
+class TestStartup(TestCase):
+    def import_index(self):
+        result = run([executable, "-c", IMPORT_SCRIPT], cwd=dirname(dirname(__file__)), capture_output=True, check=True)
+        return json_loads(result.stdout)
+
+    def test_no_heavy_imports(self):
+        modules = set(self.import_index()["modules"])
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules, f"index imports {module} at module load")
+
+    def test_import_budget(self):
+        # Take the best of a few runs to filter out scheduling noise.
+        elapsed = min(self.import_index()["elapsed"] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET_MS, f"importing index took {elapsed:.1f} ms (budget {IMPORT_BUDGET_MS} ms)")